@@ -1,17 +1,26 @@
 import getpass
+import os
 import re
+import tempfile
+import threading
+import time
+from dataclasses import replace
 from http import HTTPStatus
-from os.path import join
-from typing import Dict
+from os.path import exists, join
+from typing import IO, Dict, Optional, Tuple
+from urllib.parse import urlparse
 
 import keyring
 import requests
 
 from exceptions import (AtsSiteError, DownloadFileError, LogError,
                         PartPasswordNotDefinedError, SavingFileError)
+from http_loader import (HttpLoader, RemoteFile, get_conditional_headers,
+                         is_unchanged)
+from page_cache import CachedPage
 
 
-def get_header():
+def get_header(host='www.atsenergo.ru'):
     """Формирование хэдера запроса."""
     my_header = {}
     my_header['Accept'] = 'text/html, */*; q=0.01'
@@ -20,7 +29,7 @@ def get_header():
     my_header['Connection'] = 'keep-alive'
     my_header['Content-Length'] = '101'
     my_header['Content-Type'] = 'application/x-www-form-urlencoded'
-    my_header['Host'] = 'www.atsenergo.ru'
+    my_header['Host'] = host
 
     my_header['User-Agent'] = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
                                'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/'
@@ -29,16 +38,72 @@ def get_header():
     return my_header
 
 
-class AtsPwdLoader():
-    def __init__(self, logger, verify_status):
-        self.part_code = None
+def make_page_response(text: str, url: str) -> requests.Response:
+    """Ответ сервера, восстановленный из кэша страниц."""
+    response = requests.Response()
+    response.status_code = HTTPStatus.OK
+    response._content = text.encode('utf-8')
+    response.encoding = 'utf-8'
+    response.url = url
+    return response
+
+
+class AtsPwdLoader(HttpLoader):
+    def __init__(self, logger, verify_status, pool_size=10,
+                 rate_limiter=None, chunk_size=65536, session_manager=None,
+                 page_cache=None, timeout=(10, 60), retry_policy=None,
+                 base_url='https://www.atsenergo.ru', metrics=None,
+                 quiet=False, circuit_breaker=None):
+        super().__init__(logger, verify_status, pool_size=pool_size,
+                         rate_limiter=rate_limiter, chunk_size=chunk_size,
+                         session_manager=session_manager, timeout=timeout,
+                         retry_policy=retry_policy, metrics=metrics,
+                         quiet=quiet, circuit_breaker=circuit_breaker)
         self.user_name = None
         self.password = None
-        self.logger = logger
-        self.session = None
-        self.ATS_URL = 'www.atsenergo.ru'
-        self.REPORT_URL = f'https://{self.ATS_URL}/nreport'
-        self.verify_status = verify_status
+        # Адрес сайта АТС (для отладки и замеров можно указать локальный)
+        self.BASE_URL = base_url.rstrip('/')
+        self.ATS_URL = urlparse(self.BASE_URL).netloc
+        self.REPORT_URL = f'{self.BASE_URL}/nreport'
+        # Кэш страниц отчетов (PageCache)
+        self.page_cache = page_cache
+        # Номер текущей авторизации - чтобы при истечении сессии
+        # повторно авторизовывался только один поток
+        self.auth_generation = 0
+        self._auth_lock = threading.Lock()
+
+    def request(self, method: str, url: str, check_auth: bool = False,
+                **kwargs) -> requests.Response:
+        """HTTP-запрос к сайту через ограничитель скорости.
+
+        При check_auth=True и отказе сервера в авторизации сессии участник
+        авторизуется заново, и запрос повторяется один раз.
+        """
+        generation = self.auth_generation
+        response = self.send(method, url, **kwargs)
+        if (check_auth and self.password is not None
+                and self.is_auth_required(response, kwargs.get('stream'))):
+            response.close()
+            self.relogin(generation)
+            response = self.send(method, url, **kwargs)
+        return response
+
+    @staticmethod
+    def is_auth_required(response: requests.Response, stream=False) -> bool:
+        """Проверка, что сервер не принял авторизацию сессии."""
+        if response.status_code in (HTTPStatus.UNAUTHORIZED,
+                                    HTTPStatus.FORBIDDEN):
+            return True
+        # Сервер перенаправил на страницу авторизации
+        if urlparse(response.url).path.rstrip('/') == '/auth':
+            return True
+        if stream:
+            # Вместо файла пришла html-страница
+            return ('Content-Disposition' not in response.headers
+                    and 'text/html' in response.headers.get('Content-Type',
+                                                            ''))
+        # Вместо страницы отчета пришла форма входа
+        return 'name="password"' in response.text
 
     def save_participant_password(self, part_code: str) -> None:
         """Установка пароля участника ОРЭМ в keyring."""
@@ -56,25 +121,58 @@ class AtsPwdLoader():
             raise PartPasswordNotDefinedError(message)
 
     def login(self):
-        """Авторизация на сайте."""
+        """Авторизация на сайте.
+
+        Если для участника сохранены куки предыдущей авторизации, они
+        используются без повторного входа, пока сервер их принимает.
+        """
         # Нам нужно создать сессию, чтобы сохранить все куки,
         # получаемые от сайта
-        auth_url_without_ssl = f'http://{self.ATS_URL}/auth'
-        auth_url_with_ssl = f'https://{self.ATS_URL}/auth'
-        self.session = requests.Session()
+        self.session = self.create_session()
 
         self.set_participant_password()
+        if (self.session_manager is not None
+                and self.session_manager.restore_cookies(self.part_code,
+                                                         self.session)):
+            self.logger.info(
+                f'Session for participant {self.part_code} restored'
+            )
+            return
+        self.authorize()
+
+    def relogin(self, generation: int) -> None:
+        """Повторная авторизация после отказа сервера.
+
+        generation - номер авторизации, с которой был сделан отклоненный
+        запрос. Если другой поток уже авторизовался заново, повторный вход
+        не выполняется.
+        """
+        with self._auth_lock:
+            if self.auth_generation != generation:
+                return
+            self.logger.info(
+                f'Session for participant {self.part_code} expired'
+            )
+            if self.session_manager is not None:
+                self.session_manager.forget_cookies(self.part_code)
+            self.session.cookies.clear()
+            self.authorize()
+
+    def authorize(self):
+        """Вход на сайт с паролем участника."""
+        auth_url_without_ssl = f'http://{self.ATS_URL}/auth'
+        auth_url_with_ssl = f'{self.BASE_URL}/auth'
+
         # Заходим на сайт АТС, чтобы получить куки
         try:
-            response = self.session.get(
+            response = self.request(
+                'GET',
                 auth_url_without_ssl,
-                allow_redirects=True,
-                verify=self.verify_status
+                allow_redirects=True
             )
         except requests.exceptions.RequestException as exception:
             message = (
-                f'Error loading page: {auth_url_without_ssl}. '
-                f'Response code {response.status_code} {exception}'
+                f'Error loading page: {auth_url_without_ssl}. {exception}'
             )
             raise AtsSiteError(message)
         if response.status_code != HTTPStatus.OK:
@@ -96,21 +194,21 @@ class AtsPwdLoader():
             'op': 'Войти'
         }
 
-        my_header = get_header()
+        my_header = get_header(self.ATS_URL)
 
         try:
             # вот здесь мы добавляем куки к уже имеющимся
-            response = self.session.post(
+            response = self.request(
+                'POST',
                 auth_url_with_ssl,
                 data=post_data,
                 headers=my_header,
-                allow_redirects=True,
-                verify=self.verify_status
+                allow_redirects=True
             )
         except requests.exceptions.RequestException as exception:
             message = (
                 f'Unsuccessful authorization for participant {self.part_code}.'
-                f' Response code {response.status_code} {exception}'
+                f' {exception}'
             )
             raise LogError(message)
         else:
@@ -119,6 +217,10 @@ class AtsPwdLoader():
                     ('Authorization for participant '
                      f'{self.part_code} successful')
                 )
+                self.auth_generation += 1
+                if self.session_manager is not None:
+                    self.session_manager.save_cookies(self.part_code,
+                                                      self.session)
             else:
                 message = (
                     'Bad response code for authorization. '
@@ -132,20 +234,19 @@ class AtsPwdLoader():
         """Создание сессии."""
         # Нам нужно создать сессию, чтобы сохранить все куки,
         # получаемые от сайта
-        url_with_ssl = 'https://www.atsenergo.ru/results/rsv'
-        self.session = requests.Session()
+        url_with_ssl = f'{self.BASE_URL}/results/rsv'
+        self.session = self.create_session()
 
         # Заходим на сайт АТС, чтобы получить куки
         try:
-            response = self.session.get(
+            response = self.request(
+                'GET',
                 url_with_ssl,
-                allow_redirects=True,
-                verify=self.verify_status
+                allow_redirects=True
             )
         except requests.exceptions.RequestException as exception:
             message = (
-                f'Error loading page: {url_with_ssl}. '
-                f'Repponse code {response.status_code} {exception}'
+                f'Error loading page: {url_with_ssl}. {exception}'
             )
             raise AtsSiteError(message)
         if response.status_code != HTTPStatus.OK:
@@ -158,24 +259,58 @@ class AtsPwdLoader():
     def load_report_url(self, zone: str,
                         report_code: str,
                         report_date: str) -> requests.Response:
-        """Загрузка страницы отчета."""
+        """Загрузка страницы отчета.
+
+        Если задан кэш страниц page_cache, одинаковые страницы (с теми же
+        участником, отчетом, датой и зоной) загружаются с сайта один раз.
+        """
         params = {
             'rname': report_code,
             'rdate': report_date,
             'region': zone
         }
+        if self.page_cache is None:
+            return self.fetch_report_page(params)
+
+        def load_page(headers: Dict) -> Optional[CachedPage]:
+            response = self.fetch_report_page(params, headers)
+            if response.status_code == HTTPStatus.NOT_MODIFIED:
+                return None
+            return CachedPage(
+                text=response.text,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+                fetched_at=time.time()
+            )
+
+        page = self.page_cache.fetch(
+            (self.part_code or '', report_code, report_date, zone),
+            load_page
+        )
+        return make_page_response(page.text, self.REPORT_URL)
+
+    def fetch_report_page(self, params: Dict,
+                          headers: Optional[Dict] = None) -> requests.Response:
+        """Запрос страницы отчета с сайта.
+
+        При условном запросе (headers с If-None-Match/If-Modified-Since)
+        допускается ответ 304.
+        """
         try:
-            response = self.session.get(
+            response = self.request(
+                'GET',
                 self.REPORT_URL,
+                check_auth=True,
                 params=params,
-                verify=self.verify_status
+                headers=headers
             )
         except requests.exceptions.RequestException as exception:
             message = (
-                f'Error loading page: {self.REPORT_URL}. '
-                f'Response code {response.status_code} {exception}'
+                f'Error loading page: {self.REPORT_URL}. {exception}'
             )
             raise AtsSiteError(message)
+        if (headers and response.status_code == HTTPStatus.NOT_MODIFIED):
+            return response
         if response.status_code != HTTPStatus.OK:
             message = (
                 f'Error loading page: {self.REPORT_URL}. '
@@ -197,19 +332,33 @@ class AtsPwdLoader():
                 report_files[fid] = res[1]
         return report_files
 
-    def download_file(self, fid, zip, report_file, dest_dir):
-        """Загрузка файла отчета и его сохранение на диск."""
+    def open_file_response(self, fid, zip, report_file, headers=None):
+        """Запрос файла отчета.
+
+        Возвращает потоковый ответ сервера и имя файла из заголовка.
+        При запросе части файла (headers с Range) допускается ответ 206,
+        при условном запросе (If-None-Match/If-Modified-Since) - ответ 304.
+        """
         file_url = ''.join((self.REPORT_URL, '?', fid))
         if zip:
             file_url += '&zip=1'
         try:
-            response = self.session.get(file_url, verify=self.verify_status)
+            response = self.request('GET', file_url, check_auth=True,
+                                    stream=True, headers=headers)
         except requests.exceptions.RequestException as exception:
             message = (f'Bad response with '
-                       f'loading file {report_file}. '
-                       f'Response code {response.status_code}: {exception}')
+                       f'loading file {report_file}. {exception}')
             raise DownloadFileError(message)
-        if response.status_code != HTTPStatus.OK:
+        headers = headers or {}
+        conditional = ('If-None-Match' in headers
+                       or 'If-Modified-Since' in headers)
+        if (conditional
+                and response.status_code == HTTPStatus.NOT_MODIFIED):
+            return response, report_file
+        if not (response.status_code == HTTPStatus.OK
+                or 'Range' in headers
+                and response.status_code == HTTPStatus.PARTIAL_CONTENT):
+            response.close()
             message = (f'Bad response with '
                        f'loading file {report_file}. '
                        f'Response code {response.status_code}')
@@ -217,16 +366,118 @@ class AtsPwdLoader():
 
         file_name = response.headers['Content-Disposition'].\
             split('filename=')[1]
-        print(f'Файл: {file_name}')
-        self.logger.info(f'Download file: {file_name}')
+        if 'Range' not in headers and not conditional:
+            if not self.quiet:
+                print(f'Файл: {file_name}')
+            self.logger.info(f'Download file: {file_name}')
+        return response, file_name
+
+    def fetch_file(self, fid, zip, report_file, fileobj,
+                   known: Optional[RemoteFile] = None
+                   ) -> Optional[RemoteFile]:
+        """Загрузка файла отчета в файловый объект с докачкой
+        (см. HttpLoader.copy_response).
+
+        Если задан known (файл, загруженный ранее), файл запрашивается
+        условным запросом и не загружается, если он не изменился на сайте
+        (тогда возвращается None). Возвращает имя файла, количество
+        записанных байт, SHA-256 содержимого (считается по мере загрузки)
+        и заголовки ETag/Last-Modified ответа.
+        """
+        response, file_name = self.open_file_response(
+            fid, zip, report_file, get_conditional_headers(known) or None
+        )
+        if is_unchanged(response, known):
+            response.close()
+            return None
+        if known is not None:
+            if not self.quiet:
+                print(f'Файл изменен: {file_name}')
+            self.logger.info(f'Download changed file: {file_name}')
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+
+        def reopen(headers: Optional[Dict]) -> requests.Response:
+            return self.open_file_response(fid, zip, report_file,
+                                           headers)[0]
+
+        size, sha256 = self.copy_response(response, reopen, fileobj,
+                                          file_name)
+        return RemoteFile(url=fid, file_name=file_name, etag=etag,
+                          last_modified=last_modified, size=size,
+                          sha256=sha256)
+
+    def download_file(self, fid, zip, report_file, dest_dir,
+                      known: Optional[RemoteFile] = None
+                      ) -> Optional[RemoteFile]:
+        """Загрузка файла отчета и его сохранение на диск.
 
-        file_name = join(dest_dir, file_name)
+        Файл скачивается частями по chunk_size байт во временный файл
+        в папке dest_dir и переименовывается только после успешной загрузки,
+        поэтому прерванная загрузка не оставляет на диске обрезанный файл,
+        а прежний файл с тем же именем заменяется атомарно.
+        Возвращает сведения о файле (см. fetch_file) с полным именем файла
+        либо None, если файл known не изменился.
+        """
+        start = time.monotonic()
+        tmp_file = tempfile.NamedTemporaryFile(
+            dir=dest_dir, prefix='.py_ats_', suffix='.part', delete=False
+        )
+        file_name = None
         try:
-            with open(file_name, 'wb') as report_file:
-                report_file.write(response.content)
+            with tmp_file:
+                remote_file = self.fetch_file(fid, zip, report_file,
+                                              tmp_file, known)
+            if remote_file is None:
+                os.remove(tmp_file.name)
+                return None
+            file_name = join(dest_dir, remote_file.file_name)
+            os.replace(tmp_file.name, file_name)
+        except (DownloadFileError, AtsSiteError, LogError):
+            os.remove(tmp_file.name)
+            raise
         except IOError as exception:
+            if exists(tmp_file.name):
+                os.remove(tmp_file.name)
             raise SavingFileError(
-                f'Error saving file {file_name}: {exception}'
+                f'Error saving file {file_name or report_file}: {exception}'
             )
-        else:
-            return file_name
+        except Exception:
+            os.remove(tmp_file.name)
+            raise
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.record_throughput(
+                remote_file.size, time.monotonic() - start
+            )
+        return replace(remote_file, file_name=file_name)
+
+    def download_to_spool(self, fid, zip, report_file, max_size,
+                          known: Optional[RemoteFile] = None
+                          ) -> Optional[Tuple[RemoteFile, IO[bytes]]]:
+        """Загрузка файла отчета во временный файл без записи в папку отчета.
+
+        Файл держится в памяти, пока его размер не превысит max_size байт,
+        затем переносится во временную папку системы.
+        Возвращает сведения о файле (см. fetch_file) и временный файл,
+        открытый на чтение с начала, либо None, если файл known
+        не изменился.
+        """
+        start = time.monotonic()
+        spool = tempfile.SpooledTemporaryFile(max_size=max_size)
+        try:
+            remote_file = self.fetch_file(fid, zip, report_file, spool,
+                                          known)
+        except Exception:
+            spool.close()
+            raise
+        if remote_file is None:
+            spool.close()
+            return None
+        spool.seek(0)
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.record_throughput(
+                remote_file.size, time.monotonic() - start
+            )
+        return remote_file, spool
@@ -0,0 +1,134 @@
+"""Задания догрузки истории: деление на части, журнал и ход выполнения."""
+import datetime
+import logging
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from engine import DownloadUnit
+from manifest import Manifest, unit_key
+
+# Часть задания: участник, отчет, ценовая зона и месяц (YYYY-MM)
+ChunkKey = Tuple[str, str, str, str]
+
+# Параметры, определяющие состав задания. При продолжении задания
+# (resume=N) они берутся из журнала, остальные - из командной строки
+JOB_SETTINGS = ('dt1', 'dt2', 'partcode', 'reportcode', 'load_type',
+                'overwrite')
+
+
+def chunk_key(unit: DownloadUnit) -> ChunkKey:
+    """Часть задания, к которой относится единица загрузки."""
+    return (unit.part_code, unit.report_code, unit.zone,
+            unit.date.strftime('%Y-%m'))
+
+
+class BackfillJob():
+    """Выполнение задания догрузки истории.
+
+    Период задания делится на части (участник, отчет, ценовая зона, месяц).
+    Часть отмечается в журнале завершенной, когда все ее даты загружены
+    и распакованы. При продолжении задания завершенные части пропускаются
+    (см. add_units), а даты, загруженные после создания задания, исключаются
+    при планировании по журналу загрузки. После каждой части на экран
+    и в лог выводится ход выполнения и оставшееся время.
+    Можно использовать из нескольких потоков.
+    """
+
+    def __init__(self, manifest: Manifest, job_id: int,
+                 logger: logging.Logger):
+        self.manifest = manifest
+        self.job_id = job_id
+        self.logger = logger
+        self._complete = manifest.complete_chunks(job_id)
+        # Даты, загруженные после создания задания
+        _, created_at, _ = manifest.get_job(job_id)
+        self._loaded = manifest.completed_units_since(created_at)
+        # Незавершенные части и количество оставшихся в них дат
+        self._left: Dict[ChunkKey, int] = {}
+        self._lock = threading.Lock()
+        self.total_chunks = 0
+        self.done_chunks = 0
+        self.total_units = 0
+        self.done_units = 0
+        self._started = time.monotonic()
+
+    def add_units(self, planned_units: List[DownloadUnit],
+                  units: List[DownloadUnit]) -> List[DownloadUnit]:
+        """Учет дат отчета по одной ценовой зоне в частях задания.
+
+        planned_units - все даты отчета за период задания, units - даты,
+        которые нужно загрузить по журналу загрузки. Возвращает даты
+        незавершенных частей, не загруженные в рамках задания. Части,
+        в которых загружать нечего, сразу отмечаются завершенными.
+        """
+        chunks = {}
+        for unit in planned_units:
+            chunks.setdefault(chunk_key(unit), [])
+        for unit in units:
+            if unit_key(unit) not in self._loaded:
+                chunks[chunk_key(unit)].append(unit)
+        self.manifest.record_chunks(self.job_id, {
+            key: len(chunk_units) for key, chunk_units in chunks.items()
+        })
+        result = []
+        with self._lock:
+            for key, chunk_units in chunks.items():
+                self.total_chunks += 1
+                if key in self._complete or not chunk_units:
+                    self.done_chunks += 1
+                    if key not in self._complete:
+                        self._complete.add(key)
+                        self.manifest.complete_chunk(self.job_id, key)
+                    continue
+                self._left[key] = len(chunk_units)
+                self.total_units += len(chunk_units)
+                result.extend(chunk_units)
+        return result
+
+    def unit_done(self, unit: DownloadUnit, is_unpacked: bool) -> None:
+        """Завершение загрузки даты (вызывается после распаковки архивов).
+
+        Если архивы распакованы не все, часть остается незавершенной.
+        """
+        key = chunk_key(unit)
+        with self._lock:
+            if not is_unpacked or key not in self._left:
+                return
+            self.done_units += 1
+            self._left[key] -= 1
+            if self._left[key] > 0:
+                return
+            del self._left[key]
+            self._complete.add(key)
+            self.done_chunks += 1
+            message = self.format_progress()
+        self.manifest.complete_chunk(self.job_id, key)
+        print(message)
+        self.logger.info(message)
+
+    def format_progress(self) -> str:
+        """Ход выполнения задания и оценка оставшегося времени."""
+        message = (f'Задание {self.job_id}: частей {self.done_chunks} '
+                   f'из {self.total_chunks}, дат {self.done_units} '
+                   f'из {self.total_units}')
+        if 0 < self.done_units < self.total_units:
+            elapsed = time.monotonic() - self._started
+            left = (elapsed / self.done_units
+                    * (self.total_units - self.done_units))
+            message += (', осталось около '
+                        f'{datetime.timedelta(seconds=round(left))}')
+        return message
+
+
+def finish_job(manifest: Manifest, job_id: int,
+               logger: logging.Logger) -> None:
+    """Отметка о завершении задания, если завершены все его части."""
+    if manifest.finish_job(job_id):
+        message = f'Задание {job_id} выполнено'
+    else:
+        message = (f'Задание {job_id} выполнено не полностью, для '
+                   f'продолжения запустите загрузку с параметром '
+                   f'resume={job_id}')
+    print(message)
+    logger.info(message)
@@ -0,0 +1,291 @@
+"""Локальный сервер, имитирующий сайт АТС, для замеров скорости загрузки.
+
+Поддерживаются страницы /auth (GET и POST с авторизацией), /results/rsv,
+/nreport (страница отчета со ссылками на файлы и сами файлы, в том числе
+в архиве при &zip=1 и частями по заголовку Range) и /stats (счетчики
+запросов в формате JSON).
+
+Запуск отдельно от замеров:
+    python bench/ats_stub.py port=8765 latency=0.05 error_rate=0.01
+"""
+import io
+import json
+import random
+import sys
+import threading
+import time
+import zipfile
+from functools import lru_cache
+from http import HTTPStatus
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Параметры по умолчанию
+DEFAULT_SETTINGS = {
+    # задержка ответа на каждый запрос в секундах
+    'latency': 0.05,
+    # разброс задержки (доля от latency)
+    'jitter': 0.5,
+    # допустимая частота запросов в секунду, выше - ответ 429 (0 - без
+    # ограничения)
+    'throttle_rps': 0.0,
+    # доля запросов с ответом 503
+    'error_rate': 0.0,
+    # доля загрузок файла, обрываемых на середине
+    'cut_rate': 0.0,
+    # количество файлов на странице отчета
+    'files_per_page': 1,
+    # размер файла отчета в байтах
+    'file_size': 200 * 1024,
+    # скорость отдачи файла в байтах в секунду на соединение (0 - без
+    # ограничения)
+    'bandwidth': 0.0,
+}
+
+
+@lru_cache(maxsize=16)
+def make_payload(size: int) -> bytes:
+    """Содержимое файла отчета: наполовину случайные данные, чтобы архив
+    сжимался примерно как настоящие xls-файлы."""
+    noise = random.Random(size).randbytes(size // 2)
+    return noise + bytes(size - len(noise))
+
+
+@lru_cache(maxsize=4096)
+def make_zip(file_name: str, size: int) -> bytes:
+    """Архив с одним файлом отчета."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        info = zipfile.ZipInfo(file_name, (2020, 1, 1, 0, 0, 0))
+        archive.writestr(info, make_payload(size),
+                         compress_type=zipfile.ZIP_DEFLATED)
+    return buffer.getvalue()
+
+
+def get_file_name(report_code: str, report_date: str, zone: str,
+                  number: str) -> str:
+    """Имя файла отчета без расширения: одно и то же в ссылке на странице,
+    в имени загружаемого файла и файла в архиве."""
+    return f'{report_date}_{zone}_{number}_{report_code}'
+
+
+class AtsStubServer(ThreadingHTTPServer):
+    """Сервер с настройками имитации и счетчиками запросов."""
+
+    daemon_threads = True
+
+    def __init__(self, address, settings=None):
+        super().__init__(address, AtsStubHandler)
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+        self.random = random.Random(0)
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.stats = {}
+        self.reset_stats()
+        # ограничение частоты запросов: начало текущей секунды и счетчик
+        self._window = (0, 0)
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            self.stats = {'requests': 0, 'bytes_sent': 0, 'status': {},
+                          'logins': 0, 'cut': 0}
+
+    def count(self, status: int, sent: int = 0) -> None:
+        with self.lock:
+            self.stats['bytes_sent'] += sent
+            status = str(status)
+            self.stats['status'][status] = (
+                self.stats['status'].get(status, 0) + 1
+            )
+
+    def chance(self, rate: float) -> bool:
+        with self.lock:
+            return self.random.random() < rate
+
+    def is_throttled(self) -> bool:
+        """Превышение допустимой частоты запросов."""
+        limit = self.settings['throttle_rps']
+        if not limit:
+            return False
+        with self.lock:
+            second = int(time.monotonic())
+            start, count = self._window
+            if start != second:
+                start, count = second, 0
+            count += 1
+            self._window = (start, count)
+            return count > limit
+
+
+class AtsStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status: int, body: bytes = b'',
+                  headers=None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.write_body(body)
+        self.server.count(status, len(body))
+
+    def write_body(self, body: bytes) -> None:
+        bandwidth = self.server.settings['bandwidth']
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        step = 64 * 1024
+        for position in range(0, len(body), step):
+            self.wfile.write(body[position:position + step])
+            time.sleep(min(step, len(body) - position) / bandwidth)
+
+    def get_session(self) -> str:
+        cookie = SimpleCookie(self.headers.get('Cookie', ''))
+        morsel = cookie.get('sid')
+        return morsel.value if morsel is not None else ''
+
+    def new_session(self) -> dict:
+        sid = f'{time.time_ns()}{threading.get_ident()}'
+        with self.server.lock:
+            self.server.sessions.add(sid)
+        return {'Set-Cookie': f'sid={sid}; Path=/'}
+
+    def delay(self) -> None:
+        settings = self.server.settings
+        if settings['latency']:
+            spread = settings['latency'] * settings['jitter']
+            time.sleep(max(0.0, settings['latency']
+                           + random.uniform(-spread, spread)))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        with self.server.lock:
+            self.server.stats['requests'] += 1
+            self.server.stats['logins'] += 1
+        self.delay()
+        if urlparse(self.path).path != '/auth':
+            return self.send_body(HTTPStatus.NOT_FOUND)
+        self.send_body(HTTPStatus.OK, b'<html>ok</html>', self.new_session())
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            with self.server.lock:
+                body = json.dumps(self.server.stats).encode()
+            return self.send_body(HTTPStatus.OK, body,
+                                  {'Content-Type': 'application/json'})
+        with self.server.lock:
+            self.server.stats['requests'] += 1
+        self.delay()
+        if url.path in ('/auth', '/results/rsv'):
+            return self.send_body(HTTPStatus.OK, b'<html></html>',
+                                  self.new_session())
+        if url.path != '/nreport':
+            return self.send_body(HTTPStatus.NOT_FOUND)
+        if self.server.is_throttled():
+            return self.send_body(HTTPStatus.TOO_MANY_REQUESTS, b'',
+                                  {'Retry-After': '1'})
+        if self.server.chance(self.server.settings['error_rate']):
+            return self.send_body(HTTPStatus.SERVICE_UNAVAILABLE)
+        with self.server.lock:
+            authorized = self.get_session() in self.server.sessions
+        if not authorized:
+            return self.send_body(HTTPStatus.FOUND, b'',
+                                  {'Location': '/auth'})
+        query = parse_qs(url.query)
+        if 'fid' in query:
+            return self.send_file(query)
+        self.send_page(query)
+
+    def send_page(self, query) -> None:
+        """Страница отчета со ссылками на файлы."""
+        report_code = query.get('rname', ['report'])[0]
+        report_date = query.get('rdate', ['20200101'])[0]
+        zone = query.get('region', ['eur'])[0]
+        links = []
+        for number in range(int(self.server.settings['files_per_page'])):
+            fid = f'{report_date}{zone}{report_code}{number}'
+            file_name = get_file_name(report_code, report_date, zone,
+                                      str(number))
+            # параметры имени файла передаются в ссылке вместе с fid
+            links.append(f'<a href="?fid={fid}&rname={report_code}'
+                         f'&rdate={report_date}&region={zone}'
+                         f'&num={number}">{file_name}.xls</a>')
+        body = ('<html><body>' + '<br>'.join(links)
+                + '</body></html>').encode()
+        self.send_body(HTTPStatus.OK, body,
+                       {'Content-Type': 'text/html; charset=utf-8'})
+
+    def send_file(self, query) -> None:
+        """Файл отчета (при zip=1 - в архиве), целиком или частью."""
+        fid = query['fid'][0]
+        base_name = get_file_name(query.get('rname', ['report'])[0],
+                                  query.get('rdate', ['20200101'])[0],
+                                  query.get('region', ['eur'])[0],
+                                  query.get('num', ['0'])[0])
+        file_name = f'{base_name}.xls'
+        size = int(self.server.settings['file_size'])
+        if query.get('zip') == ['1']:
+            body = make_zip(file_name, size)
+            file_name = f'{base_name}.zip'
+        else:
+            body = make_payload(size)
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'Content-Disposition': f'attachment; filename={file_name}',
+            'Accept-Ranges': 'bytes',
+            'ETag': f'"{fid}-{len(body)}"',
+        }
+        range_header = self.headers.get('Range', '')
+        if (range_header.startswith('bytes=')
+                and self.headers.get('If-Range') == headers['ETag']):
+            start = int(range_header[6:].split('-')[0])
+            headers['Content-Range'] = (f'bytes {start}-{len(body) - 1}/'
+                                        f'{len(body)}')
+            return self.send_body(HTTPStatus.PARTIAL_CONTENT, body[start:],
+                                  headers)
+        if self.server.chance(self.server.settings['cut_rate']):
+            # обрыв соединения на середине файла
+            self.send_response(HTTPStatus.OK)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.write_body(body[:len(body) // 2])
+            self.close_connection = True
+            self.server.count(HTTPStatus.OK, len(body) // 2)
+            with self.server.lock:
+                self.server.stats['cut'] += 1
+            return
+        self.send_body(HTTPStatus.OK, body, headers)
+
+
+def start_server(settings=None, port: int = 0) -> AtsStubServer:
+    """Запуск сервера в фоновом потоке (port=0 - свободный порт)."""
+    server = AtsStubServer(('127.0.0.1', port), settings)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    settings = {}
+    for arg in sys.argv[1:]:
+        if arg.find('=') != -1:
+            settings[arg.split('=')[0]] = arg.split('=')[1]
+    port = int(settings.pop('port', '8765'))
+    settings = {name: float(value) for name, value in settings.items()}
+    server = AtsStubServer(('127.0.0.1', port), settings)
+    print(f'ATS stub: http://127.0.0.1:{server.server_port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""Замеры скорости загрузки отчетов на локальной имитации сайта АТС.
+
+Для каждого сценария запускается сервер ats_stub с параметрами сценария,
+почтовый сервер smtp_stub (для уведомлений) и отдельный процесс загрузки
+(main.load_from_main_source) с настройками участников и отчетов, как
+в рабочей установке. По итогам выводятся время загрузки, количество
+запросов и объем данных в секунду и пиковый объем памяти процесса загрузки.
+
+Запуск:
+    python bench/run_bench.py
+    python bench/run_bench.py scenario=parallel,flaky days=10 WORKERS=16
+
+Параметры:
+    scenario - сценарии через запятую (по умолчанию все)
+    participants - количество участников (по умолчанию 2)
+    days - глубина загрузки в днях (по умолчанию 3)
+    reportcode - коды отчетов через запятую (по умолчанию все отчеты из
+        ReportSettingsPart.xml)
+    output - файл для сохранения результатов в формате JSON
+    keep=1 - не удалять папку с загруженными файлами
+    Параметры в верхнем регистре (WORKERS=8, RATE_LIMIT_RPS=20 и т.п.)
+    передаются процессу загрузки как переменные окружения и заменяют
+    значения сценария.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+try:
+    import resource
+except ImportError:
+    # нет в Windows - пиковый объем памяти не замеряется
+    resource = None
+
+import smtp_stub
+from ats_stub import start_server
+
+REPO_DIR = dirname(dirname(abspath(__file__)))
+
+# Настройки загрузки, общие для всех сценариев
+BASE_ENV = {
+    'VERIFY_STATUS': '0',
+    'MAX_TIMESHIFT': '-65',
+    'RATE_LIMIT_RPS': '50',
+    'RATE_LIMIT_MAX_RPS': '200',
+    'RETRY_BASE_DELAY': '0.2',
+    'RETRY_MAX_DELAY': '5',
+    'SESSION_COOKIES': '0',
+    'PAGE_CACHE_FILE': '',
+}
+
+# Сценарии: параметры сервера (см. ats_stub.DEFAULT_SETTINGS) и
+# переменные окружения процесса загрузки
+SCENARIOS = {
+    'sequential': {
+        'server': {'latency': 0.05},
+        'env': {'WORKERS': '1'},
+    },
+    'parallel': {
+        'server': {'latency': 0.05},
+        'env': {'WORKERS': '8', 'PART_WORKERS': '4'},
+    },
+    'throttled': {
+        'server': {'latency': 0.05, 'throttle_rps': 20},
+        'env': {'WORKERS': '8', 'PART_WORKERS': '4'},
+    },
+    'flaky': {
+        'server': {'latency': 0.05, 'error_rate': 0.03, 'cut_rate': 0.1},
+        'env': {'WORKERS': '8', 'PART_WORKERS': '4'},
+    },
+    'large_files': {
+        'server': {'latency': 0.05, 'file_size': 5 * 1024 * 1024,
+                   'bandwidth': 20 * 1024 * 1024},
+        'env': {'WORKERS': '4', 'PART_WORKERS': '2'},
+    },
+}
+
+RESULT_PREFIX = 'BENCH_RESULT '
+
+
+def write_participants(file_name: str, count: int) -> None:
+    """Файл настроек участников для замеров."""
+    lines = ['<?xml version="1.0" encoding="utf-8" ?>', '<root>']
+    for number in range(count):
+        lines.append(
+            f'  <participant userName="bench{number}" '
+            f'userCode="BENCH{number:03d}" isNeedToLoad="true" '
+            f'userEmails="bench{number}@localhost" zone="eur;sib"/>'
+        )
+    lines.append('</root>')
+    with open(file_name, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(lines))
+
+
+def run_child(work_dir: str, script_settings: dict) -> None:
+    """Загрузка в отдельном процессе (вызывается из run_scenario)."""
+    sys.path.insert(0, REPO_DIR)
+    import keyring
+    import keyring.backend
+
+    class MemoryKeyring(keyring.backend.KeyringBackend):
+        """Хранилище паролей в памяти: пароли участников не нужны."""
+
+        priority = 1
+
+        def __init__(self):
+            super().__init__()
+            self.passwords = {}
+
+        def get_password(self, service, username):
+            if service == 'py_ats':
+                return 'bench'
+            return self.passwords.get((service, username))
+
+        def set_password(self, service, username, password):
+            self.passwords[(service, username)] = password
+
+        def delete_password(self, service, username):
+            self.passwords.pop((service, username), None)
+
+    keyring.set_keyring(MemoryKeyring())
+
+    import main
+
+    os.chdir(work_dir)
+    start = time.perf_counter()
+    main.load_from_main_source(script_settings)
+    wall_time = time.perf_counter() - start
+
+    peak_rss = None
+    if resource is not None:
+        # в Linux ru_maxrss в килобайтах, в macOS - в байтах
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_rss = peak_rss / 1024 if sys.platform != 'darwin' else (
+            peak_rss / 1024 / 1024)
+    print(RESULT_PREFIX + json.dumps({'wall_time': wall_time,
+                                      'peak_rss_mb': peak_rss}))
+
+
+def run_scenario(name: str, scenario: dict, params: dict,
+                 env_overrides: dict) -> dict:
+    """Запуск одного сценария и сбор результатов."""
+    work_dir = tempfile.mkdtemp(prefix=f'py_ats_bench_{name}_')
+    participants_file = join(work_dir, 'Participants.xml')
+    write_participants(participants_file, int(params['participants']))
+
+    server = start_server(scenario['server'])
+    # Уведомления отправляются на локальный SMTP-сервер
+    smtp_server = smtp_stub.start_server()
+    env = dict(os.environ)
+    env.update(BASE_ENV)
+    env.update(scenario['env'])
+    env.update(env_overrides)
+    env.update({
+        'ATS_BASE_URL': f'http://127.0.0.1:{server.server_port}',
+        'HOME_DIR_FOR_SAVE': join(work_dir, 'out'),
+        'PARTICIPANT_SETTINGS_FILE': participants_file,
+        'REPORT_SETTINGS_PRIV_FILE': join(REPO_DIR, 'ReportSettingsPart.xml'),
+        'REPORT_SETTINGS_PUB_FILE': join(REPO_DIR, 'ReportSettingsPubl.xml'),
+        'MANIFEST_FILE': join(work_dir, 'py_ats.db'),
+        'SMTP_SERVER': '127.0.0.1',
+        'SMTP_PORT': str(smtp_server.server_port),
+        'DOMAIN': 'localhost',
+    })
+    args = [sys.executable, abspath(__file__), f'child={work_dir}',
+            'source_type=ats_reports', f"dt1=-{params['days']}"]
+    if params.get('reportcode'):
+        args.append(f"reportcode={params['reportcode']}")
+
+    try:
+        process = subprocess.run(args, env=env, capture_output=True,
+                                 text=True, encoding='utf-8',
+                                 errors='replace')
+        stats = dict(server.stats)
+        smtp_stats = dict(smtp_server.stats)
+    finally:
+        server.shutdown()
+        server.server_close()
+        smtp_server.shutdown()
+        smtp_server.server_close()
+        if params.get('keep') != '1':
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    result = {'scenario': name, 'server': scenario['server'],
+              'env': {**scenario['env'], **env_overrides},
+              'requests': stats['requests'],
+              'bytes': stats['bytes_sent'],
+              'status': stats['status'],
+              'cut': stats['cut'],
+              'logins': stats['logins'],
+              'emails': smtp_stats['messages'],
+              'smtp_connections': smtp_stats['connections']}
+    for line in process.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            result.update(json.loads(line[len(RESULT_PREFIX):]))
+    if process.returncode != 0 or 'wall_time' not in result:
+        result['error'] = (process.stderr.strip().splitlines() or
+                           ['exit code ' + str(process.returncode)])[-1]
+        return result
+    result['requests_per_sec'] = result['requests'] / result['wall_time']
+    result['mb_per_sec'] = result['bytes'] / 1024 / 1024 / result['wall_time']
+    return result
+
+
+def print_results(results: list) -> None:
+    header = (f"{'scenario':<14}{'wall, s':>9}{'requests':>10}"
+              f"{'req/s':>9}{'MB':>9}{'MB/s':>8}{'RSS, MB':>9}  errors")
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        if 'error' in result:
+            print(f"{result['scenario']:<14}failed: {result['error']}")
+            continue
+        errors = ', '.join(f'{status}: {count}'
+                           for status, count in result['status'].items()
+                           if status not in ('200', '206'))
+        if result['cut']:
+            errors = ', '.join(filter(None, (errors,
+                                             f"cut: {result['cut']}")))
+        rss = ('-' if result['peak_rss_mb'] is None
+               else str(round(result['peak_rss_mb'])))
+        print(f"{result['scenario']:<14}{result['wall_time']:>9.1f}"
+              f"{result['requests']:>10}{result['requests_per_sec']:>9.1f}"
+              f"{result['bytes'] / 1024 / 1024:>9.1f}"
+              f"{result['mb_per_sec']:>8.2f}"
+              f"{rss:>9}  {errors}")
+
+
+def main():
+    params = {'participants': '2', 'days': '3'}
+    env_overrides = {}
+    for arg in sys.argv[1:]:
+        if arg.find('=') != -1:
+            key, value = arg.split('=', 1)
+            if key.isupper():
+                env_overrides[key] = value
+            else:
+                params[key] = value
+
+    if 'child' in params:
+        settings = {key: value for key, value in params.items()
+                    if key not in ('child', 'participants', 'days')}
+        run_child(params['child'], settings)
+        return
+
+    names = params.get('scenario', ','.join(SCENARIOS)).split(',')
+    for name in names:
+        if name not in SCENARIOS:
+            print(f'Неизвестный сценарий {name}. '
+                  f'Доступны: {", ".join(SCENARIOS)}')
+            sys.exit(1)
+
+    results = []
+    for name in names:
+        print(f'Сценарий {name}...', flush=True)
+        results.append(run_scenario(name, SCENARIOS[name], params,
+                                    env_overrides))
+    print_results(results)
+    if params.get('output'):
+        with open(params['output'], 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
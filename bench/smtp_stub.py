@@ -0,0 +1,130 @@
+"""Локальный SMTP-сервер, имитирующий почтовый сервер, для проверки
+отправки уведомлений.
+
+Поддерживаются команды HELO/EHLO, AUTH PLAIN и AUTH LOGIN (принимается
+любой пароль), MAIL, RCPT, DATA, RSET, NOOP и QUIT. Письма сохраняются
+в памяти сервера (messages), счетчики соединений, авторизаций и писем -
+в stats.
+
+Запуск отдельно от замеров:
+    python bench/smtp_stub.py port=8025
+"""
+import socketserver
+import sys
+import threading
+from email import message_from_bytes, policy
+
+
+class SmtpStubServer(socketserver.ThreadingTCPServer):
+    """Сервер с принятыми письмами и счетчиками."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, SmtpStubHandler)
+        self.lock = threading.Lock()
+        self.messages = []
+        self.stats = {'connections': 0, 'logins': 0, 'messages': 0}
+
+    @property
+    def server_port(self) -> int:
+        return self.server_address[1]
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.stats[name] += 1
+
+
+class SmtpStubHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line: str) -> None:
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        self.server.count('connections')
+        self.reply('220 localhost py_ats SMTP stub')
+        sender, receivers = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250-AUTH PLAIN LOGIN')
+                self.reply('250 8BITMIME')
+            elif verb == 'HELO':
+                self.reply('250 localhost')
+            elif verb == 'AUTH':
+                parts = command.split()
+                # запросы данных, которые клиент не передал в команде
+                if len(parts) > 1 and parts[1].upper() == 'LOGIN':
+                    prompts = ['VXNlcm5hbWU6', 'UGFzc3dvcmQ6'][len(parts) - 2:]
+                else:
+                    prompts = [''] if len(parts) == 2 else []
+                for prompt in prompts:
+                    self.reply(f'334 {prompt}')
+                    self.rfile.readline()
+                self.server.count('logins')
+                self.reply('235 Authentication successful')
+            elif verb == 'MAIL':
+                sender, receivers = command.split(':', 1)[1].strip(), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                receivers.append(command.split(':', 1)[1].strip())
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b'.\r\n', b'.\n'):
+                        break
+                    if data_line.startswith(b'..'):
+                        data_line = data_line[1:]
+                    data.append(data_line)
+                message = message_from_bytes(b''.join(data),
+                                             policy=policy.default)
+                with self.server.lock:
+                    self.server.messages.append(
+                        {'from': sender, 'to': receivers,
+                         'message': message}
+                    )
+                self.server.count('messages')
+                sender, receivers = None, []
+                self.reply('250 OK')
+            elif verb in ('RSET', 'NOOP'):
+                if verb == 'RSET':
+                    sender, receivers = None, []
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+def start_server(port: int = 0) -> SmtpStubServer:
+    """Запуск сервера в фоновом потоке (port=0 - свободный порт)."""
+    server = SmtpStubServer(('127.0.0.1', port))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    settings = {}
+    for arg in sys.argv[1:]:
+        if arg.find('=') != -1:
+            settings[arg.split('=')[0]] = arg.split('=')[1]
+    port = int(settings.get('port', '8025'))
+    server = SmtpStubServer(('127.0.0.1', port))
+    print(f'SMTP stub: 127.0.0.1:{server.server_port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Хранилище файлов отчетов по содержимому (SHA-256)."""
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from os.path import dirname, exists, join
+from typing import Optional
+
+
+class HashingFile():
+    """Обертка файлового объекта, считающая SHA-256 записанных данных.
+
+    Усечение файла (загрузка заново с начала после обрыва) сбрасывает хэш.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        self.hasher.update(data)
+        return self.fileobj.write(data)
+
+    def tell(self) -> int:
+        return self.fileobj.tell()
+
+    def seek(self, *args) -> int:
+        return self.fileobj.seek(*args)
+
+    def truncate(self) -> int:
+        self.hasher = hashlib.sha256()
+        return self.fileobj.truncate()
+
+    def hexdigest(self) -> str:
+        return self.hasher.hexdigest()
+
+
+def write_temp(dir_name: str, fileobj) -> HashingFile:
+    """Запись файлового объекта во временный файл в папке dir_name."""
+    tmp_file = tempfile.NamedTemporaryFile(
+        dir=dir_name, prefix='.py_ats_', suffix='.part', delete=False
+    )
+    try:
+        with tmp_file:
+            hashing = HashingFile(tmp_file)
+            shutil.copyfileobj(fileobj, hashing)
+    except Exception:
+        os.remove(tmp_file.name)
+        raise
+    hashing.name = tmp_file.name
+    return hashing
+
+
+class BlobStore():
+    """Хранилище файлов по содержимому.
+
+    Каждое уникальное содержимое хранится один раз (в папке root под именем
+    своего SHA-256), а файлы в папках отчетов являются жесткими ссылками
+    на него. Поэтому root должен находиться на том же диске, что и папки
+    отчетов. Если файловая система не поддерживает жесткие ссылки, файлы
+    копируются (экономится только повторная загрузка).
+    """
+
+    def __init__(self, root: str, logger: logging.Logger):
+        self.root = root
+        self.logger = logger
+        self._links_supported = True
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, sha256: str) -> str:
+        return join(self.root, sha256[:2], sha256)
+
+    def exists(self, sha256: Optional[str]) -> bool:
+        return bool(sha256) and exists(self.path(sha256))
+
+    def open(self, sha256: str):
+        return open(self.path(sha256), 'rb')
+
+    def _link(self, source: str, target: str) -> None:
+        """Атомарное создание target как жесткой ссылки на source (или его
+        копии) с заменой существующего файла."""
+        tmp_name = join(dirname(target),
+                        f'.py_ats_{threading.get_ident()}_{os.getpid()}.link')
+        if exists(tmp_name):
+            os.remove(tmp_name)
+        try:
+            if self._links_supported:
+                try:
+                    os.link(source, tmp_name)
+                except OSError as err:
+                    with self._lock:
+                        if self._links_supported:
+                            self.logger.warning(
+                                f'Hard links are not supported for '
+                                f'{self.root}, files are copied: {err}'
+                            )
+                        self._links_supported = False
+            if not self._links_supported:
+                shutil.copyfile(source, tmp_name)
+            os.replace(tmp_name, target)
+        except Exception:
+            if exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+
+    def materialize(self, sha256: str, file_name: str) -> None:
+        """Создание файла file_name с содержимым sha256 из хранилища."""
+        os.makedirs(dirname(file_name), exist_ok=True)
+        self._link(self.path(sha256), file_name)
+
+    def add_file(self, file_name: str, sha256: str) -> None:
+        """Учет загруженного файла.
+
+        Если такое содержимое уже хранится, файл заменяется ссылкой на него,
+        иначе содержимое файла добавляется в хранилище.
+        """
+        blob = self.path(sha256)
+        if exists(blob):
+            self._link(blob, file_name)
+            return
+        os.makedirs(dirname(blob), exist_ok=True)
+        try:
+            self._link(file_name, blob)
+        except FileExistsError:
+            self._link(blob, file_name)
+
+    def add_stream(self, fileobj, sha256: str) -> None:
+        """Добавление содержимого файлового объекта с известным хэшем."""
+        blob = self.path(sha256)
+        if exists(blob):
+            return
+        os.makedirs(dirname(blob), exist_ok=True)
+        hashing = write_temp(dirname(blob), fileobj)
+        os.replace(hashing.name, blob)
+
+    def add_member(self, archive: zipfile.ZipFile, info: zipfile.ZipInfo,
+                   file_name: str) -> str:
+        """Распаковка файла архива через хранилище.
+
+        Содержимое хэшируется при распаковке, сохраняется в хранилище
+        (если его там еще нет), а file_name создается как ссылка на него.
+        Возвращает SHA-256 содержимого.
+        """
+        with archive.open(info) as member:
+            hashing = write_temp(self.root, member)
+        sha256 = hashing.hexdigest()
+        blob = self.path(sha256)
+        if exists(blob):
+            os.remove(hashing.name)
+        else:
+            os.makedirs(dirname(blob), exist_ok=True)
+            os.replace(hashing.name, blob)
+        self.materialize(sha256, file_name)
+        return sha256
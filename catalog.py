@@ -0,0 +1,143 @@
+"""Каталог загруженных файлов отчетов (SQLite)."""
+import datetime
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from engine import DownloadUnit
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT NOT NULL PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    part_code TEXT NOT NULL,
+    report_code TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    date TEXT NOT NULL,
+    fid TEXT,
+    size INTEGER,
+    sha256 TEXT,
+    downloaded_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_report
+    ON files (report_code, date, part_code, zone);
+CREATE INDEX IF NOT EXISTS files_part ON files (part_code, date);
+CREATE INDEX IF NOT EXISTS files_name ON files (file_name);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+"""
+
+COLUMNS = ['date', 'part_code', 'report_code', 'zone', 'file_name', 'size',
+           'sha256', 'fid', 'downloaded_at', 'path']
+
+# Время ожидания блокировки базы другим процессом (в секундах)
+SQLITE_TIMEOUT = 30
+
+
+def mask_to_like(mask: str) -> str:
+    """Маска имени файла (* и ?) в шаблон LIKE."""
+    escaped = (mask.replace('\\', '\\\\').replace('%', '\\%')
+               .replace('_', '\\_'))
+    return escaped.replace('*', '%').replace('?', '_')
+
+
+class Catalog():
+    """Каталог файлов, записанных в папки отчетов: одна строка на файл
+    (скачанный или распакованный из архива).
+
+    Строки копятся в памяти и записываются одной транзакцией, когда их
+    набирается batch_size или с последней записи прошло flush_interval
+    секунд, поэтому заполнение каталога почти не замедляет загрузку.
+    Можно использовать из нескольких потоков.
+    """
+
+    def __init__(self, db_file: str, batch_size: int = 200,
+                 flush_interval: float = 5):
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(db_file, timeout=SQLITE_TIMEOUT,
+                                          check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self._lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.executescript(SCHEMA)
+            self.connection.commit()
+
+    def add(self, unit: DownloadUnit, fid: Optional[str], path: str,
+            size: int, sha256: Optional[str]) -> None:
+        """Учет файла, записанного при загрузке единицы unit."""
+        row = (path, path.replace('\\', '/').rsplit('/', 1)[-1],
+               unit.part_code, unit.report_code, unit.zone,
+               unit.date.isoformat(), fid, size, sha256,
+               datetime.datetime.now().isoformat(timespec='seconds'))
+        with self._lock:
+            self._rows.append(row)
+            if (len(self._rows) >= self.batch_size
+                    or time.monotonic() - self._flushed_at
+                    >= self.flush_interval):
+                self._flush()
+
+    def _flush(self) -> None:
+        if self._rows:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO files (path, file_name, part_code, '
+                'report_code, zone, date, fid, size, sha256, downloaded_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                self._rows
+            )
+            self.connection.commit()
+            self._rows = []
+        self._flushed_at = time.monotonic()
+
+    def flush(self) -> None:
+        """Запись накопленных строк."""
+        with self._lock:
+            self._flush()
+
+    def find(self, part_codes: Optional[List[str]] = None,
+             report_codes: Optional[List[str]] = None,
+             zones: Optional[List[str]] = None,
+             dt1: Optional[datetime.date] = None,
+             dt2: Optional[datetime.date] = None,
+             file_mask: Optional[str] = None,
+             sha256: Optional[str] = None) -> List[sqlite3.Row]:
+        """Поиск файлов по участникам, отчетам, зонам, периоду, маске имени
+        и хэшу (незаданные условия не проверяются)."""
+        conditions = []
+        params = []
+        for column, values in (('part_code', part_codes),
+                               ('report_code', report_codes),
+                               ('zone', zones)):
+            if values:
+                conditions.append(
+                    f'{column} IN ({", ".join("?" * len(values))})'
+                )
+                params.extend(values)
+        if dt1 is not None:
+            conditions.append('date >= ?')
+            params.append(dt1.isoformat())
+        if dt2 is not None:
+            conditions.append('date <= ?')
+            params.append(dt2.isoformat())
+        if file_mask:
+            conditions.append("file_name LIKE ? ESCAPE '\\'")
+            params.append(mask_to_like(file_mask))
+        if sha256:
+            conditions.append('sha256 = ?')
+            params.append(sha256.lower())
+        query = f'SELECT {", ".join(COLUMNS)} FROM files'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY date, part_code, report_code, zone, file_name'
+        with self._lock:
+            self._flush()
+            return self.connection.execute(query, params).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            self.connection.close()
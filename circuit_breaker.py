@@ -0,0 +1,128 @@
+"""Приостановка запросов к сайту при всплеске ошибок (circuit breaker)."""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict
+from urllib.parse import urlparse
+
+from exceptions import CircuitOpenError
+
+# Количество последних запросов к сайту, по которым считается доля ошибок
+WINDOW = 20
+
+
+class Circuit():
+    """Состояние выключателя одного сайта."""
+
+    def __init__(self, open_time: float):
+        # Результаты последних запросов (True - ошибка)
+        self.results = deque(maxlen=WINDOW)
+        self.is_open = False
+        self.opened_at = 0.0
+        self.open_time = open_time
+        # Пробный запрос после паузы уже отправлен
+        self.probing = False
+
+
+class CircuitBreaker():
+    """Выключатели запросов по сайтам (хостам).
+
+    Если среди последних запросов к сайту (не меньше min_requests) доля
+    временных ошибок (обрыв соединения, таймаут, ответы 429 и 5xx) достигла
+    failure_rate, запросы к сайту приостанавливаются на open_time секунд.
+    Затем к сайту пропускается один пробный запрос, остальные ждут его
+    результата: если он успешен, запросы возобновляются, иначе пауза
+    удваивается (но не больше max_open_time). Запрос, прождавший дольше
+    max_wait секунд, завершается ошибкой CircuitOpenError.
+    Один экземпляр используется всеми потоками и загрузчиками.
+    """
+
+    def __init__(self, logger: logging.Logger, failure_rate: float = 0.5,
+                 min_requests: int = 10, open_time: float = 30,
+                 max_open_time: float = 600, max_wait: float = 1800):
+        self.logger = logger
+        self.failure_rate = failure_rate
+        self.min_requests = min(min_requests, WINDOW)
+        self.open_time = open_time
+        self.max_open_time = max(max_open_time, open_time)
+        self.max_wait = max_wait
+        self._circuits: Dict[str, Circuit] = {}
+        self._condition = threading.Condition()
+
+    def _get_circuit(self, url: str) -> Circuit:
+        host = urlparse(url).netloc
+        circuit = self._circuits.get(host)
+        if circuit is None:
+            circuit = self._circuits[host] = Circuit(self.open_time)
+        return circuit
+
+    def acquire(self, url: str) -> float:
+        """Ожидание, пока запросы к сайту url приостановлены.
+
+        Возвращает время ожидания в секундах.
+        """
+        start = time.monotonic()
+        with self._condition:
+            circuit = self._get_circuit(url)
+            while circuit.is_open:
+                now = time.monotonic()
+                reopen_at = circuit.opened_at + circuit.open_time
+                if not circuit.probing and now >= reopen_at:
+                    circuit.probing = True
+                    self.logger.info(
+                        f'Circuit {urlparse(url).netloc}: probe request'
+                    )
+                    break
+                if now - start >= self.max_wait:
+                    raise CircuitOpenError(
+                        f'Requests to {urlparse(url).netloc} are suspended '
+                        f'after repeated errors'
+                    )
+                timeout = start + self.max_wait - now
+                if not circuit.probing:
+                    timeout = min(timeout, reopen_at - now)
+                self._condition.wait(timeout)
+        return time.monotonic() - start
+
+    def record(self, url: str, failed: bool, responded: bool = True) -> None:
+        """Учет результата запроса к сайту url.
+
+        failed - временная ошибка запроса, responded - получен ли ответ
+        сервера. Пробный запрос без ответа (с любым исключением) считается
+        неудачным.
+        """
+        with self._condition:
+            circuit = self._get_circuit(url)
+            host = urlparse(url).netloc
+            if circuit.is_open:
+                # результат запросов, отправленных до паузы, не учитывается
+                if not circuit.probing:
+                    return
+                circuit.probing = False
+                if failed or not responded:
+                    circuit.open_time = min(circuit.open_time * 2,
+                                            self.max_open_time)
+                    circuit.opened_at = time.monotonic()
+                    self.logger.warning(
+                        f'Circuit {host}: probe failed, requests suspended '
+                        f'for {circuit.open_time:.0f} s'
+                    )
+                else:
+                    circuit.is_open = False
+                    circuit.results.clear()
+                    circuit.open_time = self.open_time
+                    self.logger.info(f'Circuit {host}: requests resumed')
+                self._condition.notify_all()
+                return
+            circuit.results.append(failed)
+            failures = sum(circuit.results)
+            if (len(circuit.results) >= self.min_requests
+                    and failures >= self.failure_rate * len(circuit.results)):
+                circuit.is_open = True
+                circuit.opened_at = time.monotonic()
+                self.logger.warning(
+                    f'Circuit {host}: {failures} errors in last '
+                    f'{len(circuit.results)} requests, requests suspended '
+                    f'for {circuit.open_time:.0f} s'
+                )
@@ -0,0 +1,100 @@
+"""Индекс файлов в папках отчетов."""
+import os
+import threading
+from os.path import basename, dirname, join, normcase
+from typing import Dict, Set
+
+
+def name_stems(file_name: str):
+    """Все начала имени файла до точки.
+
+    Файл a.b.xls находится по маскам a.* и a.b.*, поэтому для него
+    возвращаются a и a.b.
+    """
+    position = file_name.find('.')
+    while position > 0:
+        yield file_name[:position]
+        position = file_name.find('.', position + 1)
+
+
+class DirIndex():
+    """Индекс имен файлов по папкам.
+
+    Содержимое папки читается один раз при первом обращении к ней, затем
+    индекс обновляется при записи, распаковке и удалении файлов. Поиск
+    файла по маске <имя>.* сводится к поиску в словаре. Скрытые файлы
+    (в том числе временные файлы загрузки) не индексируются, как и при
+    поиске через glob.
+    """
+
+    def __init__(self):
+        # папка -> начало имени -> имена файлов
+        self._dirs: Dict[str, Dict[str, Set[str]]] = {}
+        self._lock = threading.Lock()
+        self._dir_locks: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def _key(file_dir: str) -> str:
+        return normcase(os.path.abspath(file_dir))
+
+    @staticmethod
+    def _add_name(stems: Dict[str, Set[str]], file_name: str) -> None:
+        if file_name.startswith('.'):
+            return
+        for stem in name_stems(file_name):
+            stems.setdefault(normcase(stem), set()).add(file_name)
+
+    def _load(self, file_dir: str) -> Dict[str, Set[str]]:
+        key = self._key(file_dir)
+        with self._lock:
+            stems = self._dirs.get(key)
+            if stems is not None:
+                return stems
+            dir_lock = self._dir_locks.setdefault(key, threading.Lock())
+        # Папку читает только один поток, остальные ждут результат
+        with dir_lock:
+            with self._lock:
+                stems = self._dirs.get(key)
+            if stems is not None:
+                return stems
+            stems = {}
+            try:
+                with os.scandir(file_dir) as entries:
+                    for entry in entries:
+                        self._add_name(stems, entry.name)
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self._dirs[key] = stems
+            return stems
+
+    def find(self, file_dir: str, base_name: str) -> str:
+        """Полный путь к файлу <base_name>.* в папке или ''."""
+        stems = self._load(file_dir)
+        with self._lock:
+            names = stems.get(normcase(base_name))
+            if not names:
+                return ''
+            file_name = min(names)
+        return join(file_dir, file_name)
+
+    def add(self, file_path: str) -> None:
+        """Учет записанного файла."""
+        key = self._key(dirname(file_path))
+        with self._lock:
+            stems = self._dirs.get(key)
+            if stems is not None:
+                self._add_name(stems, basename(file_path))
+
+    def remove(self, file_path: str) -> None:
+        """Учет удаленного файла."""
+        key = self._key(dirname(file_path))
+        file_name = basename(file_path)
+        with self._lock:
+            stems = self._dirs.get(key)
+            if stems is None:
+                return
+            for stem in name_stems(file_name):
+                names = stems.get(normcase(stem))
+                if names is not None:
+                    names.discard(file_name)
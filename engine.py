@@ -0,0 +1,82 @@
+"""Параллельное выполнение заданий на загрузку отчетов."""
+import datetime
+import threading
+from collections import defaultdict
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from itertools import zip_longest
+from typing import Callable, Dict, List
+
+from report_settings import ReportSetting
+
+
+@dataclass(frozen=True)
+class DownloadUnit:
+    """Единица загрузки: участник, отчет, ценовая зона и дата."""
+
+    part_code: str
+    report_code: str
+    zone: str
+    date: datetime.date
+    report: ReportSetting = field(compare=False, hash=False, repr=False)
+    dest_dir: str = field(compare=False, hash=False, default='')
+
+
+def interleave_units(units: List[DownloadUnit]) -> List[DownloadUnit]:
+    """Чередование заданий разных участников.
+
+    Потоки пула не простаивают на семафоре одного участника,
+    пока в очереди есть задания других участников.
+    """
+    by_participant = defaultdict(list)
+    for unit in units:
+        by_participant[unit.part_code].append(unit)
+    result = []
+    for group in zip_longest(*by_participant.values()):
+        result.extend(unit for unit in group if unit is not None)
+    return result
+
+
+def run_units(units: List[DownloadUnit],
+              handler: Callable[[DownloadUnit], int],
+              workers: int = 1,
+              part_workers: int = 1) -> Dict[DownloadUnit, int]:
+    """Выполнение заданий на загрузку.
+
+    handler выполняет одно задание и возвращает количество загруженных
+    файлов. При workers <= 1 задания выполняются последовательно в текущем
+    потоке, иначе - в пуле из workers потоков, причем для одного участника
+    одновременно выполняется не более part_workers заданий.
+    Первая же ошибка отменяет невыполненные задания и пробрасывается дальше.
+    """
+    results = {}
+    if workers <= 1:
+        for unit in units:
+            results[unit] = handler(unit)
+        return results
+
+    semaphores = {
+        unit.part_code: threading.BoundedSemaphore(max(part_workers, 1))
+        for unit in units
+    }
+
+    def run_unit(unit: DownloadUnit) -> int:
+        with semaphores[unit.part_code]:
+            return handler(unit)
+
+    executor = ThreadPoolExecutor(max_workers=workers,
+                                  thread_name_prefix='py_ats')
+    try:
+        futures = {
+            executor.submit(run_unit, unit): unit
+            for unit in interleave_units(units)
+        }
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in done:
+            if future.exception() is not None:
+                raise future.exception()
+        for future, unit in futures.items():
+            results[unit] = future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    return results
@@ -20,3 +20,23 @@ class PartPasswordNotDefinedError(Exception):
 
 class EmailError(Exception):
     pass
+
+
+class SettingsError(Exception):
+    pass
+
+
+class IncompleteDownloadError(DownloadFileError):
+    pass
+
+
+class NpSrSiteError(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class PartialLoadError(Exception):
+    pass
@@ -0,0 +1,83 @@
+"""Ошибки загрузки, не прерывающие запуск, и их итоговая сводка."""
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Iterable, List
+
+from engine import DownloadUnit
+
+# Уровни, на которых ошибка изолируется
+PARTICIPANT = 'participant'
+REPORT = 'report'
+UNIT = 'unit'
+SHARD = 'shard'
+SITE_PAGE = 'page'
+FILE = 'file'
+
+SCOPE_NAMES = {
+    PARTICIPANT: 'участник',
+    REPORT: 'отчет',
+    UNIT: 'дата',
+    SHARD: 'процесс загрузки',
+    SITE_PAGE: 'страница',
+    FILE: 'файл',
+}
+
+
+@dataclass(frozen=True)
+class Failure:
+    """Ошибка загрузки участника, отчета, даты или части запуска."""
+
+    scope: str
+    name: str
+    error: str
+
+
+def unit_name(unit: DownloadUnit) -> str:
+    """Наименование даты загрузки для сводки ошибок."""
+    return (f'{unit.part_code or "-"} {unit.report_code} {unit.zone} '
+            f'{unit.date:%d.%m.%Y}')
+
+
+class FailureLog():
+    """Ошибки запуска.
+
+    Ошибка участника (например, авторизации), отчета или даты записывается
+    в лог и сюда, а загрузка остальных продолжается. В конце запуска
+    выводится сводка (см. summary). Можно использовать из нескольких
+    потоков.
+    """
+
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+        self._failures: List[Failure] = []
+        self._lock = threading.Lock()
+
+    def add(self, scope: str, name: str, error: Exception) -> None:
+        """Учет ошибки (с записью в лог)."""
+        self.logger.exception(f'Error loading {scope} {name}: {error}',
+                              exc_info=error)
+        with self._lock:
+            self._failures.append(Failure(scope, name, str(error)))
+
+    def extend(self, failures: Iterable[Failure]) -> None:
+        """Добавление ошибок другой части запуска (процесса пула)."""
+        with self._lock:
+            self._failures.extend(failures)
+
+    def items(self) -> List[Failure]:
+        with self._lock:
+            return list(self._failures)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._failures)
+
+    def summary(self) -> str:
+        """Сводка ошибок запуска."""
+        failures = self.items()
+        lines = [f'Ошибок загрузки: {len(failures)}']
+        for failure in failures:
+            lines.append(f'  {SCOPE_NAMES.get(failure.scope, failure.scope)} '
+                         f'{failure.name}: {failure.error}')
+        return '\n'.join(lines)
@@ -0,0 +1,301 @@
+"""Общая часть загрузчиков с сайтов: сессия, ограничение скорости, повторы
+при временных ошибках и потоковая загрузка файлов с докачкой."""
+import time
+from dataclasses import dataclass
+from http import HTTPStatus
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+
+from blob_store import HashingFile
+from exceptions import DownloadFileError, IncompleteDownloadError
+from metrics import CIRCUIT_WAIT, RETRY_WAIT, THROTTLE
+from retry import READ_ERROR, classify_exception, classify_status
+
+
+@dataclass(frozen=True)
+class RemoteFile:
+    """Файл источника, загружаемый по постоянному адресу, и его метаданные
+    на момент последней загрузки (для проверки изменений)."""
+
+    url: str
+    file_name: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    size: Optional[int]
+    sha256: Optional[str]
+
+
+def get_conditional_headers(known: Optional[RemoteFile]) -> Dict:
+    """Заголовки условного запроса файла (If-None-Match/If-Modified-Since)."""
+    headers = {}
+    if known is not None:
+        if known.etag:
+            headers['If-None-Match'] = known.etag
+        if known.last_modified:
+            headers['If-Modified-Since'] = known.last_modified
+    return headers
+
+
+def is_unchanged(response: requests.Response,
+                 known: Optional[RemoteFile]) -> bool:
+    """Совпадает ли файл на сайте (по заголовкам ответа) с загруженным ранее.
+
+    Сравниваются ETag либо Last-Modified и размер, а если сервер их не
+    передает или они не были записаны - только размер.
+    """
+    if known is None:
+        return False
+    if response.status_code == HTTPStatus.NOT_MODIFIED:
+        return True
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    length = response.headers.get('Content-Length')
+    if 'Content-Encoding' in response.headers:
+        length = None
+    if etag and known.etag:
+        return etag == known.etag
+    if last_modified and known.last_modified:
+        return (last_modified == known.last_modified
+                and (length is None or known.size is None
+                     or int(length) == known.size))
+    return (length is not None and known.size is not None
+            and int(length) == known.size)
+
+
+class HttpLoader():
+    """Загрузчик с сайта через общий пул соединений.
+
+    Запросы проходят через ограничитель скорости rate_limiter и
+    повторяются при временных ошибках по политике retry_policy, запросы
+    и объем данных учитываются в metrics в группе part_code.
+    """
+
+    def __init__(self, logger, verify_status, pool_size=10,
+                 rate_limiter=None, chunk_size=65536, session_manager=None,
+                 timeout=(10, 60), retry_policy=None, metrics=None,
+                 quiet=False, circuit_breaker=None):
+        self.part_code = None
+        self.logger = logger
+        self.session = None
+        self.verify_status = verify_status
+        # Размер пула соединений сессии (не меньше числа потоков загрузки)
+        self.pool_size = pool_size
+        # Общий для всех сессий ограничитель скорости (AdaptiveRateLimiter)
+        self.rate_limiter = rate_limiter
+        # Размер части файла при потоковой загрузке (в байтах)
+        self.chunk_size = chunk_size
+        # Общий пул соединений и хранилище кук (SessionManager)
+        self.session_manager = session_manager
+        # Таймауты соединения и чтения ответа (в секундах)
+        self.timeout = timeout
+        # Политика повторов при временных ошибках (RetryPolicy)
+        self.retry_policy = retry_policy
+        # Метрики запуска (RunMetrics)
+        self.metrics = metrics
+        # Без вывода на экран сообщений о каждой дате и файле
+        self.quiet = quiet
+        # Общая для всех загрузчиков приостановка запросов к сайту при
+        # всплеске ошибок (CircuitBreaker)
+        self.circuit_breaker = circuit_breaker
+
+    def create_session(self) -> requests.Session:
+        """Создание сессии с пулом соединений под число потоков."""
+        if self.session_manager is not None:
+            return self.session_manager.create_session()
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def request(self, method: str, url: str,
+                **kwargs) -> requests.Response:
+        """HTTP-запрос к сайту через ограничитель скорости (см. send)."""
+        return self.send(method, url, **kwargs)
+
+    def send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Отправка запроса через ограничитель скорости.
+
+        Запрос, не удавшийся из-за временной ошибки (обрыв соединения,
+        таймаут, ответ 429 или 5xx), повторяется по политике retry_policy.
+        Если попытки исчерпаны, возвращается последний ответ сервера либо
+        выбрасывается последнее исключение. Пока запросы к сайту
+        приостановлены (circuit_breaker), запрос ждет.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            if self.circuit_breaker is not None:
+                self.add_wait(CIRCUIT_WAIT,
+                              self.circuit_breaker.acquire(url))
+            if self.rate_limiter is not None:
+                self.add_wait(THROTTLE, self.rate_limiter.acquire())
+            try:
+                response = self.session.request(
+                    method, url, verify=self.verify_status, **kwargs
+                )
+            except requests.exceptions.RequestException as exception:
+                if self.metrics is not None:
+                    self.metrics.add(self.part_code, requests=1)
+                if self.rate_limiter is not None:
+                    self.rate_limiter.record_error(exception)
+                kind = classify_exception(exception)
+                self.record_result(url, kind, responded=False)
+                if not self.should_retry(kind, attempt, method):
+                    raise
+                self.wait_retry(kind, attempt, url, exception)
+            except Exception:
+                self.record_result(url, None, responded=False)
+                raise
+            else:
+                kind = classify_status(response.status_code)
+                self.record_result(url, kind)
+                if self.metrics is not None:
+                    # тело потокового ответа учитывается при его чтении
+                    self.metrics.add(
+                        self.part_code, requests=1,
+                        bytes=0 if kwargs.get('stream') else len(
+                            response.content)
+                    )
+                if self.rate_limiter is not None:
+                    self.rate_limiter.record_response(
+                        response.status_code,
+                        response.elapsed.total_seconds(),
+                        response.headers.get('Retry-After')
+                    )
+                if not self.should_retry(kind, attempt, method):
+                    return response
+                response.close()
+                self.wait_retry(kind, attempt, url,
+                                f'response code {response.status_code}',
+                                response.headers.get('Retry-After'))
+            attempt += 1
+
+    def record_result(self, url: str, kind: Optional[str],
+                      responded: bool = True) -> None:
+        """Учет результата запроса (kind - вид временной ошибки либо None,
+        responded - получен ли ответ) для приостановки запросов к сайту."""
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record(url, kind is not None, responded)
+
+    def should_retry(self, kind: Optional[str], attempt: int,
+                     method: str = 'GET') -> bool:
+        """Нужно ли повторять запрос после неудачной попытки."""
+        return (self.retry_policy is not None
+                and self.retry_policy.should_retry(kind, attempt, method))
+
+    def wait_retry(self, kind: str, attempt: int, url: str, reason,
+                   retry_after: Optional[str] = None) -> None:
+        """Пауза перед повтором запроса."""
+        delay = self.retry_policy.delay(kind, attempt, retry_after)
+        self.logger.warning(
+            f'Request {url} failed ({kind}: {reason}), '
+            f'retry {attempt + 1} in {delay:.1f} s'
+        )
+        time.sleep(delay)
+        self.add_wait(RETRY_WAIT, delay)
+
+    def add_wait(self, phase: str, seconds: float) -> None:
+        """Учет времени ожидания в метриках запуска."""
+        if self.metrics is not None:
+            self.metrics.add_wait(phase, seconds)
+
+    @staticmethod
+    def get_resume_headers(response: requests.Response,
+                           received: int) -> Dict:
+        """Заголовки запроса оставшейся части файла (Range/If-Range).
+
+        Докачка возможна, только если сервер принимает запросы диапазонов
+        и тело ответа не сжато (диапазон задается в байтах сжатого тела).
+        If-Range гарантирует, что при изменении файла на сервере он будет
+        загружен заново целиком.
+        """
+        if (received == 0
+                or response.headers.get('Accept-Ranges', '').lower() == 'none'
+                or 'Content-Encoding' in response.headers):
+            return {}
+        etag = response.headers.get('ETag')
+        validator = (etag if etag and not etag.startswith('W/')
+                     else response.headers.get('Last-Modified'))
+        if not validator:
+            return {}
+        return {'Range': f'bytes={received}-', 'If-Range': validator}
+
+    def copy_response(self, response: requests.Response,
+                      reopen: Callable[[Optional[Dict]], requests.Response],
+                      fileobj, file_name: str) -> Tuple[int, str]:
+        """Запись потокового ответа в файловый объект с докачкой.
+
+        Если соединение оборвалось во время загрузки, файл запрашивается
+        заново (reopen с заголовками докачки либо None) по политике
+        retry_policy: с места обрыва (запрос Range), если сервер это
+        поддерживает, иначе с начала.
+        Возвращает количество записанных байт и SHA-256 содержимого
+        (считается по мере загрузки).
+        """
+        fileobj = HashingFile(fileobj)
+        start = fileobj.tell()
+        attempt = 0
+        while True:
+            try:
+                with response:
+                    self.copy_stream(response, fileobj, file_name)
+                return fileobj.tell() - start, fileobj.hexdigest()
+            except (requests.exceptions.RequestException,
+                    IncompleteDownloadError) as exception:
+                kind = classify_exception(exception) or READ_ERROR
+                if not self.should_retry(kind, attempt):
+                    raise DownloadFileError(
+                        f'Bad response with loading file {file_name}. '
+                        f'{exception}'
+                    )
+                received = fileobj.tell() - start
+                headers = self.get_resume_headers(response, received)
+                self.wait_retry(kind, attempt, file_name,
+                                f'received {received} bytes: {exception}')
+            attempt += 1
+            response = reopen(headers)
+            content_range = response.headers.get('Content-Range', '')
+            if (response.status_code == HTTPStatus.PARTIAL_CONTENT
+                    and content_range.startswith(f'bytes {received}-')):
+                self.logger.info(
+                    f'Resume file {file_name} from byte {received}'
+                )
+            else:
+                if response.status_code == HTTPStatus.PARTIAL_CONTENT:
+                    # сервер вернул не тот диапазон - загружаем заново
+                    response.close()
+                    response = reopen(None)
+                fileobj.seek(start)
+                fileobj.truncate()
+
+    def copy_stream(self, response: requests.Response, fileobj,
+                    report_file: str) -> int:
+        """Копирование тела ответа в файловый объект частями.
+
+        Возвращает количество записанных байт.
+        """
+        size = 0
+        try:
+            for chunk in response.iter_content(self.chunk_size):
+                if self.rate_limiter is not None:
+                    self.add_wait(THROTTLE,
+                                  self.rate_limiter.consume(len(chunk)))
+                fileobj.write(chunk)
+                size += len(chunk)
+        finally:
+            if self.metrics is not None:
+                self.metrics.add(self.part_code, bytes=size)
+        content_length = response.headers.get('Content-Length')
+        if (content_length is not None
+                and 'Content-Encoding' not in response.headers
+                and int(content_length) != size):
+            raise IncompleteDownloadError(
+                f'Bad response with loading file {report_file}. '
+                f'Received {size} of {content_length} bytes'
+            )
+        return size
@@ -0,0 +1,96 @@
+"""Асинхронная запись лога и структурированные записи (JSON lines)."""
+import atexit
+import copy
+import datetime
+import json
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from engine import DownloadUnit
+
+# Поля структурированной записи (передаются в extra записи лога)
+FIELDS = ('participant', 'report_code', 'zone', 'date', 'fid', 'bytes',
+          'duration')
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON: время, уровень, сообщение и поля
+    FIELDS, если они заданы в записи."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.datetime.fromtimestamp(
+                record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class RecordQueueHandler(QueueHandler):
+    """Передача записей лога в очередь.
+
+    В отличие от QueueHandler текст исключения не добавляется
+    к сообщению, а остается в exc_text записи: обычный лог выводит его
+    после сообщения, а структурированный - в поле exception.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        # exc_info не передается через очередь процессов (pickle)
+        record.exc_info = None
+        return record
+
+
+def unit_fields(unit: DownloadUnit, fid: Optional[str] = None,
+                size: Optional[int] = None,
+                start: Optional[float] = None) -> Dict:
+    """Поля структурированной записи о файле единицы загрузки unit.
+
+    start - время начала загрузки файла (time.monotonic()).
+    """
+    fields = {
+        'participant': unit.part_code,
+        'report_code': unit.report_code,
+        'zone': unit.zone,
+        'date': unit.date.isoformat(),
+        'fid': fid,
+        'bytes': size,
+    }
+    if start is not None:
+        fields['duration'] = round(time.monotonic() - start, 3)
+    return fields
+
+
+def start_queue_logging(logger: logging.Logger,
+                        *handlers: logging.Handler) -> QueueListener:
+    """Запись лога через очередь.
+
+    Логгер только кладет записи в очередь, а в handlers (файлы лога) их
+    пишет отдельный поток, поэтому загрузка не ждет записи лога на диск.
+    Оставшиеся в очереди записи дописываются при завершении программы.
+    """
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers,
+                             respect_handler_level=True)
+    logger.addHandler(RecordQueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
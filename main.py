@@ -2,57 +2,71 @@
 # coding: utf-8
 
 """Скрипт по загрузке данных с сайта АО "АТС"."""
+import cProfile
 import datetime
+import functools
 import getpass
-import glob
 import logging
+import multiprocessing
 import os
+import pstats
+import signal
 import sys
 import time
 import xml.etree.ElementTree as ElementTree
-import zipfile
-from logging.handlers import RotatingFileHandler
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+from logging.handlers import QueueListener, RotatingFileHandler
 from os.path import basename, dirname, exists, join, splitext
-from typing import List
+from typing import Callable, List, Optional
 
 import keyring
 import urllib3
 from dotenv import load_dotenv
 
+import np_sr
 from atsPwdLoader import AtsPwdLoader
-from sendMail import send_mail
-
-
-def get_exist_file_name(file_dir: str, file_mask: str) -> str:
-    """Функция проверки наличия файла в папке по маске."""
-    file_path = join(file_dir, file_mask)
-    # Получаем список файлов, удовлетворяющих маске
-    res0 = glob.glob(file_path)
-    # Если список файлов не пустой,
-    # то возвращаем полный путь к первому найденному файлу
-    if bool(len(res0) > 0):
-        return join(file_dir, res0[0])
-    return ''
-
-
-def convert_path(path: str, ucode: str, region: str, date1) -> str:
-    """Конвертируем строку."""
-    replace_masks = {
-        '%USERCODE%': ucode,
-        '%REGION%': region,
-        '%YEAR%': date1.strftime('%Y'),
-        '%MONTH%': date1.strftime('%m'),
-        '%DAY%': date1.strftime('%d')
-    }
-    for old_str, new_str in replace_masks.items():
-        path = path.replace(old_str, new_str)
-    return path
+from backfill import JOB_SETTINGS, BackfillJob, finish_job
+from blob_store import BlobStore
+from catalog import Catalog
+from circuit_breaker import CircuitBreaker
+from dir_index import DirIndex
+from engine import DownloadUnit, run_units
+from failures import (FILE, PARTICIPANT, REPORT, SHARD, SITE_PAGE, UNIT,
+                      FailureLog, unit_name)
+from exceptions import EmailError, PartialLoadError
+from http_loader import RemoteFile
+from log_pipeline import (JsonLinesFormatter, RecordQueueHandler,
+                          start_queue_logging, unit_fields)
+from manifest import Manifest
+from metrics import DOWNLOAD, FS_CHECK, LOGIN, PAGE, RunMetrics
+from notifier import Digests, Notifier
+from page_cache import PageCache
+from publication import (PublicationPolicy, exclude_unpublished_units,
+                         get_confirmed_empty_units)
+from planner import (advance_watermark, exclude_complete_units,
+                     get_incremental_start, get_report_zones,
+                     is_report_selected, plan_units)
+from report_settings import LoadFileType, load_report_settings
+from rate_limiter import AdaptiveRateLimiter
+from retry import RetryPolicy
+from scheduler import Scheduler
+from session_manager import SessionManager
+from unpacker import Unpacker
 
 
 def get_logger() -> logging.Logger:
-    """Инициализация логгера."""
+    """Инициализация логгера.
+
+    Записи пишутся в файл лога (и в LOG_JSON_FILE, если он задан) отдельным
+    потоком через очередь (см. start_queue_logging).
+    """
 
     _logger = logging.getLogger('py_ats')
+    # Логгер уже настроен: повторный запуск в том же процессе либо процесс
+    # загрузки, пишущий лог через родительский процесс (processes=N)
+    if _logger.handlers:
+        return _logger
     _logger.setLevel(logging.INFO)
 
     # Если папки с логом нет, то создаем её
@@ -65,8 +79,21 @@ def get_logger() -> logging.Logger:
     # задаем форматирование
     _formatter = logging.Formatter('%(asctime)s - %(levelname)s: %(message)s')
     _fh.setFormatter(_formatter)
+    _handlers = [_fh]
+
+    # Структурированный лог: одна запись JSON на строку
+    LOG_JSON_FILE = os.environ.get("LOG_JSON_FILE")                         # noqa
+    if LOG_JSON_FILE:
+        if dirname(LOG_JSON_FILE):
+            os.makedirs(dirname(LOG_JSON_FILE), exist_ok=True)
+        _jh = RotatingFileHandler(LOG_JSON_FILE,
+                                  maxBytes=10000000, backupCount=5,
+                                  encoding='utf-8')
+        _jh.setFormatter(JsonLinesFormatter())
+        _handlers.append(_jh)
+
     # добавляем handler в логгер
-    _logger.addHandler(_fh)
+    start_queue_logging(_logger, *_handlers)
     return _logger
 
 
@@ -150,6 +177,15 @@ def get_dates(scr_settings, max_timeshift):
     return dt1, dt2
 
 
+def is_incremental_mode(scr_settings) -> bool:
+    """Проверка режима загрузки (параметр mode)."""
+    mode = scr_settings.get('mode', 'full')
+    if mode not in ('full', 'incremental'):
+        print("Параметр mode может принимать значения full или incremental!")
+        sys.exit()
+    return mode == 'incremental'
+
+
 def get_participant_settings(reportcode_args: str, load_type: str) -> List:
     """Чтение настроек участников ОРЭМ."""
     if reportcode_args == '':
@@ -187,40 +223,275 @@ def get_participant_settings(reportcode_args: str, load_type: str) -> List:
     return part_settings
 
 
-def unpack_archive(dest_dir, file_name, logger):
-    """Распаковка архива в нужную директорию."""
-    try:
-        with zipfile.ZipFile(file_name) as z:
-            z.extractall(dest_dir)
-        os.remove(file_name)
-    except zipfile.BadZipFile:
-        logger.error(
-            (f'Bad zip file. Error with unpacking '
-             f'{basename(file_name)}')
-        )
-        print(f'Invalid file {file_name}')
-    except IOError:
-        logger.error(f"IOError with inpacking file {file_name}")
-    except Exception as err:
-        logger.error(f"Unknown error with inpacking file {file_name}: {err}")
+def get_publication_policy() -> PublicationPolicy:
+    """Правила повторного запроса пустых страниц отчетов (из окружения)."""
+    return PublicationPolicy(
+        base_ttl=float(os.environ.get("NEGATIVE_CACHE_TTL", '1')),
+        max_ttl=float(os.environ.get("NEGATIVE_CACHE_MAX_TTL", '168')),
+        max_misses=int(os.environ.get("NEGATIVE_CACHE_MAX_MISSES", '5')),
+        margin=float(os.environ.get("PUBLICATION_MARGIN", '1'))
+    )
+
+
+def get_circuit_breaker(logger: logging.Logger) -> Optional[CircuitBreaker]:
+    """Приостановка запросов к сайтам при всплеске ошибок (из окружения).
+
+    При CIRCUIT_FAILURE_RATE=0 запросы не приостанавливаются.
+    """
+    failure_rate = float(os.environ.get("CIRCUIT_FAILURE_RATE", '0.5'))
+    if failure_rate <= 0:
+        return None
+    return CircuitBreaker(
+        logger,
+        failure_rate=failure_rate,
+        min_requests=int(os.environ.get("CIRCUIT_MIN_REQUESTS", '10')),
+        open_time=float(os.environ.get("CIRCUIT_OPEN_TIME", '30')),
+        max_open_time=float(os.environ.get("CIRCUIT_MAX_OPEN_TIME", '600')),
+        max_wait=float(os.environ.get("CIRCUIT_MAX_WAIT", '1800'))
+    )
 
 
-def load_from_main_source(script_settings):
+def load_unit(loader: AtsPwdLoader, unit: DownloadUnit, overwrite: str,
+              logger: logging.Logger, unpacker: Unpacker,
+              spool_size: int, dir_index: DirIndex,
+              manifest: Manifest = None, metrics: RunMetrics = None,
+              catalog: Catalog = None,
+              on_done: Optional[Callable[[bool], None]] = None) -> int:
+    """Загрузка файлов отчета за одну дату и ценовую зону.
+
+    Возвращает количество загруженных файлов. Наличие файлов на диске
+    проверяется по индексу dir_index. Архивы распаковываются
+    в фоне пулом unpacker. Загруженные файлы и завершение загрузки
+    (после распаковки всех архивов) отмечаются в журнале manifest,
+    записанные в папку отчета файлы - в каталоге catalog. Время этапов,
+    запросы и объем данных учитываются в metrics. После распаковки всех
+    архивов вызывается on_done (True, если все распакованы успешно).
+    """
+    if metrics is None:
+        metrics = RunMetrics()
+    with metrics.group(unit.part_code, unit.report_code, unit.zone):
+        files_count = load_unit_files(loader, unit, overwrite, unpacker,
+                                      spool_size, dir_index, manifest,
+                                      metrics, catalog, on_done)
+        metrics.add(unit.part_code, units=1, files=files_count)
+    return files_count
+
+
+def load_unit_files(loader: AtsPwdLoader, unit: DownloadUnit,
+                    overwrite: str, unpacker: Unpacker, spool_size: int,
+                    dir_index: DirIndex, manifest: Manifest,
+                    metrics: RunMetrics, catalog: Catalog = None,
+                    on_done: Optional[Callable[[bool], None]] = None) -> int:
+    """Загрузка файлов отчета за одну дату и ценовую зону (см. load_unit)."""
+    report = unit.report
+    dest_dir = unit.dest_dir
+
+    if not loader.quiet:
+        print(unit.date)
+
+    # Если целевой папки нет, но создаем её
+    with metrics.timer(FS_CHECK):
+        os.makedirs(dest_dir, exist_ok=True)
+
+    # загрузка страницы отчета
+    with metrics.timer(PAGE):
+        response = loader.load_report_url(
+            zone=unit.zone,
+            report_code=report.code,
+            report_date=unit.date.strftime('%Y%m%d')
+        )
+
+    report_files = loader.get_report_files_from_url(response)
+    if manifest is not None:
+        if not report_files:
+            manifest.record_empty(unit)
+        elif manifest.clear_empty(unit):
+            # Файлы появились после пустых проверок - время публикации
+            manifest.record_publication(unit, datetime.datetime.now())
+
+    files_count = 0
+    unpack_futures = []
+    overwrite = overwrite.lower()
+    zip_report = report.load_file_type == LoadFileType.ZIP
+    blob_store = unpacker.blob_store
+    for fid, report_file in report_files.items():
+        base_name = splitext(report_file)[0]
+        # Файл, загруженный ранее: при overwrite=changed он загружается
+        # заново, только если изменился на сайте
+        known_file = None
+        with metrics.timer(FS_CHECK):
+            exist_file_name = dir_index.find(dest_dir, base_name)
+            if exist_file_name != "" and overwrite == 'false':
+                continue
+            if exist_file_name != "" and overwrite == 'true':
+                os.remove(exist_file_name)
+                dir_index.remove(exist_file_name)
+            if exist_file_name != "" and overwrite == 'changed':
+                if manifest is not None:
+                    known_file = manifest.get_file(unit, fid)
+                if known_file is None and not report.is_need_to_unpack:
+                    # файл загружен без записи в журнал - сравнивается
+                    # только размер
+                    known_file = RemoteFile(
+                        url=fid, file_name=basename(exist_file_name),
+                        etag=None, last_modified=None,
+                        size=os.path.getsize(exist_file_name), sha256=None
+                    )
+
+        start = time.monotonic()
+        # Файл, содержимое которого уже есть в хранилище (тот же fid
+        # загружался в другую папку), повторно не скачивается
+        stored_file = None
+        if (blob_store is not None and manifest is not None
+                and overwrite == 'false'):
+            stored_file = manifest.find_file(fid)
+            if (stored_file is not None
+                    and not blob_store.exists(stored_file.sha256)):
+                stored_file = None
+
+        # Загрузка файла отчета
+        if report.is_need_to_unpack:
+            # Архив распаковывается в фоне прямо из временного файла,
+            # без записи в папку отчета
+            if stored_file is not None:
+                remote_file = stored_file
+                archive = blob_store.open(remote_file.sha256)
+            else:
+                with metrics.timer(DOWNLOAD):
+                    downloaded = loader.download_to_spool(
+                        fid,
+                        zip=zip_report,
+                        report_file=report_file,
+                        max_size=spool_size,
+                        known=known_file
+                    )
+                if downloaded is None:
+                    # файл не изменился на сайте
+                    continue
+                remote_file, archive = downloaded
+                if blob_store is not None:
+                    with metrics.timer(FS_CHECK):
+                        blob_store.add_stream(archive, remote_file.sha256)
+                    archive.seek(0)
+            file_name = remote_file.file_name
+            on_file = None
+            if catalog is not None:
+                on_file = functools.partial(catalog.add, unit, fid)
+            unpack_futures.append(
+                unpacker.submit(dest_dir, archive, file_name, on_file)
+            )
+        else:
+            if stored_file is not None:
+                remote_file = stored_file
+                file_name = join(dest_dir, remote_file.file_name)
+                with metrics.timer(FS_CHECK):
+                    blob_store.materialize(remote_file.sha256, file_name)
+            else:
+                with metrics.timer(DOWNLOAD):
+                    remote_file = loader.download_file(
+                        fid,
+                        zip=zip_report,
+                        report_file=report_file,
+                        dest_dir=dest_dir,
+                        known=known_file
+                    )
+                if remote_file is None:
+                    # файл не изменился на сайте
+                    continue
+                file_name = remote_file.file_name
+                if blob_store is not None:
+                    with metrics.timer(FS_CHECK):
+                        blob_store.add_file(file_name, remote_file.sha256)
+            # Измененный файл пришел под другим именем - прежний удаляется
+            # после успешной загрузки нового
+            if (known_file is not None
+                    and exist_file_name != file_name
+                    and exists(exist_file_name)):
+                os.remove(exist_file_name)
+                dir_index.remove(exist_file_name)
+            dir_index.add(file_name)
+            if catalog is not None:
+                catalog.add(unit, fid, file_name, remote_file.size,
+                            remote_file.sha256)
+        if manifest is not None:
+            manifest.record_file(unit, fid, basename(file_name),
+                                 remote_file.size, remote_file.sha256,
+                                 remote_file.etag, remote_file.last_modified)
+        loader.logger.info(
+            f'File loaded: {basename(file_name)}',
+            extra=unit_fields(unit, fid, remote_file.size, start)
+        )
+        files_count = files_count + 1
+
+    def mark_complete(is_unpacked: bool) -> None:
+        if is_unpacked and manifest is not None and report_files:
+            manifest.mark_complete(unit, files_count)
+        if on_done is not None:
+            on_done(is_unpacked)
+    unpacker.on_complete(unpack_futures, mark_complete)
+    return files_count
+
+
+def open_backfill_job(script_settings, manifest_file, max_timeshift):
+    """Новое задание догрузки истории (backfill=true) либо продолжение
+    прерванного задания (resume=N).
+
+    Период (в виде дат), участники, отчеты, тип загрузки и режим
+    перезаписи нового задания сохраняются в журнале загрузки, при
+    продолжении они берутся из журнала. Возвращает параметры запуска
+    с номером задания (job_id).
+    """
+    manifest = Manifest(manifest_file)
+    try:
+        if 'resume' in script_settings:
+            job_id = int(script_settings['resume'])
+            job = manifest.get_job(job_id)
+            if job is None:
+                print(f"Задание {job_id} не найдено!")
+                sys.exit()
+            job_settings, _, finished_at = job
+            if finished_at is not None:
+                print(f'Задание {job_id} уже выполнено '
+                      f'{finished_at:%d.%m.%Y %H:%M}')
+            else:
+                print(f'Продолжение задания {job_id}')
+        else:
+            dt1, dt2 = get_dates(script_settings, max_timeshift)
+            job_settings = {key: script_settings[key]
+                            for key in JOB_SETTINGS
+                            if key in script_settings}
+            job_settings['dt1'] = dt1.strftime('%Y%m%d')
+            job_settings['dt2'] = dt2.strftime('%Y%m%d')
+            job_id = manifest.create_job(job_settings)
+            print(f'Задание {job_id}: при сбое загрузку можно продолжить '
+                  f'с параметром resume={job_id}')
+    finally:
+        manifest.close()
+    # Задание загружается полностью (mode=full) за сохраненный период
+    settings = {key: value for key, value in script_settings.items()
+                if key not in JOB_SETTINGS + ('dt', 'mode', 'backfill',
+                                              'resume')}
+    settings.update(job_settings)
+    settings['job_id'] = str(job_id)
+    return settings
+
+
+def load_from_main_source(script_settings, shard=False):
+    """Загрузка отчетов с сайта АТС.
+
+    При shard=True (процесс пула при processes=N) письма не отправляются,
+    а метрики не сохраняются: они возвращаются родительскому процессу.
+    """
     start_time = datetime.datetime.now()
 
     # Загрузка переменных окружения
     dotenv_path = join(dirname(__file__), '.env')
     load_dotenv(dotenv_path)
 
-    # переменные для искусственной "заморозки" программы. Такая "заморозка"
-    # нужна, чтобы сайт АТС не снижал искусственно скорость загрузки отчетов
-    # Интервал времени между "заморозками" программы (в секундах)
-    TIME_BETWEEN_TIMEOUT = int(os.environ.get("TIME_BETWEEN_TIMEOUT"))      # noqa
-
     VERIFY_STATUS = int(os.environ.get("VERIFY_STATUS")) == 1     # noqa
-
-    # Длительность "заморозки" программы
-    TIMEOUT_IN_SEC = int(os.environ.get("TIMEOUT_IN_SECONDS"))              # noqa
+    # Адрес сайта АТС
+    ATS_BASE_URL = os.environ.get("ATS_BASE_URL",                           # noqa
+                                  'https://www.atsenergo.ru')
 
     # Определение начальных директорий для настроек и для загрузки отчетов
     HOME_DIR_FOR_SAVE = os.environ.get("HOME_DIR_FOR_SAVE")                 # noqa
@@ -230,6 +501,78 @@ def load_from_main_source(script_settings):
 
     MAX_TIMESHIFT = int(os.environ.get("MAX_TIMESHIFT"))                    # noqa
 
+    # Количество потоков загрузки: всего и на одну сессию участника
+    WORKERS = int(script_settings.get(                                      # noqa
+        'workers', os.environ.get("WORKERS", '1')))
+    PART_WORKERS = int(script_settings.get(                                 # noqa
+        'part_workers', os.environ.get("PART_WORKERS", '1')))
+
+    # Количество процессов загрузки: участники (и группы отчетов)
+    # распределяются по процессам со своими сессиями и ограничением скорости
+    PROCESSES = int(script_settings.get(                                    # noqa
+        'processes', os.environ.get("PROCESSES", '1')))
+
+    # Ограничение скорости запросов к сайту АТС: начальная, минимальная и
+    # максимальная частота запросов в секунду и скорость скачивания в байтах
+    # в секунду (0 - без ограничения). Частота подстраивается под ответы
+    # сервера, чтобы сайт АТС не снижал искусственно скорость загрузки
+    RATE_LIMIT_RPS = float(os.environ.get("RATE_LIMIT_RPS", '2'))           # noqa
+    RATE_LIMIT_MIN_RPS = float(os.environ.get("RATE_LIMIT_MIN_RPS", '0.2')) # noqa
+    RATE_LIMIT_MAX_RPS = float(os.environ.get("RATE_LIMIT_MAX_RPS", '10'))  # noqa
+    RATE_LIMIT_BYTES_PER_SEC = float(                                       # noqa
+        os.environ.get("RATE_LIMIT_BYTES_PER_SEC", '0'))
+
+    # Размер части файла при потоковой загрузке (в байтах)
+    DOWNLOAD_CHUNK_SIZE = int(                                              # noqa
+        os.environ.get("DOWNLOAD_CHUNK_SIZE", '65536'))
+
+    # Количество потоков распаковки архивов и размер архива (в байтах),
+    # до которого он хранится в памяти, а не во временном файле
+    UNPACK_WORKERS = int(os.environ.get("UNPACK_WORKERS", '2'))            # noqa
+    SPOOL_MAX_SIZE = int(                                                   # noqa
+        os.environ.get("SPOOL_MAX_SIZE", str(16 * 1024 * 1024)))
+
+    # Хранилище файлов по содержимому: каждый уникальный файл хранится
+    # один раз, в папках отчетов - жесткие ссылки на него (папка должна быть
+    # на том же диске, что и папки отчетов; пустое значение - не использовать)
+    BLOB_STORE_DIR = os.environ.get("BLOB_STORE_DIR")                       # noqa
+
+    # Сохранять ли куки авторизации участников между запусками (в keyring)
+    SESSION_COOKIES = int(os.environ.get("SESSION_COOKIES", '1')) == 1      # noqa
+
+    # Кэш страниц отчетов на диске: файл (если не задан - страницы
+    # кэшируются только в памяти до конца запуска), время жизни страницы
+    # в секундах и максимальный размер кэша в мегабайтах
+    PAGE_CACHE_FILE = os.environ.get("PAGE_CACHE_FILE")                     # noqa
+    PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", '3600'))          # noqa
+    PAGE_CACHE_MAX_MB = int(os.environ.get("PAGE_CACHE_MAX_MB", '50'))      # noqa
+
+    # Таймауты соединения и чтения ответа в секундах, количество попыток
+    # запроса и границы задержки между попытками при временных ошибках
+    CONNECT_TIMEOUT = float(os.environ.get("CONNECT_TIMEOUT", '10'))        # noqa
+    READ_TIMEOUT = float(os.environ.get("READ_TIMEOUT", '60'))              # noqa
+    RETRY_ATTEMPTS = int(os.environ.get("RETRY_ATTEMPTS", '5'))             # noqa
+    RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", '1'))       # noqa
+    RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", '60'))        # noqa
+
+    # Журнал загруженных отчетов и количество последних дней, за которые
+    # отчеты перепроверяются на сайте, даже если они уже были загружены
+    MANIFEST_FILE = os.environ.get("MANIFEST_FILE", 'py_ats.db')            # noqa
+    RECHECK_DAYS = int(script_settings.get(                                 # noqa
+        'recheck_days', os.environ.get("RECHECK_DAYS", '7')))
+
+    # Каталог файлов в папках отчетов для поиска (source_type=catalog),
+    # пустое значение - не вести
+    CATALOG_FILE = os.environ.get("CATALOG_FILE", 'py_ats_catalog.db')      # noqa
+
+    # Файлы с метриками запуска: JSON и текстовый файл для Prometheus
+    # (node_exporter textfile collector), пустое значение - не сохранять
+    METRICS_FILE = os.environ.get("METRICS_FILE", 'LOG/metrics.json')       # noqa
+    METRICS_PROM_FILE = os.environ.get("METRICS_PROM_FILE")                 # noqa
+    # Без вывода на экран сообщений о каждой дате и файле (quiet=true)
+    QUIET = script_settings.get(                                            # noqa
+        'quiet', os.environ.get("QUIET", 'false')).lower() == 'true'
+
     # Создаем логгер
     logger = get_logger()
 
@@ -239,7 +582,24 @@ def load_from_main_source(script_settings):
     if 'load_type' not in script_settings.keys():
         script_settings['load_type'] = 'private'
 
+    # Задание догрузки истории: новое (backfill=true) либо продолжение
+    # прерванного (resume=N)
+    if not shard and (
+            'resume' in script_settings
+            or script_settings.get('backfill', 'false').lower() == 'true'):
+        script_settings = open_backfill_job(script_settings, MANIFEST_FILE,
+                                            MAX_TIMESHIFT)
+
+    if PROCESSES > 1 and not shard:
+        load_in_processes(script_settings, PROCESSES, logger)
+        if 'job_id' in script_settings:
+            manifest = Manifest(MANIFEST_FILE)
+            finish_job(manifest, int(script_settings['job_id']), logger)
+            manifest.close()
+        return
+
     dt1, dt2 = get_dates(script_settings, MAX_TIMESHIFT)
+    incremental = is_incremental_mode(script_settings)
 
     # получаем список настроек участников ОРЭМ
     if 'partcode' not in script_settings:
@@ -256,180 +616,874 @@ def load_from_main_source(script_settings):
     # user_settings = get_user_settings()
 
     logger.info("------------Start download------------")
-    time1 = time.time()
-    # Цикл по участникам
-
+    rate_limiter = AdaptiveRateLimiter(
+        requests_per_sec=RATE_LIMIT_RPS,
+        bytes_per_sec=RATE_LIMIT_BYTES_PER_SEC,
+        min_rate=RATE_LIMIT_MIN_RPS,
+        max_rate=RATE_LIMIT_MAX_RPS,
+        logger=logger
+    )
+    retry_policy = RetryPolicy(max_attempts=RETRY_ATTEMPTS,
+                               base_delay=RETRY_BASE_DELAY,
+                               max_delay=RETRY_MAX_DELAY)
+    circuit_breaker = get_circuit_breaker(logger)
+    failures = FailureLog(logger)
+
+    # Письмо участнику отправляется в фоне, как только загружены все его
+    # отчеты с уведомлением. В процессе пула (shard) строки писем
+    # возвращаются родительскому процессу
     emails_by_receivers = {}
-    for participant in participants:
-        # Создаем список получателей и писем для них
-        if script_settings['load_type'] == 'private':
-            email = participant['user_emails']
-            emails_by_receivers[email] = []
+    notifier = None
+    if shard:
+        def collect_rows(receivers: str, rows: List) -> None:
+            emails_by_receivers.setdefault(receivers, []).extend(rows)
+        digests = Digests(collect_rows)
+    else:
+        notifier = Notifier(logger)
+        digests = Digests(notifier.notify)
+
+    manifest = Manifest(MANIFEST_FILE)
+    publication_policy = get_publication_policy()
+    overwrite = script_settings['overwrite'].lower()
+    complete_units = set()
+    empty_pages = {}
+    # При overwrite=changed загруженные даты перепроверяются на сайте,
+    # а пустые страницы по-прежнему запрашиваются по расписанию
+    if overwrite == 'false':
+        complete_units = manifest.complete_units(dt1, dt2)
+    if overwrite in ('false', 'changed'):
+        empty_pages = manifest.empty_pages(dt1, dt2)
+    publication_lags = manifest.publication_lags()
+    recheck_from = datetime.date.today() - datetime.timedelta(
+        days=RECHECK_DAYS)
+    backfill = None
+    if 'job_id' in script_settings:
+        backfill = BackfillJob(manifest, int(script_settings['job_id']),
+                               logger)
+
+    # Индекс файлов в папках отчетов вместо поиска по маске для каждого файла
+    dir_index = DirIndex()
+    metrics = RunMetrics()
+    blob_store = BlobStore(BLOB_STORE_DIR, logger) if BLOB_STORE_DIR else None
+    catalog = Catalog(CATALOG_FILE) if CATALOG_FILE else None
+    unpacker = Unpacker(logger, workers=UNPACK_WORKERS,
+                        max_pending=2 * max(UNPACK_WORKERS, WORKERS),
+                        dir_index=dir_index, metrics=metrics,
+                        blob_store=blob_store)
+
+    session_manager = SessionManager(
+        logger,
+        pool_size=max(WORKERS, PART_WORKERS, 10),
+        store_cookies=SESSION_COOKIES
+    )
 
-    for participant in participants:
+    page_cache = PageCache(PAGE_CACHE_FILE, ttl=PAGE_CACHE_TTL,
+                           max_bytes=PAGE_CACHE_MAX_MB * 1024 * 1024)
+
+    loaders = {}
+
+    def handle_unit(unit: DownloadUnit) -> int:
+        on_done = None
+        if backfill is not None:
+            on_done = functools.partial(backfill.unit_done, unit)
+        try:
+            files_count = load_unit(loaders[unit.part_code], unit,
+                                    script_settings['overwrite'], logger,
+                                    unpacker, SPOOL_MAX_SIZE, dir_index,
+                                    manifest, metrics, catalog, on_done)
+        except Exception as err:
+            failures.add(UNIT, unit_name(unit), err)
+            files_count = 0
+        digests.unit_done(unit.part_code, unit.report_code, unit.zone,
+                          files_count)
+        return files_count
+
+    # Все задания (участник, отчет, зона) и отметки, с которых они
+    # начинаются, - для сдвига отметок в режиме mode=incremental
+    watermark_groups = []
+    pending_units = []
+
+    def plan_zone(participant, report, zone) -> List[DownloadUnit]:
+        """Задания на загрузку отчета участника по ценовой зоне."""
         part_code = str(participant['user_code']).upper()
+        report_dt1 = dt1
+        if incremental:
+            # Загрузка только дат после последней полностью
+            # загруженной и дней, за которые возможны исправления
+            watermark = manifest.get_watermark(part_code, report.code, zone)
+            report_dt1 = get_incremental_start(report, dt1, dt2, watermark,
+                                               recheck_from)
+        planned_units = plan_units(part_code, report, zone, report_dt1, dt2,
+                                   HOME_DIR_FOR_SAVE)
+        if incremental:
+            watermark_groups.append((part_code, report.code, zone,
+                                     watermark, planned_units))
+        # Задания по датам без уже загруженных дат, которые
+        # не могут измениться, без недавно пустых и еще
+        # не опубликованных дат
+        units = exclude_complete_units(planned_units, complete_units,
+                                       recheck_from)
+        units = exclude_unpublished_units(units, empty_pages,
+                                          publication_lags,
+                                          publication_policy, recheck_from)
+        if backfill is not None:
+            units = backfill.add_units(planned_units, units)
+        if report.notify and participant.get('user_emails'):
+            row_to_send = {
+                'part_code': part_code,
+                'report_name': report.name,
+                'rep_path': join(HOME_DIR_FOR_SAVE,
+                                 report.path.render(part_code, zone, dt2))
+            }
+            digests.add_group(part_code, participant['user_emails'],
+                              report.code, zone, len(units), row_to_send)
+        return units
+
+    # читаем настройки отчетов (персональных и публичных)
+    if script_settings['load_type'] == 'public':
+        report_settings_file = REPORT_SETTINGS_PUB_FILE
+    else:
+        report_settings_file = REPORT_SETTINGS_PRIV_FILE
+    report_settings = load_report_settings(report_settings_file)
 
-        # читаем настройки отчетов (персональных и публичных)
-        report_settings = []
-        if script_settings['load_type'] == 'public':
-            report_settings_file = REPORT_SETTINGS_PUB_FILE
-        else:
-            report_settings_file = REPORT_SETTINGS_PRIV_FILE
-
-        if exists(report_settings_file):
-            root = ElementTree.parse(report_settings_file).getroot()
-            for rep_tag in root.findall('report'):
-                curr_setting = {'name': rep_tag.get('name'),
-                                'code': rep_tag.get('code'),
-                                'notify': rep_tag.get('notify', 'False'),
-                                'code2': rep_tag.get('code2'),
-                                'type': rep_tag.get('type'),
-                                'file_mask': rep_tag.get('fileMask'),
-                                'load_file_type': rep_tag.get('loadFileType'),
-                                'is_need_to_unpack': rep_tag.get('unpack'),
-                                'is_need_to_load': rep_tag.get('needToLoad', 'true'),
-                                'zone': rep_tag.get('region'),
-                                'path': rep_tag.get('path')}
-                if rep_tag.get('period') is None:
-                    curr_setting['period'] = 'day'
-                else:
-                    curr_setting['period'] = rep_tag.get('period')
-                report_settings.append(curr_setting)
+    # Цикл по участникам. Ошибка участника (например, авторизации), отчета
+    # или даты записывается в failures и не прерывает загрузку остальных
+    for participant in participants:
+        part_code = str(participant['user_code']).upper()
 
         try:
-            loader = AtsPwdLoader(logger=logger, verify_status=VERIFY_STATUS)
+            loader = AtsPwdLoader(logger=logger, verify_status=VERIFY_STATUS,
+                                  rate_limiter=rate_limiter,
+                                  chunk_size=DOWNLOAD_CHUNK_SIZE,
+                                  session_manager=session_manager,
+                                  page_cache=page_cache,
+                                  timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                                  retry_policy=retry_policy,
+                                  base_url=ATS_BASE_URL,
+                                  metrics=metrics, quiet=QUIET,
+                                  circuit_breaker=circuit_breaker)
             loader.part_code = part_code
             loader.user_name = participant['user_name']
 
-            if script_settings['load_type'] == 'private':
-                loader.login()
-            else:
-                loader.init_session()
+            with metrics.timer(LOGIN):
+                if script_settings['load_type'] == 'private':
+                    loader.login()
+                else:
+                    loader.init_session()
+        except Exception as err:
+            print(err)
+            failures.add(PARTICIPANT, part_code or '-', err)
+            continue
+        loaders[part_code] = loader
+
+        # Цикл по отчетам
+        for report in report_settings:
+            if not is_report_selected(report, script_settings):
+                continue
+            print(f"Загрузка отчета {report.name}")
+            try:
+                # Цикл по ценовым зонам
+                for zone in get_report_zones(report, participant):
+                    pending_units.extend(plan_zone(participant, report, zone))
+            except Exception as err:
+                print(err)
+                failures.add(REPORT, f'{part_code or "-"} {report.code}',
+                             err)
+                continue
+
+            # В последовательном режиме отчет загружается сразу
+            # (задание - после планирования всех частей, чтобы
+            # оценка оставшегося времени учитывала все задание)
+            if WORKERS <= 1 and backfill is None:
+                run_units(pending_units, handle_unit)
+                pending_units = []
+        # Новых заданий у участника не будет
+        digests.seal(part_code)
+
+    if pending_units:
+        run_units(pending_units, handle_unit, workers=WORKERS,
+                  part_workers=PART_WORKERS)
+
+    # Дожидаемся распаковки всех архивов
+    unpacker.close()
+    if backfill is not None and not shard:
+        finish_job(manifest, backfill.job_id, logger)
+
+    # Сдвигаем отметки полностью загруженных дат
+    if incremental:
+        loaded_units = manifest.complete_units(dt1, dt2)
+        empty_units = get_confirmed_empty_units(
+            manifest.empty_pages(dt1, dt2), publication_policy, recheck_from
+        )
+        for (part_code, report_code, zone, watermark,
+             planned_units) in watermark_groups:
+            new_watermark = advance_watermark(watermark, planned_units,
+                                              loaded_units, empty_units)
+            if new_watermark != watermark:
+                manifest.set_watermark(part_code, report_code, zone,
+                                       new_watermark)
+
+    # Сохраняем куки для следующего запуска (сервер мог их обновить)
+    if script_settings['load_type'] == 'private':
+        for part_code, loader in loaders.items():
+            session_manager.save_cookies(part_code, loader.session)
+    session_manager.close()
+
+    page_cache.close()
+    manifest.close()
+    if catalog is not None:
+        catalog.close()
+    metrics.finish()
+    if shard:
+        return {'emails': emails_by_receivers, 'metrics': metrics.summary(),
+                'failures': failures.items()}
+    logger.info(
+        "Download complete. Script execution time: %s",
+        datetime.datetime.now() - start_time
+    )
+    logger.info("Time by phase: %s", metrics.format_phases())
+    if METRICS_FILE:
+        metrics.write_json(METRICS_FILE)
+    if METRICS_PROM_FILE:
+        metrics.write_prometheus(METRICS_PROM_FILE)
+    if failures:
+        # Готовые письма отправляются и при ошибках загрузки
+        flush_notifications(notifier)
+        raise_failures(failures)
+    # Дожидаемся отправки писем
+    notifier.close()
+
+
+def raise_failures(failures: FailureLog) -> None:
+    """Вывод сводки ошибок запуска и завершение с ошибкой."""
+    summary = failures.summary()
+    print(summary)
+    failures.logger.error(summary)
+    raise PartialLoadError(summary)
+
+
+def flush_notifications(notifier: Optional[Notifier]) -> None:
+    """Отправка уже готовых писем перед выходом из-за ошибки загрузки."""
+    if notifier is None:
+        return
+    try:
+        notifier.close()
+    except EmailError:
+        # ошибки отправки уже записаны в лог
+        pass
+
+
+def init_shard_logging(log_queue) -> None:
+    """Настройка лога процесса пула: записи передаются родителю."""
+    logger = logging.getLogger('py_ats')
+    logger.setLevel(logging.INFO)
+    # Обработчики, унаследованные от родительского процесса, не нужны:
+    # лог пишет поток родителя
+    logger.handlers.clear()
+    logger.addHandler(RecordQueueHandler(log_queue))
+
+
+def run_shard(script_settings):
+    """Загрузка одной части (участник и группа отчетов) в процессе пула."""
+    return load_from_main_source(script_settings, shard=True)
+
+
+def split_report_groups(report_codes: List[str],
+                        groups_count: int) -> List[Optional[List[str]]]:
+    """Разбиение кодов отчетов на groups_count групп (None - без разбиения)."""
+    if groups_count <= 1 or len(report_codes) <= 1:
+        return [None]
+    groups_count = min(groups_count, len(report_codes))
+    return [report_codes[i::groups_count] for i in range(groups_count)]
+
+
+def load_in_processes(script_settings, processes: int,
+                      logger: logging.Logger):
+    """Загрузка отчетов в пуле из processes процессов.
+
+    Каждый участник (а при report_groups=N - каждая группа отчетов
+    участника) загружается в отдельном задании пула со своей авторизацией,
+    сессией и ограничением скорости. Записи лога, метрики и строки
+    уведомлений собираются в родительском процессе. Ошибка одного задания
+    не прерывает остальные; ошибки заданий и процессов собираются в общую
+    сводку, после отправки уведомлений выбрасывается PartialLoadError.
+    """
+    start_time = datetime.datetime.now()
 
-            # Цикл по отчетам
-            for report in report_settings:
-                # проверяем, заданы ли коды участника
-                if 'reportcode' in script_settings.keys():
-                    if (not str(report['code']).lower()
-                            in script_settings['reportcode'].lower().split(',')):
-                        continue
+    REPORT_SETTINGS_PUB_FILE = os.environ.get("REPORT_SETTINGS_PUB_FILE")   # noqa
+    REPORT_SETTINGS_PRIV_FILE = os.environ.get("REPORT_SETTINGS_PRIV_FILE") # noqa
+    # Количество групп, на которые делятся отчеты одного участника
+    REPORT_GROUPS = int(script_settings.get(                                # noqa
+        'report_groups', os.environ.get("REPORT_GROUPS", '1')))
+    METRICS_FILE = os.environ.get("METRICS_FILE", 'LOG/metrics.json')       # noqa
+    METRICS_PROM_FILE = os.environ.get("METRICS_PROM_FILE")                 # noqa
+
+    participants = get_participant_settings(
+        script_settings.get('partcode', ''),
+        script_settings['load_type']
+    )
+    if script_settings['load_type'] == 'public':
+        report_settings = load_report_settings(REPORT_SETTINGS_PUB_FILE)
+    else:
+        report_settings = load_report_settings(REPORT_SETTINGS_PRIV_FILE)
+    report_groups = split_report_groups(
+        [report.code for report in report_settings
+         if is_report_selected(report, script_settings)],
+        REPORT_GROUPS
+    )
 
-                if report['is_need_to_load'] == 'false':
-                    continue
-                print(f"Загрузка отчета {report['name']}")
+    shards = []
+    for participant in participants:
+        for report_group in report_groups:
+            shard_settings = dict(script_settings,
+                                  partcode=str(participant['user_code']))
+            if report_group is not None:
+                shard_settings['reportcode'] = ','.join(report_group)
+            shards.append(shard_settings)
 
-                # Цикл по ценовым зонам
-                if report['zone'] == 'zone':
-                    price_zones = str(participant['zone'])
+    logger.info("------------Start download------------")
+    metrics = RunMetrics()
+    notifier = Notifier(logger)
+    # Количество незавершенных заданий и строки писем по участникам
+    shards_left = {}
+    for shard_settings in shards:
+        part_code = shard_settings['partcode']
+        shards_left[part_code] = shards_left.get(part_code, 0) + 1
+    participant_rows = {}
+    failures = FailureLog(logger)
+    log_queue = multiprocessing.Queue()
+    listener = QueueListener(log_queue, *logger.handlers,
+                             respect_handler_level=True)
+    listener.start()
+    try:
+        with ProcessPoolExecutor(max_workers=processes,
+                                 initializer=init_shard_logging,
+                                 initargs=(log_queue,)) as executor:
+            futures = {executor.submit(run_shard, shard_settings):
+                       shard_settings for shard_settings in shards}
+            for future in as_completed(futures):
+                shard_settings = futures[future]
+                part_code = shard_settings['partcode']
+                shard_name = part_code or '-'
+                if 'reportcode' in shard_settings:
+                    shard_name += f" ({shard_settings['reportcode']})"
+                try:
+                    result = future.result()
+                except Exception as err:
+                    failures.add(SHARD, shard_name, err)
                 else:
-                    price_zones = str(report['zone'])
-
-                for zone in price_zones.split(';'):
-                    # Цикл по датам
-                    files_count = 0
-                    dt = dt1
-                    while dt <= dt2:
-                        time2 = time.time()
-                        if time2 - time1 > TIME_BETWEEN_TIMEOUT:
-                            time1 = time2
-                            print(f"Ожидание {TIMEOUT_IN_SEC} секунды...")
-                            time.sleep(TIMEOUT_IN_SEC)
-
-                        dest_dir = convert_path(
-                            join(HOME_DIR_FOR_SAVE, str(report['path'])),
-                            str(loader.part_code),
-                            zone,
-                            dt
-                        )
-
-                        if report['period'] == 'month' and dt.day != 1:
-                            dt = dt + datetime.timedelta(days=1)
-                            continue
-                        if (report['period'] == 'end_of_month'
-                                and (dt + datetime.timedelta(days=1)).day != 1):
-                            dt = dt + datetime.timedelta(days=1)
-                            continue
-
-                        print(dt)
-
-                        # Если целевой папки нет, но создаем её
-                        if not exists(dest_dir):
-                            os.makedirs(dest_dir)
-
-                        # загрузка страницы отчета
-                        response = loader.load_report_url(
-                            zone=zone,
-                            report_code=report['code'],
-                            report_date=dt.strftime('%Y%m%d')
-                        )
-
-                        report_files = loader.get_report_files_from_url(response)
-
-                        for fid, report_file in report_files.items():
-                            base_name = splitext(report_file)[0]
-                            exist_file_name = get_exist_file_name(
-                                dest_dir,
-                                base_name + '.*'
-                            )
-                            if (exist_file_name != ""
-                                    and script_settings['overwrite'].lower()
-                                    == 'false'):
-                                pass
-                            else:
-                                if (exist_file_name != "" and
-                                        script_settings['overwrite'].lower()
-                                        == 'true'):
-                                    os.remove(exist_file_name)
-
-                                if report['load_file_type'] == 'zip':
-                                    zip_report = True
-                                else:
-                                    zip_report = False
-
-                                # Загрузка файла отчета
-                                file_name = loader.download_file(
-                                    fid,
-                                    zip=zip_report,
-                                    report_file=report_file,
-                                    dest_dir=dest_dir
-                                )
-
-                                if report['is_need_to_unpack'].lower() == 'true':
-                                    unpack_archive(dest_dir, file_name, logger)
-                                files_count = files_count + 1
-
-                                time2 = time.time()
-                                if time2 - time1 > TIME_BETWEEN_TIMEOUT:
-                                    time1 = time2
-                                    print(
-                                        f'Ожидание {TIMEOUT_IN_SEC} секунды...'
-                                    )
-                                    time.sleep(TIMEOUT_IN_SEC)
-                        # for fid, report_file in report_files.items():
-
-                        dt = dt + datetime.timedelta(days=1)
-                    # while dt <= dt2:
-                    if report['notify'].upper() == 'TRUE' and files_count > 0:
-                        row_to_send = {
-                            'part_code': part_code,
-                            'report_name': report['name'],
-                            'rep_path': dest_dir
-                        }
-                        email = participant['user_emails']
-                        emails_by_receivers[email].append(row_to_send)
-                # for zone in ZONE_SETTING.split(';'):
-            # for report_setting in report_settings:
-        except Exception as err:
-            logger.exception(err)
-            print(err)
-            raise Exception(err)
+                    metrics.merge(result['metrics'])
+                    failures.extend(result['failures'])
+                    rows = participant_rows.setdefault(part_code, {})
+                    for email, reports in result['emails'].items():
+                        rows.setdefault(email, []).extend(reports)
+                # Письмо участнику - как только завершены все его задания
+                shards_left[part_code] -= 1
+                if shards_left[part_code] == 0:
+                    for email, reports in participant_rows.pop(
+                            part_code, {}).items():
+                        notifier.notify(email, reports)
+    finally:
+        listener.stop()
+
+    metrics.finish()
     logger.info(
         "Download complete. Script execution time: %s",
         datetime.datetime.now() - start_time
     )
-    for email, reports in emails_by_receivers.items():
-        if len(reports) > 0:
-            send_mail(email, reports, logger)
+    logger.info("Time by phase: %s", metrics.format_phases())
+    if METRICS_FILE:
+        metrics.write_json(METRICS_FILE)
+    if METRICS_PROM_FILE:
+        metrics.write_prometheus(METRICS_PROM_FILE)
+    if failures:
+        # Готовые письма отправляются и при ошибках загрузки
+        flush_notifications(notifier)
+        raise_failures(failures)
+    notifier.close()
+
+
+def plan_from_main_source(script_settings):
+    """Вывод плана загрузки без обращения к сайту (dry-run)."""
+    dotenv_path = join(dirname(__file__), '.env')
+    load_dotenv(dotenv_path)
+
+    HOME_DIR_FOR_SAVE = os.environ.get("HOME_DIR_FOR_SAVE")                 # noqa
+    REPORT_SETTINGS_PUB_FILE = os.environ.get("REPORT_SETTINGS_PUB_FILE")   # noqa
+    REPORT_SETTINGS_PRIV_FILE = os.environ.get("REPORT_SETTINGS_PRIV_FILE") # noqa
+    MAX_TIMESHIFT = int(os.environ.get("MAX_TIMESHIFT"))                    # noqa
+    MANIFEST_FILE = os.environ.get("MANIFEST_FILE", 'py_ats.db')            # noqa
+    RECHECK_DAYS = int(script_settings.get(                                 # noqa
+        'recheck_days', os.environ.get("RECHECK_DAYS", '7')))
+
+    if 'overwrite' not in script_settings.keys():
+        script_settings['overwrite'] = 'false'
+    if 'load_type' not in script_settings.keys():
+        script_settings['load_type'] = 'private'
+
+    dt1, dt2 = get_dates(script_settings, MAX_TIMESHIFT)
+    incremental = is_incremental_mode(script_settings)
+    participants = get_participant_settings(
+        script_settings.get('partcode', ''),
+        script_settings['load_type']
+    )
+    if script_settings['load_type'] == 'public':
+        report_settings = load_report_settings(REPORT_SETTINGS_PUB_FILE)
+    else:
+        report_settings = load_report_settings(REPORT_SETTINGS_PRIV_FILE)
+
+    complete_units = set()
+    empty_pages = {}
+    publication_lags = {}
+    publication_policy = get_publication_policy()
+    manifest = None
+    if exists(MANIFEST_FILE):
+        manifest = Manifest(MANIFEST_FILE)
+        overwrite = script_settings['overwrite'].lower()
+        if overwrite == 'false':
+            complete_units = manifest.complete_units(dt1, dt2)
+        if overwrite in ('false', 'changed'):
+            empty_pages = manifest.empty_pages(dt1, dt2)
+        publication_lags = manifest.publication_lags()
+    recheck_from = datetime.date.today() - datetime.timedelta(
+        days=RECHECK_DAYS)
+
+    print(f'Период загрузки: {dt1} - {dt2}')
+    total_units = 0
+    total_skipped = 0
+    total_waiting = 0
+    for participant in participants:
+        part_code = str(participant['user_code']).upper()
+        print(f'Участник {part_code or "-"}')
+        for report in report_settings:
+            if not is_report_selected(report, script_settings):
+                continue
+            for zone in get_report_zones(report, participant):
+                report_dt1 = dt1
+                if incremental:
+                    watermark = None
+                    if manifest is not None:
+                        watermark = manifest.get_watermark(part_code,
+                                                           report.code, zone)
+                    report_dt1 = get_incremental_start(
+                        report, dt1, dt2, watermark, recheck_from
+                    )
+                units = plan_units(part_code, report, zone, report_dt1, dt2,
+                                   HOME_DIR_FOR_SAVE)
+                not_loaded = exclude_complete_units(units, complete_units,
+                                                    recheck_from)
+                to_load = exclude_unpublished_units(not_loaded, empty_pages,
+                                                    publication_lags,
+                                                    publication_policy,
+                                                    recheck_from)
+                skipped = len(units) - len(not_loaded)
+                waiting = len(not_loaded) - len(to_load)
+                total_units += len(to_load)
+                total_skipped += skipped
+                total_waiting += waiting
+                since = f', с {report_dt1}' if incremental else ''
+                print(f"  {report.code} ({zone}, {report.period_name}"
+                      f"{since}): "
+                      f"{len(to_load)} заданий, уже загружено {skipped}, "
+                      f"ожидают публикации {waiting}")
+    print(f'Всего заданий: {total_units}, уже загружено: {total_skipped}, '
+          f'ожидают публикации: {total_waiting}')
+    if manifest is not None:
+        manifest.close()
+
+
+def query_catalog(script_settings):
+    """Поиск загруженных файлов в каталоге без обхода папок отчетов."""
+    dotenv_path = join(dirname(__file__), '.env')
+    load_dotenv(dotenv_path)
+
+    CATALOG_FILE = os.environ.get("CATALOG_FILE", 'py_ats_catalog.db')      # noqa
+
+    if not CATALOG_FILE or not exists(CATALOG_FILE):
+        print(f'Каталог {CATALOG_FILE} не найден')
+        sys.exit(1)
+
+    def get_list(name: str, upper: bool = False) -> Optional[List[str]]:
+        value = script_settings.get(name, '')
+        if value == '':
+            return None
+        return [item.upper() if upper else item
+                for item in value.split(',')]
+
+    dt1 = dt2 = None
+    if {'dt', 'dt1', 'dt2'} & script_settings.keys():
+        dt1, dt2 = get_dates(script_settings, 0)
+
+    catalog = Catalog(CATALOG_FILE)
+    try:
+        rows = catalog.find(part_codes=get_list('partcode', upper=True),
+                            report_codes=get_list('reportcode'),
+                            zones=get_list('zone'),
+                            dt1=dt1, dt2=dt2,
+                            file_mask=script_settings.get('file'),
+                            sha256=script_settings.get('sha256'))
+    finally:
+        catalog.close()
+
+    if script_settings.get('output', 'table') == 'paths':
+        for row in rows:
+            print(row['path'])
+        return
+    for row in rows:
+        print(f"{row['date']}  {row['part_code'] or '-'}  "
+              f"{row['report_code']}  {row['zone'] or '-'}  "
+              f"{row['size']}  {row['path']}")
+    print(f'Найдено файлов: {len(rows)}')
+
+
+def load_from_np_sr(script_settings):
+    """Загрузка реестров с сайта НП "Совет рынка".
+
+    Страницы и файлы задаются в файле настроек NP_SR_SETTINGS_FILE.
+    Файлы, которые уже есть на диске, проверяются условным запросом и
+    загружаются заново, только если изменились на сайте.
+    """
+    start_time = datetime.datetime.now()
+
+    dotenv_path = join(dirname(__file__), '.env')
+    load_dotenv(dotenv_path)
+
+    VERIFY_STATUS = int(os.environ.get("VERIFY_STATUS")) == 1     # noqa
+    HOME_DIR_FOR_SAVE = os.environ.get("HOME_DIR_FOR_SAVE")                 # noqa
+    # Файл настроек страниц и файлов и адрес сайта НП "Совет рынка"
+    NP_SR_SETTINGS_FILE = os.environ.get("NP_SR_SETTINGS_FILE",             # noqa
+                                         'NpSrSettings.xml')
+    NP_SR_BASE_URL = os.environ.get("NP_SR_BASE_URL", np_sr.SITE_URL)       # noqa
+    WORKERS = int(script_settings.get(                                      # noqa
+        'workers', os.environ.get("WORKERS", '1')))
+    RATE_LIMIT_RPS = float(os.environ.get("RATE_LIMIT_RPS", '2'))           # noqa
+    RATE_LIMIT_MIN_RPS = float(os.environ.get("RATE_LIMIT_MIN_RPS", '0.2')) # noqa
+    RATE_LIMIT_MAX_RPS = float(os.environ.get("RATE_LIMIT_MAX_RPS", '10'))  # noqa
+    RATE_LIMIT_BYTES_PER_SEC = float(                                       # noqa
+        os.environ.get("RATE_LIMIT_BYTES_PER_SEC", '0'))
+    DOWNLOAD_CHUNK_SIZE = int(                                              # noqa
+        os.environ.get("DOWNLOAD_CHUNK_SIZE", '65536'))
+    CONNECT_TIMEOUT = float(os.environ.get("CONNECT_TIMEOUT", '10'))        # noqa
+    READ_TIMEOUT = float(os.environ.get("READ_TIMEOUT", '60'))              # noqa
+    RETRY_ATTEMPTS = int(os.environ.get("RETRY_ATTEMPTS", '5'))             # noqa
+    RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", '1'))       # noqa
+    RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", '60'))        # noqa
+    MANIFEST_FILE = os.environ.get("MANIFEST_FILE", 'py_ats.db')            # noqa
+    # Без вывода на экран сообщений о каждой дате и файле (quiet=true)
+    QUIET = script_settings.get(                                            # noqa
+        'quiet', os.environ.get("QUIET", 'false')).lower() == 'true'
+
+    logger = get_logger()
+    overwrite = script_settings.get('overwrite', 'false').lower() == 'true'
+    pages = np_sr.load_np_sr_settings(NP_SR_SETTINGS_FILE)
+
+    logger.info("------------Start download np-sr.ru------------")
+    rate_limiter = AdaptiveRateLimiter(
+        requests_per_sec=RATE_LIMIT_RPS,
+        bytes_per_sec=RATE_LIMIT_BYTES_PER_SEC,
+        min_rate=RATE_LIMIT_MIN_RPS,
+        max_rate=RATE_LIMIT_MAX_RPS,
+        logger=logger
+    )
+    session_manager = SessionManager(logger, pool_size=max(WORKERS, 10),
+                                     store_cookies=False)
+    loader = np_sr.NpSrLoader(
+        logger, VERIFY_STATUS, base_url=NP_SR_BASE_URL,
+        rate_limiter=rate_limiter, chunk_size=DOWNLOAD_CHUNK_SIZE,
+        session_manager=session_manager,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+        retry_policy=RetryPolicy(max_attempts=RETRY_ATTEMPTS,
+                                 base_delay=RETRY_BASE_DELAY,
+                                 max_delay=RETRY_MAX_DELAY),
+        quiet=QUIET, circuit_breaker=get_circuit_breaker(logger)
+    )
+    loader.session = loader.create_session()
+    manifest = Manifest(MANIFEST_FILE)
+    known_files = manifest.remote_files(np_sr.SOURCE)
+
+    def update_file(url: str, file_setting: np_sr.NpSrFile) -> bool:
+        file_name = join(HOME_DIR_FOR_SAVE, file_setting.path,
+                         url.split('/')[-1])
+        remote_file, downloaded = loader.update_file(
+            url, file_name, known_files.get(url), force=overwrite
+        )
+        if remote_file is not None:
+            manifest.record_remote_file(np_sr.SOURCE, remote_file,
+                                        downloaded)
+        return downloaded
+
+    failures = FailureLog(logger)
+    downloaded = unchanged = 0
+    try:
+        files = []
+        for page in pages:
+            try:
+                files.extend(loader.get_page_files(page))
+            except Exception as err:
+                failures.add(SITE_PAGE, page.url, err)
+        with ThreadPoolExecutor(max_workers=max(WORKERS, 1),
+                                thread_name_prefix='py_ats') as executor:
+            futures = {executor.submit(update_file, url, file_setting): url
+                       for url, file_setting in files}
+            for future in as_completed(futures):
+                try:
+                    if future.result():
+                        downloaded += 1
+                    else:
+                        unchanged += 1
+                except Exception as err:
+                    failures.add(FILE, futures[future], err)
+    finally:
+        session_manager.close()
+        manifest.close()
+
+    print(f'Загружено файлов: {downloaded}, без изменений: {unchanged}')
+    logger.info(
+        "Download np-sr.ru complete: %s downloaded, %s unchanged. "
+        "Script execution time: %s",
+        downloaded, unchanged, datetime.datetime.now() - start_time
+    )
+    if failures:
+        raise_failures(failures)
+
+
+def run_daemon(script_settings):
+    """Загрузка отчетов по расписанию в долго работающем процессе.
+
+    Переменные окружения, настройки, авторизация участников, пул соединений
+    и кэши создаются один раз. Каждый отчет опрашивается со своим интервалом
+    в своем окне публикации (атрибуты pollInterval, publishWindow, priority),
+    загружаются только даты после последней полностью загруженной и
+    последние recheck_days дней (как в режиме mode=incremental).
+    """
+    dotenv_path = join(dirname(__file__), '.env')
+    load_dotenv(dotenv_path)
+
+    VERIFY_STATUS = int(os.environ.get("VERIFY_STATUS")) == 1     # noqa
+    ATS_BASE_URL = os.environ.get("ATS_BASE_URL",                           # noqa
+                                  'https://www.atsenergo.ru')
+    HOME_DIR_FOR_SAVE = os.environ.get("HOME_DIR_FOR_SAVE")                 # noqa
+    REPORT_SETTINGS_PUB_FILE = os.environ.get("REPORT_SETTINGS_PUB_FILE")   # noqa
+    REPORT_SETTINGS_PRIV_FILE = os.environ.get("REPORT_SETTINGS_PRIV_FILE") # noqa
+    MAX_TIMESHIFT = int(os.environ.get("MAX_TIMESHIFT"))                    # noqa
+    WORKERS = int(script_settings.get(                                      # noqa
+        'workers', os.environ.get("WORKERS", '1')))
+    PART_WORKERS = int(script_settings.get(                                 # noqa
+        'part_workers', os.environ.get("PART_WORKERS", '1')))
+    # Количество отчетов, загружаемых одновременно
+    DAEMON_WORKERS = int(script_settings.get(                               # noqa
+        'daemon_workers', os.environ.get("DAEMON_WORKERS", '2')))
+    RATE_LIMIT_RPS = float(os.environ.get("RATE_LIMIT_RPS", '2'))           # noqa
+    RATE_LIMIT_MIN_RPS = float(os.environ.get("RATE_LIMIT_MIN_RPS", '0.2')) # noqa
+    RATE_LIMIT_MAX_RPS = float(os.environ.get("RATE_LIMIT_MAX_RPS", '10'))  # noqa
+    RATE_LIMIT_BYTES_PER_SEC = float(                                       # noqa
+        os.environ.get("RATE_LIMIT_BYTES_PER_SEC", '0'))
+    DOWNLOAD_CHUNK_SIZE = int(                                              # noqa
+        os.environ.get("DOWNLOAD_CHUNK_SIZE", '65536'))
+    UNPACK_WORKERS = int(os.environ.get("UNPACK_WORKERS", '2'))            # noqa
+    SPOOL_MAX_SIZE = int(                                                   # noqa
+        os.environ.get("SPOOL_MAX_SIZE", str(16 * 1024 * 1024)))
+    BLOB_STORE_DIR = os.environ.get("BLOB_STORE_DIR")                       # noqa
+    SESSION_COOKIES = int(os.environ.get("SESSION_COOKIES", '1')) == 1      # noqa
+    PAGE_CACHE_FILE = os.environ.get("PAGE_CACHE_FILE")                     # noqa
+    PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", '3600'))          # noqa
+    PAGE_CACHE_MAX_MB = int(os.environ.get("PAGE_CACHE_MAX_MB", '50'))      # noqa
+    CONNECT_TIMEOUT = float(os.environ.get("CONNECT_TIMEOUT", '10'))        # noqa
+    READ_TIMEOUT = float(os.environ.get("READ_TIMEOUT", '60'))              # noqa
+    RETRY_ATTEMPTS = int(os.environ.get("RETRY_ATTEMPTS", '5'))             # noqa
+    RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", '1'))       # noqa
+    RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", '60'))        # noqa
+    MANIFEST_FILE = os.environ.get("MANIFEST_FILE", 'py_ats.db')            # noqa
+    RECHECK_DAYS = int(script_settings.get(                                 # noqa
+        'recheck_days', os.environ.get("RECHECK_DAYS", '7')))
+    CATALOG_FILE = os.environ.get("CATALOG_FILE", 'py_ats_catalog.db')      # noqa
+    METRICS_FILE = os.environ.get("METRICS_FILE", 'LOG/metrics.json')       # noqa
+    METRICS_PROM_FILE = os.environ.get("METRICS_PROM_FILE")                 # noqa
+    # Без вывода на экран сообщений о каждой дате и файле (quiet=true)
+    QUIET = script_settings.get(                                            # noqa
+        'quiet', os.environ.get("QUIET", 'false')).lower() == 'true'
+
+    logger = get_logger()
+
+    if 'overwrite' not in script_settings.keys():
+        script_settings['overwrite'] = 'false'
+    if 'load_type' not in script_settings.keys():
+        script_settings['load_type'] = 'private'
+    load_type = script_settings['load_type']
+
+    participants = get_participant_settings(
+        script_settings.get('partcode', ''),
+        load_type
+    )
+    if load_type == 'public':
+        report_settings_file = REPORT_SETTINGS_PUB_FILE
+    else:
+        report_settings_file = REPORT_SETTINGS_PRIV_FILE
+
+    def get_reports():
+        # Файл настроек разбирается заново только после его изменения
+        return [report for report in load_report_settings(report_settings_file)
+                if is_report_selected(report, script_settings)]
+
+    logger.info("------------Start daemon------------")
+    rate_limiter = AdaptiveRateLimiter(
+        requests_per_sec=RATE_LIMIT_RPS,
+        bytes_per_sec=RATE_LIMIT_BYTES_PER_SEC,
+        min_rate=RATE_LIMIT_MIN_RPS,
+        max_rate=RATE_LIMIT_MAX_RPS,
+        logger=logger
+    )
+    retry_policy = RetryPolicy(max_attempts=RETRY_ATTEMPTS,
+                               base_delay=RETRY_BASE_DELAY,
+                               max_delay=RETRY_MAX_DELAY)
+    circuit_breaker = get_circuit_breaker(logger)
+    manifest = Manifest(MANIFEST_FILE)
+    publication_policy = get_publication_policy()
+    notifier = Notifier(logger)
+    dir_index = DirIndex()
+    metrics = RunMetrics()
+    blob_store = BlobStore(BLOB_STORE_DIR, logger) if BLOB_STORE_DIR else None
+    catalog = Catalog(CATALOG_FILE) if CATALOG_FILE else None
+    unpacker = Unpacker(logger, workers=UNPACK_WORKERS,
+                        max_pending=2 * max(UNPACK_WORKERS, WORKERS),
+                        dir_index=dir_index, metrics=metrics,
+                        blob_store=blob_store)
+    session_manager = SessionManager(
+        logger,
+        pool_size=max(WORKERS * DAEMON_WORKERS, PART_WORKERS, 10),
+        store_cookies=SESSION_COOKIES
+    )
+    page_cache = PageCache(PAGE_CACHE_FILE, ttl=PAGE_CACHE_TTL,
+                           max_bytes=PAGE_CACHE_MAX_MB * 1024 * 1024)
+
+    # Авторизация участников выполняется один раз; при истечении сессии
+    # загрузчик авторизуется заново сам. Участники, авторизация которых
+    # не удалась, не опрашиваются
+    failures = FailureLog(logger)
+    loaders = {}
+    for participant in participants:
+        part_code = str(participant['user_code']).upper()
+        try:
+            loader = AtsPwdLoader(logger=logger, verify_status=VERIFY_STATUS,
+                                  rate_limiter=rate_limiter,
+                                  chunk_size=DOWNLOAD_CHUNK_SIZE,
+                                  session_manager=session_manager,
+                                  page_cache=page_cache,
+                                  timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                                  retry_policy=retry_policy,
+                                  base_url=ATS_BASE_URL,
+                                  metrics=metrics, quiet=QUIET,
+                                  circuit_breaker=circuit_breaker)
+            loader.part_code = part_code
+            loader.user_name = participant['user_name']
+            with metrics.timer(LOGIN):
+                if load_type == 'private':
+                    loader.login()
+                else:
+                    loader.init_session()
+        except Exception as err:
+            print(err)
+            failures.add(PARTICIPANT, part_code or '-', err)
+            continue
+        loaders[part_code] = loader
+
+    def handle_unit(unit: DownloadUnit) -> int:
+        # Ошибка одной даты не прерывает опрос отчета, дата загружается
+        # при следующем опросе
+        try:
+            return load_unit(loaders[unit.part_code], unit,
+                             script_settings['overwrite'], logger, unpacker,
+                             SPOOL_MAX_SIZE, dir_index, manifest, metrics,
+                             catalog)
+        except Exception as err:
+            logger.exception(f'Error loading {unit_name(unit)}: {err}')
+            return 0
+
+    def load_report(report):
+        """Опрос одного отчета по всем участникам и ценовым зонам."""
+        dt2 = datetime.date.today()
+        dt1 = dt2 + datetime.timedelta(days=MAX_TIMESHIFT)
+        recheck_from = dt2 - datetime.timedelta(days=RECHECK_DAYS)
+        overwrite = script_settings['overwrite'].lower()
+        complete_units = set()
+        empty_pages = {}
+        if overwrite == 'false':
+            complete_units = manifest.complete_units(dt1, dt2)
+        if overwrite in ('false', 'changed'):
+            empty_pages = manifest.empty_pages(dt1, dt2)
+        publication_lags = manifest.publication_lags()
+        logger.info(f"Polling report {report.code}")
+        for participant in participants:
+            part_code = str(participant['user_code']).upper()
+            if part_code not in loaders:
+                continue
+            rows_to_send = []
+            for zone in get_report_zones(report, participant):
+                watermark = manifest.get_watermark(part_code, report.code,
+                                                   zone)
+                report_dt1 = get_incremental_start(report, dt1, dt2,
+                                                   watermark, recheck_from)
+                planned_units = plan_units(part_code, report, zone,
+                                           report_dt1, dt2, HOME_DIR_FOR_SAVE)
+                units = exclude_complete_units(planned_units, complete_units,
+                                               recheck_from)
+                units = exclude_unpublished_units(units, empty_pages,
+                                                  publication_lags,
+                                                  publication_policy,
+                                                  recheck_from)
+                results = run_units(units, handle_unit, workers=WORKERS,
+                                    part_workers=PART_WORKERS)
+                # Даты, архивы которых еще распаковываются, учитываются
+                # в отметке при следующем опросе
+                new_watermark = advance_watermark(
+                    watermark, planned_units,
+                    manifest.complete_units(report_dt1, dt2),
+                    get_confirmed_empty_units(
+                        manifest.empty_pages(report_dt1, dt2),
+                        publication_policy, recheck_from
+                    )
+                )
+                if new_watermark != watermark:
+                    manifest.set_watermark(part_code, report.code, zone,
+                                           new_watermark)
+                if report.notify and sum(results.values()) > 0:
+                    rows_to_send.append({
+                        'part_code': part_code,
+                        'report_name': report.name,
+                        'rep_path': join(
+                            HOME_DIR_FOR_SAVE,
+                            report.path.render(part_code, zone, dt2)
+                        )
+                    })
+            if participant.get('user_emails'):
+                notifier.notify(participant['user_emails'], rows_to_send)
+        metrics.finish()
+        if METRICS_FILE:
+            metrics.write_json(METRICS_FILE)
+        if METRICS_PROM_FILE:
+            metrics.write_prometheus(METRICS_PROM_FILE)
+
+    # SIGTERM завершает процесс так же, как Ctrl+C: текущие задания
+    # дорабатывают, новые не запускаются
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    scheduler = Scheduler(load_report, logger, workers=DAEMON_WORKERS)
+    try:
+        scheduler.run(refresh=get_reports)
+    except KeyboardInterrupt:
+        logger.info("Daemon stopped")
+    finally:
+        unpacker.close()
+        if load_type == 'private':
+            for part_code, loader in loaders.items():
+                session_manager.save_cookies(part_code, loader.session)
+        session_manager.close()
+        page_cache.close()
+        manifest.close()
+        if catalog is not None:
+            catalog.close()
+        flush_notifications(notifier)
+    if len(failures) > 0:
+        raise_failures(failures)
 
 
 def main():
@@ -450,12 +1504,44 @@ def main():
             print('Пароль записан')
             sys.exit(0)
 
+    # Профилирование запуска (cProfile)
+    profile_file = None
+    for arg in sys.argv:
+        if arg == '--profile':
+            profile_file = 'LOG/py_ats.prof'
+        elif arg.startswith('--profile='):
+            profile_file = arg.split('=', 1)[1]
+
     for arg in sys.argv:
-        if arg.find('=') != -1:
+        if arg.find('=') != -1 and not arg.startswith('--'):
             script_settings[arg.split('=')[0]] = arg.split('=')[1]
 
-    if script_settings['source_type'] == 'ats_reports':
-        load_from_main_source(script_settings)
+    profiler = None
+    if profile_file is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        if script_settings['source_type'] == 'ats_reports':
+            load_from_main_source(script_settings)
+        elif script_settings['source_type'] == 'plan':
+            plan_from_main_source(script_settings)
+        elif script_settings['source_type'] == 'daemon':
+            run_daemon(script_settings)
+        elif script_settings['source_type'] == 'catalog':
+            query_catalog(script_settings)
+        elif script_settings['source_type'] == np_sr.SOURCE:
+            load_from_np_sr(script_settings)
+    except PartialLoadError:
+        # сводка ошибок уже выведена, остальное загружено
+        sys.exit(1)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(dirname(os.path.abspath(profile_file)),
+                        exist_ok=True)
+            profiler.dump_stats(profile_file)
+            print(f'Профиль запуска сохранен в {profile_file}')
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,424 @@
+"""Журнал загруженных отчетов (SQLite)."""
+import datetime
+import json
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from engine import DownloadUnit
+from http_loader import RemoteFile
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (
+    part_code TEXT NOT NULL,
+    report_code TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    date TEXT NOT NULL,
+    files_count INTEGER NOT NULL,
+    completed_at TEXT NOT NULL,
+    PRIMARY KEY (part_code, report_code, zone, date)
+);
+CREATE TABLE IF NOT EXISTS files (
+    part_code TEXT NOT NULL,
+    report_code TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    date TEXT NOT NULL,
+    fid TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    size INTEGER,
+    downloaded_at TEXT NOT NULL,
+    sha256 TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    PRIMARY KEY (part_code, report_code, zone, date, fid)
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    part_code TEXT NOT NULL,
+    report_code TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    date TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (part_code, report_code, zone)
+);
+CREATE TABLE IF NOT EXISTS empty_pages (
+    part_code TEXT NOT NULL,
+    report_code TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    date TEXT NOT NULL,
+    checked_at TEXT NOT NULL,
+    misses INTEGER NOT NULL,
+    PRIMARY KEY (part_code, report_code, zone, date)
+);
+CREATE TABLE IF NOT EXISTS publications (
+    report_code TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    date TEXT NOT NULL,
+    lag_hours REAL NOT NULL,
+    seen_at TEXT NOT NULL,
+    PRIMARY KEY (report_code, zone, date)
+);
+CREATE TABLE IF NOT EXISTS remote_files (
+    source TEXT NOT NULL,
+    url TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    size INTEGER,
+    sha256 TEXT,
+    checked_at TEXT NOT NULL,
+    downloaded_at TEXT,
+    PRIMARY KEY (source, url)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    settings TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS job_chunks (
+    job_id INTEGER NOT NULL,
+    part_code TEXT NOT NULL,
+    report_code TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    month TEXT NOT NULL,
+    units_count INTEGER NOT NULL,
+    completed_at TEXT,
+    PRIMARY KEY (job_id, part_code, report_code, zone, month)
+);
+"""
+
+
+# Столбцы, добавленные в таблицы после их появления: (таблица, столбец, тип)
+COLUMNS = [
+    ('files', 'sha256', 'TEXT'),
+    ('files', 'etag', 'TEXT'),
+    ('files', 'last_modified', 'TEXT'),
+]
+
+# Время ожидания блокировки базы другим процессом (в секундах)
+SQLITE_TIMEOUT = 30
+
+
+def unit_key(unit: DownloadUnit) -> Tuple[str, str, str, str]:
+    """Ключ единицы загрузки в журнале."""
+    return (unit.part_code, unit.report_code, unit.zone,
+            unit.date.isoformat())
+
+
+class Manifest():
+    """Журнал единиц загрузки (участник, отчет, зона, дата) и их файлов.
+
+    Единица считается завершенной, если страница отчета за дату содержала
+    файлы и все они были загружены (либо уже были на диске).
+    Одно соединение используется всеми потоками загрузки под блокировкой.
+    """
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        # timeout - ожидание блокировки, если в журнал пишут другие
+        # процессы загрузки (processes=N)
+        self.connection = sqlite3.connect(db_file, timeout=SQLITE_TIMEOUT,
+                                          check_same_thread=False)
+        with self._lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.executescript(SCHEMA)
+            self._add_columns()
+            self.connection.commit()
+
+    def _add_columns(self) -> None:
+        """Добавление новых столбцов в журнал, созданный прежней версией."""
+        for table, column, column_type in COLUMNS:
+            columns = {row[1] for row in self.connection.execute(
+                f'PRAGMA table_info({table})'
+            )}
+            if column not in columns:
+                self.connection.execute(
+                    f'ALTER TABLE {table} ADD COLUMN {column} {column_type}'
+                )
+
+    def complete_units(self, dt1: datetime.date,
+                       dt2: datetime.date) -> Set[Tuple[str, str, str, str]]:
+        """Ключи завершенных единиц загрузки за период."""
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT part_code, report_code, zone, date FROM units '
+                'WHERE date BETWEEN ? AND ?',
+                (dt1.isoformat(), dt2.isoformat())
+            ).fetchall()
+        return {tuple(row) for row in rows}
+
+    def completed_units_since(self, since: datetime.datetime
+                              ) -> Set[Tuple[str, str, str, str]]:
+        """Ключи единиц загрузки, завершенных начиная с момента since."""
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT part_code, report_code, zone, date FROM units '
+                'WHERE completed_at >= ?',
+                (since.isoformat(),)
+            ).fetchall()
+        return {tuple(row) for row in rows}
+
+    def record_file(self, unit: DownloadUnit, fid: str, file_name: str,
+                    size: int, sha256: Optional[str] = None,
+                    etag: Optional[str] = None,
+                    last_modified: Optional[str] = None) -> None:
+        """Запись о загруженном файле."""
+        with self._lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO files (part_code, report_code, zone, '
+                'date, fid, file_name, size, downloaded_at, sha256, etag, '
+                'last_modified) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                unit_key(unit) + (fid, file_name, size,
+                                  datetime.datetime.now().isoformat(), sha256,
+                                  etag, last_modified)
+            )
+            self.connection.commit()
+
+    def get_file(self, unit: DownloadUnit,
+                 fid: str) -> Optional[RemoteFile]:
+        """Сведения о файле fid, загруженном для единицы unit."""
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT fid, file_name, etag, last_modified, size, sha256 '
+                'FROM files WHERE part_code = ? AND report_code = ? '
+                'AND zone = ? AND date = ? AND fid = ?',
+                unit_key(unit) + (fid,)
+            ).fetchone()
+        return RemoteFile(*row) if row is not None else None
+
+    def find_file(self, fid: str) -> Optional[RemoteFile]:
+        """Сведения о последнем загруженном файле с идентификатором fid
+        (если хэш его содержимого известен)."""
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT fid, file_name, etag, last_modified, size, sha256 '
+                'FROM files WHERE fid = ? AND sha256 IS NOT NULL '
+                'ORDER BY downloaded_at DESC LIMIT 1',
+                (fid,)
+            ).fetchone()
+        return RemoteFile(*row) if row is not None else None
+
+    def mark_complete(self, unit: DownloadUnit, files_count: int) -> None:
+        """Отметка о завершении единицы загрузки."""
+        with self._lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?, ?)',
+                unit_key(unit) + (files_count,
+                                  datetime.datetime.now().isoformat())
+            )
+            self.connection.commit()
+
+    def get_watermark(self, part_code: str, report_code: str,
+                      zone: str) -> Optional[datetime.date]:
+        """Последняя дата, до которой отчет загружен полностью."""
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT date FROM watermarks '
+                'WHERE part_code = ? AND report_code = ? AND zone = ?',
+                (part_code, report_code, zone)
+            ).fetchone()
+        if row is None:
+            return None
+        return datetime.date.fromisoformat(row[0])
+
+    def set_watermark(self, part_code: str, report_code: str, zone: str,
+                      date: datetime.date) -> None:
+        """Запись последней даты, до которой отчет загружен полностью."""
+        with self._lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?, ?)',
+                (part_code, report_code, zone, date.isoformat(),
+                 datetime.datetime.now().isoformat())
+            )
+            self.connection.commit()
+
+    def record_empty(self, unit: DownloadUnit) -> None:
+        """Отметка о том, что страница отчета за дату не содержала файлов."""
+        with self._lock:
+            self.connection.execute(
+                'INSERT INTO empty_pages VALUES (?, ?, ?, ?, ?, 1) '
+                'ON CONFLICT (part_code, report_code, zone, date) DO UPDATE '
+                'SET checked_at = excluded.checked_at, misses = misses + 1',
+                unit_key(unit) + (datetime.datetime.now().isoformat(),)
+            )
+            self.connection.commit()
+
+    def clear_empty(self, unit: DownloadUnit) -> bool:
+        """Удаление отметок о пустой странице, когда на ней появились файлы.
+
+        Возвращает True, если страница раньше была пустой.
+        """
+        with self._lock:
+            cursor = self.connection.execute(
+                'DELETE FROM empty_pages WHERE part_code = ? '
+                'AND report_code = ? AND zone = ? AND date = ?',
+                unit_key(unit)
+            )
+            self.connection.commit()
+        return cursor.rowcount > 0
+
+    def empty_pages(self, dt1: datetime.date, dt2: datetime.date
+                    ) -> Dict[Tuple[str, str, str, str],
+                              Tuple[datetime.datetime, int]]:
+        """Пустые страницы отчетов за период: время последней проверки и
+        количество проверок подряд, на которых файлов не было."""
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT part_code, report_code, zone, date, checked_at, '
+                'misses FROM empty_pages WHERE date BETWEEN ? AND ?',
+                (dt1.isoformat(), dt2.isoformat())
+            ).fetchall()
+        return {tuple(row[:4]): (datetime.datetime.fromisoformat(row[4]),
+                                 row[5])
+                for row in rows}
+
+    def record_publication(self, unit: DownloadUnit,
+                           seen_at: datetime.datetime) -> None:
+        """Запись времени появления файлов отчета на сайте.
+
+        Задержка публикации отсчитывается от начала даты отчета (для
+        отчетов, публикуемых накануне, она отрицательная).
+        """
+        lag = seen_at - datetime.datetime.combine(unit.date,
+                                                  datetime.time.min)
+        with self._lock:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO publications VALUES (?, ?, ?, ?, ?)',
+                (unit.report_code, unit.zone, unit.date.isoformat(),
+                 lag.total_seconds() / 3600, seen_at.isoformat())
+            )
+            self.connection.commit()
+
+    def publication_lags(self, limit: int = 30) -> Dict[str, List[float]]:
+        """Последние limit задержек публикации (в часах) по кодам отчетов."""
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT report_code, lag_hours FROM ('
+                'SELECT report_code, lag_hours, ROW_NUMBER() OVER ('
+                'PARTITION BY report_code ORDER BY date DESC) AS number '
+                'FROM publications) WHERE number <= ?',
+                (limit,)
+            ).fetchall()
+        lags = {}
+        for report_code, lag_hours in rows:
+            lags.setdefault(report_code, []).append(lag_hours)
+        return lags
+
+    def remote_files(self, source: str) -> Dict[str, RemoteFile]:
+        """Загруженные файлы источника source по адресам."""
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT url, file_name, etag, last_modified, size, sha256 '
+                'FROM remote_files WHERE source = ?',
+                (source,)
+            ).fetchall()
+        return {row[0]: RemoteFile(*row) for row in rows}
+
+    def record_remote_file(self, source: str, remote_file: RemoteFile,
+                           downloaded: bool) -> None:
+        """Запись о проверке (downloaded=False) или загрузке файла."""
+        now = datetime.datetime.now().isoformat()
+        with self._lock:
+            self.connection.execute(
+                'INSERT INTO remote_files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (source, url) DO UPDATE SET '
+                'file_name = excluded.file_name, etag = excluded.etag, '
+                'last_modified = excluded.last_modified, '
+                'size = excluded.size, '
+                'sha256 = COALESCE(excluded.sha256, sha256), '
+                'checked_at = excluded.checked_at, '
+                'downloaded_at = COALESCE(excluded.downloaded_at, '
+                'downloaded_at)',
+                (source, remote_file.url, remote_file.file_name,
+                 remote_file.etag, remote_file.last_modified,
+                 remote_file.size, remote_file.sha256, now,
+                 now if downloaded else None)
+            )
+            self.connection.commit()
+
+    def create_job(self, settings: Dict[str, str]) -> int:
+        """Новое задание загрузки с параметрами settings, возвращает его
+        номер."""
+        with self._lock:
+            cursor = self.connection.execute(
+                'INSERT INTO jobs (settings, created_at) VALUES (?, ?)',
+                (json.dumps(settings, ensure_ascii=False),
+                 datetime.datetime.now().isoformat())
+            )
+            self.connection.commit()
+        return cursor.lastrowid
+
+    def get_job(self, job_id: int
+                ) -> Optional[Tuple[Dict[str, str], datetime.datetime,
+                                    Optional[datetime.datetime]]]:
+        """Параметры задания, время его создания и завершения."""
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT settings, created_at, finished_at FROM jobs '
+                'WHERE job_id = ?',
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        settings, created_at, finished_at = row
+        return (json.loads(settings),
+                datetime.datetime.fromisoformat(created_at),
+                datetime.datetime.fromisoformat(finished_at)
+                if finished_at else None)
+
+    def finish_job(self, job_id: int) -> bool:
+        """Отметка о завершении задания, если завершены все его части.
+
+        Возвращает True, если задание завершено.
+        """
+        with self._lock:
+            cursor = self.connection.execute(
+                'UPDATE jobs SET finished_at = ? WHERE job_id = ? '
+                'AND NOT EXISTS (SELECT 1 FROM job_chunks WHERE job_id = ? '
+                'AND completed_at IS NULL)',
+                (datetime.datetime.now().isoformat(), job_id, job_id)
+            )
+            self.connection.commit()
+        return cursor.rowcount > 0
+
+    def record_chunks(self, job_id: int,
+                      chunks: Dict[Tuple[str, str, str, str], int]) -> None:
+        """Запись частей задания (ключ части - количество дат в ней),
+        уже записанные части не изменяются."""
+        with self._lock:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO job_chunks (job_id, part_code, '
+                'report_code, zone, month, units_count) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(job_id,) + key + (units_count,)
+                 for key, units_count in chunks.items()]
+            )
+            self.connection.commit()
+
+    def complete_chunk(self, job_id: int,
+                       key: Tuple[str, str, str, str]) -> None:
+        """Отметка о завершении части задания."""
+        with self._lock:
+            self.connection.execute(
+                'UPDATE job_chunks SET completed_at = ? WHERE job_id = ? '
+                'AND part_code = ? AND report_code = ? AND zone = ? '
+                'AND month = ?',
+                (datetime.datetime.now().isoformat(), job_id) + key
+            )
+            self.connection.commit()
+
+    def complete_chunks(self, job_id: int
+                        ) -> Set[Tuple[str, str, str, str]]:
+        """Ключи завершенных частей задания."""
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT part_code, report_code, zone, month FROM job_chunks '
+                'WHERE job_id = ? AND completed_at IS NOT NULL',
+                (job_id,)
+            ).fetchall()
+        return {tuple(row) for row in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
@@ -0,0 +1,218 @@
+"""Метрики запуска: время по этапам, запросы и объем данных."""
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+# Этапы загрузки
+LOGIN = 'login'
+PAGE = 'page'
+DOWNLOAD = 'download'
+UNPACK = 'unpack'
+FS_CHECK = 'fs_check'
+# Ожидания: ограничение скорости и паузы перед повтором запроса
+THROTTLE = 'throttle'
+RETRY_WAIT = 'retry_wait'
+# Ожидание, пока запросы к сайту приостановлены из-за ошибок
+CIRCUIT_WAIT = 'circuit_wait'
+
+PHASES = (LOGIN, PAGE, DOWNLOAD, UNPACK, FS_CHECK, THROTTLE, RETRY_WAIT,
+          CIRCUIT_WAIT)
+
+# Счетчики по участнику, отчету и ценовой зоне
+COUNTERS = ('requests', 'bytes', 'files', 'units')
+
+Key = Tuple[str, str, str]
+
+
+class RunMetrics():
+    """Метрики одного запуска.
+
+    Время этапов не пересекается: ожидания (THROTTLE, RETRY_WAIT,
+    CIRCUIT_WAIT) внутри этапа учитываются отдельно и вычитаются из времени
+    самого этапа, поэтому по сумме этапов видно, сколько времени ушло
+    на ответы сайта, на работу программы и на паузы. Запросы и байты
+    относятся к заданию (участник, отчет, зона), которое выполняет текущий
+    поток (см. group), либо только к участнику. Один экземпляр можно
+    использовать из нескольких потоков.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.finished_at = None
+        self._start = time.perf_counter()
+        self.duration = None
+        # этап -> [количество, секунды]
+        self.phases: Dict[str, list] = {phase: [0, 0.0] for phase in PHASES}
+        self.groups: Dict[Key, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _waited(self) -> float:
+        return getattr(self._local, 'waited', 0.0)
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[phase][0] += 1
+            self.phases[phase][1] += seconds
+
+    def add_wait(self, phase: str, seconds: float) -> None:
+        """Учет ожидания (вычитается из объемлющего этапа)."""
+        if seconds <= 0:
+            return
+        self._local.waited = self._waited() + seconds
+        self.add_time(phase, seconds)
+
+    @contextmanager
+    def timer(self, phase: str):
+        """Замер времени этапа без ожиданий внутри него."""
+        start = time.perf_counter()
+        waited = self._waited()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add_time(phase, elapsed - (self._waited() - waited))
+
+    @contextmanager
+    def group(self, part_code: str, report_code: str, zone: str):
+        """Задание, к которому относятся запросы текущего потока."""
+        previous = getattr(self._local, 'group', None)
+        self._local.group = (part_code, report_code, zone)
+        try:
+            yield
+        finally:
+            self._local.group = previous
+
+    def add(self, part_code: Optional[str], **counters: int) -> None:
+        """Увеличение счетчиков (requests, bytes, files, units) задания
+        текущего потока либо участника part_code."""
+        key = getattr(self._local, 'group', None)
+        if key is None:
+            key = (part_code or '', '', '')
+        with self._lock:
+            values = self.groups.get(key)
+            if values is None:
+                values = self.groups[key] = dict.fromkeys(COUNTERS, 0)
+            for name, value in counters.items():
+                values[name] += value
+
+    def merge(self, summary: Dict) -> None:
+        """Добавление итогов другого запуска (см. summary), например,
+        процесса загрузки при processes=N."""
+        with self._lock:
+            for phase, values in summary['phases'].items():
+                self.phases[phase][0] += values['count']
+                self.phases[phase][1] += values['seconds']
+            for group in summary['groups']:
+                key = (group['participant'], group['report'], group['zone'])
+                values = self.groups.get(key)
+                if values is None:
+                    values = self.groups[key] = dict.fromkeys(COUNTERS, 0)
+                for name in COUNTERS:
+                    values[name] += group[name]
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self._start
+        self.finished_at = time.time()
+
+    def summary(self) -> Dict:
+        """Итоги запуска для выгрузки в JSON."""
+        with self._lock:
+            phases = {phase: {'count': count, 'seconds': round(seconds, 3)}
+                      for phase, (count, seconds) in self.phases.items()}
+            groups = [
+                dict(participant=key[0], report=key[1], zone=key[2],
+                     **values)
+                for key, values in sorted(self.groups.items())
+            ]
+        totals = {name: sum(group[name] for group in groups)
+                  for name in COUNTERS}
+        return {
+            'started_at': datetime.datetime.fromtimestamp(
+                self.started_at).isoformat(timespec='seconds'),
+            'duration': round(self.duration or 0.0, 3),
+            'phases': phases,
+            'totals': totals,
+            'groups': groups,
+        }
+
+    def to_prometheus(self) -> str:
+        """Итоги запуска в текстовом формате Prometheus."""
+        summary = self.summary()
+        lines = [
+            '# HELP py_ats_run_duration_seconds Duration of the last run.',
+            '# TYPE py_ats_run_duration_seconds gauge',
+            f"py_ats_run_duration_seconds {summary['duration']}",
+            '# HELP py_ats_run_finished_timestamp_seconds '
+            'Time the last run finished.',
+            '# TYPE py_ats_run_finished_timestamp_seconds gauge',
+            f'py_ats_run_finished_timestamp_seconds '
+            f'{round(self.finished_at or time.time(), 3)}',
+            '# HELP py_ats_phase_seconds Time spent in each phase '
+            'of the last run.',
+            '# TYPE py_ats_phase_seconds gauge',
+        ]
+        for phase, values in summary['phases'].items():
+            lines.append(f'py_ats_phase_seconds{{phase="{phase}"}} '
+                         f"{values['seconds']}")
+        lines += ['# HELP py_ats_phase_count Number of timed operations '
+                  'in each phase of the last run.',
+                  '# TYPE py_ats_phase_count gauge']
+        for phase, values in summary['phases'].items():
+            lines.append(f'py_ats_phase_count{{phase="{phase}"}} '
+                         f"{values['count']}")
+        for name in COUNTERS:
+            lines += [f'# HELP py_ats_{name} Number of {name} in the last '
+                      f'run by participant, report and zone.',
+                      f'# TYPE py_ats_{name} gauge']
+            for group in summary['groups']:
+                labels = ','.join(
+                    f'{label}="{escape_label(group[label])}"'
+                    for label in ('participant', 'report', 'zone')
+                )
+                lines.append(f'py_ats_{name}{{{labels}}} {group[name]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, file_name: str) -> None:
+        write_atomic(file_name,
+                     json.dumps(self.summary(), ensure_ascii=False, indent=2))
+
+    def write_prometheus(self, file_name: str) -> None:
+        write_atomic(file_name, self.to_prometheus())
+
+    def format_phases(self) -> str:
+        """Строка с временем этапов для лога."""
+        with self._lock:
+            return ', '.join(f'{phase} {seconds:.1f}s'
+                             for phase, (_, seconds) in self.phases.items())
+
+
+def escape_label(value: str) -> str:
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def write_atomic(file_name: str, text: str) -> None:
+    """Запись файла целиком через временный файл (файл, который читает
+    node_exporter, не должен быть виден наполовину записанным)."""
+    dir_name = os.path.dirname(os.path.abspath(file_name))
+    os.makedirs(dir_name, exist_ok=True)
+    tmp_file = tempfile.NamedTemporaryFile(
+        'w', dir=dir_name, prefix='.py_ats_', suffix='.part',
+        encoding='utf-8', delete=False
+    )
+    try:
+        with tmp_file:
+            tmp_file.write(text)
+        # временный файл создается с правами 0600
+        os.chmod(tmp_file.name, 0o644)
+        os.replace(tmp_file.name, file_name)
+    except Exception:
+        if os.path.exists(tmp_file.name):
+            os.remove(tmp_file.name)
+        raise
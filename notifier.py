@@ -0,0 +1,181 @@
+"""Отправка уведомлений о загруженных отчетах в фоновом потоке."""
+import logging
+import os
+import queue
+import smtplib
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from exceptions import EmailError
+from sendMail import get_from_email, get_user_password, make_message
+
+
+class Notifier():
+    """Фоновая отправка писем через одно SMTP-соединение.
+
+    Пароль пользователя читается из keyring один раз, соединение
+    авторизуется один раз и используется для всех писем запуска. Если писем
+    нет дольше idle_timeout секунд, соединение закрывается и при следующем
+    письме открывается заново (так же, как после обрыва соединения).
+    Ошибки отправки записываются в лог, а при close выбрасывается EmailError.
+    """
+
+    def __init__(self, logger: logging.Logger,
+                 smtp_server: Optional[str] = None,
+                 smtp_port: Optional[int] = None,
+                 idle_timeout: float = 60):
+        self.logger = logger
+        self.smtp_server = smtp_server or os.environ.get("SMTP_SERVER")
+        self.smtp_port = smtp_port or int(os.environ.get("SMTP_PORT", '25'))
+        self.idle_timeout = idle_timeout
+        self.sent = 0
+        self.errors: List[str] = []
+        self._credentials: Optional[Tuple[str, str]] = None
+        self._server: Optional[smtplib.SMTP] = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._work,
+                                        name='py_ats_notifier', daemon=True)
+        self._thread.start()
+
+    def notify(self, receivers: str, rows: List[Dict]) -> None:
+        """Постановка письма со списком отчетов rows в очередь."""
+        if rows:
+            self._queue.put((receivers, rows))
+
+    def _work(self) -> None:
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self._disconnect()
+                continue
+            if item is None:
+                self._disconnect()
+                return
+            receivers, rows = item
+            try:
+                self._send(receivers, rows)
+            except Exception as err:
+                self.logger.exception(f'Error sending email: {err}')
+                self.errors.append(f'{receivers}: {err}')
+            else:
+                self.sent += 1
+                self.logger.info('Email successfully sent')
+
+    def _connect(self) -> Tuple[smtplib.SMTP, str]:
+        if self._credentials is None:
+            user_name, password = get_user_password()
+            self._credentials = (get_from_email(user_name), password)
+        from_email, password = self._credentials
+        if self._server is None:
+            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
+            try:
+                server.login(from_email, password)
+            except Exception:
+                server.close()
+                raise
+            self._server = server
+        return self._server, from_email
+
+    def _disconnect(self) -> None:
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except smtplib.SMTPException:
+            self._server.close()
+        except OSError:
+            pass
+        self._server = None
+
+    def _send(self, receivers: str, rows: List[Dict]) -> None:
+        # соединение могло быть закрыто сервером - тогда одна повторная
+        # попытка через новое соединение
+        for attempt in range(2):
+            server, from_email = self._connect()
+            try:
+                server.send_message(make_message(receivers, rows,
+                                                 from_email))
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._server = None
+                if attempt > 0:
+                    raise
+
+    def close(self) -> None:
+        """Ожидание отправки всех писем и закрытие соединения."""
+        self._queue.put(None)
+        self._thread.join()
+        if self.errors:
+            raise EmailError(
+                f"Error sending email: {'; '.join(self.errors)}"
+            )
+
+
+class Digests():
+    """Сбор строк уведомлений по участникам.
+
+    Строки участника передаются в send, как только выполнены все задания
+    его отчетов с уведомлением и участник отмечен завершенным (seal), то есть
+    новых заданий у него больше не будет. Один экземпляр можно использовать
+    из нескольких потоков.
+    """
+
+    def __init__(self, send: Callable[[str, List[Dict]], None]):
+        self.send = send
+        # (участник, отчет, зона) -> [строка письма, осталось заданий, файлов]
+        self._groups: Dict[Tuple[str, str, str], list] = {}
+        # участник -> [получатели, ключи групп, отмечен ли завершенным]
+        self._participants: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def add_group(self, part_code: str, receivers: str, report_code: str,
+                  zone: str, units_count: int, row: Dict) -> None:
+        """Отчет участника по зоне с уведомлением и числом его заданий."""
+        key = (part_code, report_code, zone)
+        with self._lock:
+            participant = self._participants.setdefault(
+                part_code, [receivers, [], False]
+            )
+            participant[1].append(key)
+            self._groups[key] = [row, units_count, 0]
+
+    def unit_done(self, part_code: str, report_code: str, zone: str,
+                  files_count: int) -> None:
+        """Учет выполненного задания."""
+        with self._lock:
+            group = self._groups.get((part_code, report_code, zone))
+            if group is None:
+                return
+            group[1] -= 1
+            group[2] += files_count
+            ready = self._pop_ready(part_code)
+        self._send(ready)
+
+    def seal(self, part_code: str) -> None:
+        """Отметка о том, что все задания участника запланированы."""
+        with self._lock:
+            participant = self._participants.get(part_code)
+            if participant is None:
+                return
+            participant[2] = True
+            ready = self._pop_ready(part_code)
+        self._send(ready)
+
+    def _pop_ready(self, part_code: str
+                   ) -> Optional[Tuple[str, List[Dict]]]:
+        participant = self._participants.get(part_code)
+        if participant is None or not participant[2]:
+            return None
+        receivers, keys, _ = participant
+        groups = [self._groups[key] for key in keys]
+        if any(group[1] > 0 for group in groups):
+            return None
+        del self._participants[part_code]
+        for key in keys:
+            del self._groups[key]
+        return receivers, [group[0] for group in groups if group[2] > 0]
+
+    def _send(self, ready: Optional[Tuple[str, List[Dict]]]) -> None:
+        if ready is not None and ready[1]:
+            self.send(*ready)
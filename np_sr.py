@@ -1,60 +1,234 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-"""Скрипт по загрузке данных с сайта НП СР."""
+"""Загрузка реестров с сайта НП "Совет рынка" (source_type=np_sr)."""
 import os
 import re
+import tempfile
+import time
+import xml.etree.ElementTree as ElementTree
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from http import HTTPStatus
+from os.path import dirname, exists, getmtime, getsize
+from typing import Dict, List, Optional, Tuple
 
 import requests
 
+from exceptions import DownloadFileError, NpSrSiteError, SettingsError
+from http_loader import (HttpLoader, RemoteFile, get_conditional_headers,
+                         is_unchanged)
+
+# Имя источника в журнале загрузки
+SOURCE = 'np_sr'
+
 SITE_URL = "http://www.np-sr.ru"
-VIE_URL = SITE_URL + "/ru/market/vie/index.htm"
-REPORT_PATH = os.path.normpath(
-    r"z:\BPE\Отдел покупок электроэнергии - RS\База отчетов\НП Совет рынка"
-)
-
-s = requests.Session()
-response = s.get(VIE_URL, verify=False)
-
-RE_EXPR = r"href=\"(/sites/default/files/reestr[_a-z\d.]*?.xlsx?)\""
-results = re.findall(RE_EXPR, response.text)
-
-if results is not None:
-    for ref in results:
-        if "reestr_kvalificirovannyh" in ref:
-            REPORT_DIR = os.path.join(
-                REPORT_PATH, "Перечень квалифицированных объектов"
+
+# Ссылки на файлы реестров на странице (по умолчанию)
+LINK_PATTERN = r"href=\"(/sites/default/files/reestr[_a-z\d.]*?.xlsx?)\""
+
+
+@dataclass(frozen=True)
+class NpSrFile:
+    """Файлы страницы, ссылки на которые содержат pattern (регулярное
+    выражение), и папка для них относительно HOME_DIR_FOR_SAVE."""
+
+    pattern: str
+    path: str
+
+
+@dataclass(frozen=True)
+class NpSrPage:
+    """Страница сайта со ссылками на файлы."""
+
+    url: str
+    link_pattern: str
+    files: Tuple[NpSrFile, ...]
+
+
+def compile_pattern(pattern: str, attr: str, url: str) -> str:
+    """Проверка регулярного выражения из настроек."""
+    try:
+        re.compile(pattern)
+    except re.error as err:
+        raise SettingsError(f'Page {url}: bad {attr} {pattern!r}: {err}')
+    return pattern
+
+
+def load_np_sr_settings(settings_file: str) -> Tuple[NpSrPage, ...]:
+    """Чтение настроек страниц и файлов НП "Совет рынка"."""
+    if not settings_file or not exists(settings_file):
+        raise SettingsError(f'Settings file {settings_file} not found')
+    root = ElementTree.parse(settings_file).getroot()
+    pages = []
+    for page_tag in root.findall('page'):
+        url = page_tag.get('url')
+        if not url:
+            raise SettingsError('Page: attribute url is required')
+        files = []
+        for file_tag in page_tag.findall('file'):
+            for attr in ('pattern', 'path'):
+                if file_tag.get(attr) is None:
+                    raise SettingsError(
+                        f'Page {url}: file attribute {attr} is required'
+                    )
+            files.append(NpSrFile(
+                pattern=compile_pattern(file_tag.get('pattern'), 'pattern',
+                                        url),
+                path=file_tag.get('path')
+            ))
+        pages.append(NpSrPage(
+            url=url,
+            link_pattern=compile_pattern(
+                page_tag.get('linkPattern', LINK_PATTERN), 'linkPattern', url
+            ),
+            files=tuple(files)
+        ))
+    return tuple(pages)
+
+
+def is_same_file(response: requests.Response, file_name: str,
+                 known: Optional[RemoteFile]) -> bool:
+    """Совпадает ли файл на сайте (по заголовкам ответа) с файлом на диске.
+
+    Если файл уже загружался, сравниваются ETag либо Last-Modified и
+    размер. Для файла, загруженного без записи в журнал (прежней версией
+    программы), сравнивается размер и проверяется, что файл на сайте
+    не изменен после записи файла на диск.
+    """
+    if known is not None and (known.etag or known.last_modified):
+        return is_unchanged(response, known)
+    last_modified = response.headers.get('Last-Modified')
+    length = response.headers.get('Content-Length')
+    if 'Content-Encoding' in response.headers:
+        length = None
+    if length is None or int(length) != getsize(file_name):
+        return False
+    if last_modified:
+        try:
+            modified = parsedate_to_datetime(last_modified).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return modified <= getmtime(file_name)
+    return known is not None
+
+
+class NpSrLoader(HttpLoader):
+    """Загрузчик файлов с сайта НП "Совет рынка".
+
+    Файлы, которые уже есть на диске, запрашиваются условным запросом
+    (If-None-Match/If-Modified-Since) и загружаются заново, только если
+    они изменились на сайте.
+    """
+
+    def __init__(self, logger, verify_status, base_url=SITE_URL, **kwargs):
+        super().__init__(logger, verify_status, **kwargs)
+        self.part_code = SOURCE
+        self.BASE_URL = base_url.rstrip('/')
+
+    def get_page_files(self, page: NpSrPage) -> List[Tuple[str, NpSrFile]]:
+        """Адреса файлов страницы и их настройки."""
+        page_url = self.BASE_URL + page.url
+        try:
+            response = self.request('GET', page_url)
+        except requests.exceptions.RequestException as exception:
+            raise NpSrSiteError(f'Error loading page: {page_url}. '
+                                f'{exception}')
+        if response.status_code != HTTPStatus.OK:
+            raise NpSrSiteError(f'Error loading page: {page_url}. '
+                                f'Response code {response.status_code}')
+        result = []
+        for ref in dict.fromkeys(re.findall(page.link_pattern,
+                                            response.text)):
+            for file_setting in page.files:
+                if re.search(file_setting.pattern, ref):
+                    result.append((self.BASE_URL + ref, file_setting))
+                    break
+        return result
+
+    def open_file(self, url: str,
+                  headers: Optional[Dict] = None) -> requests.Response:
+        """Запрос файла (допускаются ответы 304 и 206 на условный запрос
+        и запрос части файла)."""
+        try:
+            response = self.request('GET', url, stream=True,
+                                    headers=headers)
+        except requests.exceptions.RequestException as exception:
+            raise DownloadFileError(
+                f'Bad response with loading file {url}. {exception}'
             )
-        elif "reestr_sertifikatov" in ref:
-            REPORT_DIR = os.path.join(REPORT_PATH, "Реестр сертификатов")
-        else:
-            REPORT_DIR = None
-
-        if REPORT_DIR is not None:
-            if not os.path.exists(REPORT_DIR):
-                os.makedirs(REPORT_DIR)
-
-            filename = ref.split("/")[-1]
-            full_filename = os.path.join(REPORT_DIR, filename)
-            if not os.path.exists(full_filename):
-                try:
-                    FILE_URL = SITE_URL + ref
-
-                    response = s.get(FILE_URL, verify=False)
-                    if response.status_code != 200:
-                        print(
-                            "Bad response with loading file %s. \
-                                        Response code %s",
-                            os.path.basename(filename),
-                            response.status_code,
-                        )
-                except requests.exceptions.RequestException as exception:
-                    print(exception)
-
-                print("Файл: {}".format(filename))
-
-                try:
-                    with open(full_filename, "wb") as report_file:
-                        report_file.write(response.content)
-                except IOError:
-                    print("Error with saving file %s", filename)
+        allowed = [HTTPStatus.OK]
+        if headers and 'Range' in headers:
+            allowed.append(HTTPStatus.PARTIAL_CONTENT)
+        if headers and ('If-None-Match' in headers
+                        or 'If-Modified-Since' in headers):
+            allowed.append(HTTPStatus.NOT_MODIFIED)
+        if response.status_code not in allowed:
+            response.close()
+            raise DownloadFileError(
+                f'Bad response with loading file {url}. '
+                f'Response code {response.status_code}'
+            )
+        return response
+
+    def update_file(self, url: str, file_name: str,
+                    known: Optional[RemoteFile],
+                    force: bool = False) -> Tuple[RemoteFile, bool]:
+        """Загрузка файла, если его нет на диске или он изменился на сайте.
+
+        Измененный файл скачивается во временный файл и атомарно заменяет
+        прежний. При force=True файл загружается без проверки изменений.
+        Возвращает метаданные файла и признак того, что файл загружен.
+        """
+        check = exists(file_name) and not force
+        headers = get_conditional_headers(known) if check else {}
+        response = self.open_file(url, headers)
+        if response.status_code == HTTPStatus.NOT_MODIFIED:
+            response.close()
+            return known, False
+        remote_file = RemoteFile(
+            url=url,
+            file_name=file_name,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+            size=getsize(file_name) if check else None,
+            sha256=None
+        )
+        if check and is_same_file(response, file_name, known):
+            response.close()
+            return remote_file, False
+
+        if not self.quiet:
+            print(f'Файл: {os.path.basename(file_name)}')
+        self.logger.info(f'Download file: {url}')
+        start = time.monotonic()
+        os.makedirs(dirname(file_name), exist_ok=True)
+        tmp_file = tempfile.NamedTemporaryFile(
+            dir=dirname(file_name), prefix='.py_ats_', suffix='.part',
+            delete=False
+        )
+        try:
+            with tmp_file:
+                size, sha256 = self.copy_response(
+                    response, lambda resume: self.open_file(url, resume),
+                    tmp_file, os.path.basename(file_name)
+                )
+            os.replace(tmp_file.name, file_name)
+        except Exception:
+            if exists(tmp_file.name):
+                os.remove(tmp_file.name)
+            raise
+        if self.rate_limiter is not None:
+            self.rate_limiter.record_throughput(
+                size, time.monotonic() - start
+            )
+        return RemoteFile(url=url, file_name=file_name,
+                          etag=remote_file.etag,
+                          last_modified=remote_file.last_modified,
+                          size=size, sha256=sha256), True
+
+
+if __name__ == '__main__':
+    # Прежний способ запуска: python np_sr.py
+    import main
+    main.load_from_np_sr({'source_type': SOURCE})
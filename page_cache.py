@@ -0,0 +1,170 @@
+"""Кэш страниц отчетов сайта АТС."""
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_fetched_at ON pages (fetched_at);
+"""
+
+# Время ожидания блокировки кэша другим процессом загрузки (в секундах)
+SQLITE_TIMEOUT = 30
+
+
+@dataclass
+class CachedPage:
+    """Страница отчета и данные для ее условной перепроверки."""
+
+    text: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Заголовки условного запроса (If-None-Match/If-Modified-Since)."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class PageCache():
+    """Двухуровневый кэш страниц отчетов.
+
+    Страница используется без обращения к сайту в течение ttl секунд,
+    после этого она перепроверяется условным запросом по
+    ETag/Last-Modified, если сервер их прислал. Повторные запросы одной и
+    той же страницы (в том числе одновременные из разных потоков)
+    выполняют один HTTP-запрос. Просроченные страницы удаляются из памяти,
+    поэтому долго работающий процесс (daemon) видит новые файлы отчетов.
+    Если задан db_file, страницы сохраняются также на диск (SQLite) и
+    используются в следующих запусках. Суммарный размер страниц на диске
+    ограничен max_bytes, первыми удаляются самые старые.
+    """
+
+    def __init__(self, db_file: Optional[str] = None, ttl: float = 3600,
+                 max_bytes: int = 50 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._memory: Dict[str, CachedPage] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self.connection = None
+        if db_file:
+            self.connection = sqlite3.connect(db_file,
+                                              timeout=SQLITE_TIMEOUT,
+                                              check_same_thread=False)
+            with self._lock:
+                self.connection.executescript(SCHEMA)
+                self.connection.commit()
+
+    @staticmethod
+    def make_key(key: Tuple[str, ...]) -> str:
+        return '|'.join(key)
+
+    def _is_fresh(self, page: CachedPage) -> bool:
+        return time.time() - page.fetched_at < self.ttl
+
+    def _load(self, key: str) -> Optional[CachedPage]:
+        if self.connection is None:
+            return None
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT text, etag, last_modified, fetched_at FROM pages '
+                'WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return CachedPage(*row)
+
+    def _store(self, key: str, page: CachedPage) -> None:
+        with self._lock:
+            self._memory[key] = page
+            for old_key in [old_key for old_key, old_page
+                            in self._memory.items()
+                            if not self._is_fresh(old_page)]:
+                del self._memory[old_key]
+            if self.connection is None:
+                return
+            self.connection.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                (key, page.text, page.etag, page.last_modified,
+                 page.fetched_at, len(page.text))
+            )
+            self._evict()
+            self.connection.commit()
+
+    def _evict(self) -> None:
+        # Просроченные страницы без ETag/Last-Modified уже не пригодятся
+        self.connection.execute(
+            'DELETE FROM pages WHERE fetched_at < ? '
+            'AND etag IS NULL AND last_modified IS NULL',
+            (time.time() - self.ttl,)
+        )
+        total = self.connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM pages'
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.connection.execute(
+                'SELECT key, size FROM pages ORDER BY fetched_at'
+        ).fetchall():
+            self.connection.execute('DELETE FROM pages WHERE key = ?',
+                                    (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def fetch(self, key: Tuple[str, ...],
+              load_page: Callable[[Dict[str, str]], Optional[CachedPage]]
+              ) -> CachedPage:
+        """Страница из кэша либо с сайта.
+
+        load_page получает заголовки условного запроса и возвращает новую
+        страницу или None, если сервер ответил, что страница не изменилась.
+        """
+        key = self.make_key(key)
+        with self._lock:
+            page = self._memory.get(key)
+            if page is not None and self._is_fresh(page):
+                return page
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # Одну и ту же страницу загружает только один поток
+        with key_lock:
+            with self._lock:
+                page = self._memory.get(key)
+            if page is not None and self._is_fresh(page):
+                return page
+
+            page = self._load(key) or page
+            if page is not None and self._is_fresh(page):
+                with self._lock:
+                    self._memory[key] = page
+                return page
+
+            headers = page.conditional_headers() if page is not None else {}
+            new_page = load_page(headers)
+            if new_page is None:
+                # страница не изменилась
+                page.fetched_at = time.time()
+            else:
+                page = new_page
+            self._store(key, page)
+            return page
+
+    def close(self) -> None:
+        if self.connection is not None:
+            with self._lock:
+                self.connection.close()
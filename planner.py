@@ -0,0 +1,148 @@
+"""Планирование заданий на загрузку отчетов."""
+import datetime
+from os.path import join
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from engine import DownloadUnit
+from manifest import unit_key
+from report_settings import Period, ReportSetting
+
+
+def iter_month_starts(dt1: datetime.date, dt2: datetime.date,
+                      step: int = 1) -> Iterator[datetime.date]:
+    """Первые числа месяцев (с шагом step от января), начиная с месяца dt1."""
+    month = dt1.month - 1
+    month -= month % step
+    year = dt1.year
+    while True:
+        dt = datetime.date(year, month + 1, 1)
+        if dt > dt2:
+            return
+        yield dt
+        month += step
+        year += month // 12
+        month %= 12
+
+
+def get_period_dates(period: Period, dt1: datetime.date,
+                     dt2: datetime.date,
+                     weekdays: Tuple[int, ...] = ()) -> List[datetime.date]:
+    """Даты загрузки отчета в интервале [dt1, dt2] с учетом периодичности.
+
+    Даты вычисляются сразу, без перебора всех дней интервала.
+    """
+    if dt1 > dt2:
+        return []
+    one_day = datetime.timedelta(days=1)
+    if period == Period.DAY:
+        return [dt1 + datetime.timedelta(days=i)
+                for i in range((dt2 - dt1).days + 1)]
+    if period in (Period.WEEK, Period.WEEKDAYS):
+        if period == Period.WEEK:
+            weekdays = (0,)
+        dates = []
+        for weekday in weekdays:
+            dt = dt1 + datetime.timedelta(days=(weekday - dt1.weekday()) % 7)
+            while dt <= dt2:
+                dates.append(dt)
+                dt += datetime.timedelta(days=7)
+        return sorted(dates)
+    if period in (Period.MONTH, Period.QUARTER):
+        step = 1 if period == Period.MONTH else 3
+        return [dt for dt in iter_month_starts(dt1, dt2, step) if dt >= dt1]
+    if period in (Period.END_OF_MONTH, Period.END_OF_QUARTER):
+        step = 1 if period == Period.END_OF_MONTH else 3
+        # последний день периода - это день перед началом следующего
+        return [start - one_day
+                for start in iter_month_starts(dt1, dt2 + one_day, step)
+                if start > dt1]
+    raise ValueError(f'Unknown report period {period}')
+
+
+def is_report_selected(report: ReportSetting, script_settings: Dict) -> bool:
+    """Проверка, нужно ли загружать отчет."""
+    # проверяем, заданы ли коды отчетов
+    if 'reportcode' in script_settings.keys():
+        if (not report.code.lower()
+                in script_settings['reportcode'].lower().split(',')):
+            return False
+    return report.is_need_to_load
+
+
+def get_report_zones(report: ReportSetting, participant: Dict) -> List[str]:
+    """Ценовые зоны, по которым загружается отчет."""
+    if report.zone == 'zone':
+        price_zones = str(participant['zone'])
+    else:
+        price_zones = report.zone
+    return price_zones.split(';')
+
+
+def plan_units(part_code: str, report: ReportSetting, zone: str,
+               dt1: datetime.date, dt2: datetime.date,
+               home_dir: str) -> List[DownloadUnit]:
+    """Задания на загрузку отчета по одной ценовой зоне."""
+    return [
+        DownloadUnit(
+            part_code=part_code,
+            report_code=report.code,
+            zone=zone,
+            date=dt,
+            report=report,
+            dest_dir=join(home_dir, report.path.render(part_code, zone, dt))
+        )
+        for dt in get_period_dates(report.period, dt1, dt2, report.weekdays)
+    ]
+
+
+def exclude_complete_units(units: List[DownloadUnit],
+                           complete_units: Set[Tuple[str, str, str, str]],
+                           recheck_from: datetime.date) -> List[DownloadUnit]:
+    """Исключение уже загруженных дат, которые не могут измениться."""
+    return [
+        unit for unit in units
+        if unit.date >= recheck_from or unit_key(unit) not in complete_units
+    ]
+
+
+def get_incremental_start(report: ReportSetting, dt1: datetime.date,
+                          dt2: datetime.date,
+                          watermark: Optional[datetime.date],
+                          recheck_from: datetime.date) -> datetime.date:
+    """Начало периода загрузки отчета в режиме mode=incremental.
+
+    Запрашиваются даты после отметки watermark (последней полностью
+    загруженной даты), а также последние дни начиная с recheck_from, за
+    которые АТС может опубликовать исправления. Период не выходит за
+    глубину загрузки отчета (lookback) и за начало периода dt1.
+    """
+    start = dt1
+    if report.lookback is not None:
+        start = max(start, dt2 - datetime.timedelta(days=report.lookback))
+    if watermark is not None:
+        start = max(start, min(watermark + datetime.timedelta(days=1),
+                               recheck_from))
+    return start
+
+
+def advance_watermark(watermark: Optional[datetime.date],
+                      units: List[DownloadUnit],
+                      complete_units: Set[Tuple[str, str, str, str]],
+                      empty_units: Set[Tuple[str, str, str, str]] = frozenset()
+                      ) -> Optional[datetime.date]:
+    """Сдвиг отметки до последней даты, до которой завершены все задания.
+
+    units - все задания отчета по зоне за период загрузки по порядку дат,
+    empty_units - даты, страницы которых окончательно пусты (они считаются
+    завершенными). Отметка сдвигается только по непрерывной цепочке
+    завершенных заданий.
+    """
+    for unit in units:
+        if watermark is not None and unit.date <= watermark:
+            continue
+        key = unit_key(unit)
+        if key not in complete_units and key not in empty_units:
+            break
+        if watermark is None or unit.date > watermark:
+            watermark = unit.date
+    return watermark
@@ -0,0 +1,100 @@
+"""Отрицательный кэш пустых страниц отчетов и ожидаемое время публикации."""
+import datetime
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from engine import DownloadUnit
+from manifest import unit_key
+
+EmptyPages = Dict[Tuple[str, str, str, str], Tuple[datetime.datetime, int]]
+
+
+@dataclass(frozen=True)
+class PublicationPolicy:
+    """Правила повторного запроса пустых страниц отчетов.
+
+    Пустая страница запрашивается снова не раньше, чем через
+    base_ttl часов, умноженных на возраст даты в днях и удвоенных за каждую
+    следующую пустую проверку (но не позже, чем через max_ttl часов).
+    Даты старше recheck_from, пустые max_misses проверок подряд, больше
+    не запрашиваются. Страницы за сегодня и завтра запрашиваются только
+    начиная с margin часов до самого раннего наблюдавшегося времени
+    публикации отчета.
+    """
+
+    base_ttl: float = 1
+    max_ttl: float = 168
+    max_misses: int = 5
+    margin: float = 1
+
+    def empty_ttl(self, date: datetime.date, misses: int,
+                  today: datetime.date) -> datetime.timedelta:
+        """Время, в течение которого пустая страница не запрашивается."""
+        age = max((today - date).days, 1)
+        hours = self.base_ttl * age * 2 ** (max(misses, 1) - 1)
+        return datetime.timedelta(hours=min(hours, self.max_ttl))
+
+    def is_empty_due(self, date: datetime.date, checked_at: datetime.datetime,
+                     misses: int, now: datetime.datetime,
+                     recheck_from: datetime.date) -> bool:
+        """Нужно ли снова запросить пустую страницу."""
+        if date < recheck_from and misses >= self.max_misses:
+            return False
+        return now - checked_at >= self.empty_ttl(date, misses, now.date())
+
+    def is_confirmed_empty(self, date: datetime.date, misses: int,
+                           recheck_from: datetime.date) -> bool:
+        """Пуста ли страница окончательно (дата старше recheck_from либо
+        пустая max_misses проверок подряд)."""
+        return date < recheck_from or misses >= self.max_misses
+
+    def get_publication_start(self, date: datetime.date,
+                              lags: List[float]
+                              ) -> Optional[datetime.datetime]:
+        """Время, с которого имеет смысл запрашивать страницу за дату."""
+        if not lags:
+            return None
+        return (datetime.datetime.combine(date, datetime.time.min)
+                + datetime.timedelta(hours=min(lags) - self.margin))
+
+
+def exclude_unpublished_units(units: List[DownloadUnit],
+                              empty_pages: EmptyPages,
+                              publication_lags: Dict[str, List[float]],
+                              policy: PublicationPolicy,
+                              recheck_from: datetime.date,
+                              now: Optional[datetime.datetime] = None
+                              ) -> List[DownloadUnit]:
+    """Исключение дат, страницы которых недавно были пустыми или которые
+    по статистике еще не опубликованы."""
+    if now is None:
+        now = datetime.datetime.now()
+    today = now.date()
+    result = []
+    for unit in units:
+        empty = empty_pages.get(unit_key(unit))
+        if empty is not None and not policy.is_empty_due(
+                unit.date, empty[0], empty[1], now, recheck_from):
+            continue
+        if unit.date >= today:
+            start = policy.get_publication_start(
+                unit.date, publication_lags.get(unit.report_code, [])
+            )
+            if start is not None and now < start:
+                continue
+        result.append(unit)
+    return result
+
+
+def get_confirmed_empty_units(empty_pages: EmptyPages,
+                              policy: PublicationPolicy,
+                              recheck_from: datetime.date
+                              ) -> Set[Tuple[str, str, str, str]]:
+    """Даты, страницы которых окончательно пусты (выходные дни, отчеты
+    и зоны без публикаций): для отметки watermark они считаются
+    загруженными."""
+    return {
+        key for key, (_, misses) in empty_pages.items()
+        if policy.is_confirmed_empty(datetime.date.fromisoformat(key[3]),
+                                     misses, recheck_from)
+    }
@@ -0,0 +1,198 @@
+"""Адаптивное ограничение скорости запросов к сайту АТС."""
+import logging
+import threading
+import time
+from typing import Optional
+
+# Кратное превышение среднего времени ответа, считающееся замедлением сервера
+LATENCY_SPIKE_FACTOR = 3.0
+# Минимальный абсолютный рост времени ответа (в секундах), чтобы колебания
+# на быстрых ответах не считались замедлением
+MIN_LATENCY_SPIKE = 0.5
+# Доля от средней скорости скачивания, считающаяся падением пропускной
+# способности
+THROUGHPUT_DROP_FACTOR = 0.3
+# Минимальный размер файла (в байтах) для оценки скорости скачивания: на
+# мелких файлах скорость определяется временем ответа, а не каналом
+MIN_THROUGHPUT_SAMPLE = 256 * 1024
+# Коэффициент сглаживания скользящих средних
+EWMA_ALPHA = 0.2
+# Прирост допустимой частоты запросов после каждого успешного ответа
+INCREASE_STEP = 0.1
+# Во сколько раз снижается частота запросов при признаках перегрузки
+DECREASE_FACTOR = 0.5
+# Минимальный интервал между двумя снижениями частоты (в секундах), чтобы
+# пачка одновременных ошибок от параллельных потоков не обнуляла скорость
+DECREASE_COOLDOWN = 1.0
+# Пауза после ответа 429, если сервер не прислал заголовок Retry-After
+DEFAULT_RETRY_AFTER = 5.0
+
+
+class TokenBucket():
+    """Потокобезопасное "ведро токенов".
+
+    Токены пополняются со скоростью rate в секунду, но не более capacity.
+    Запрос, которому не хватило токенов, резервирует их "в долг" и ждет,
+    пока долг не будет погашен, поэтому ожидающие потоки обслуживаются
+    в порядке обращения. При rate <= 0 ограничение отключено.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def set_rate(self, rate: float) -> None:
+        """Изменение скорости пополнения."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.capacity = max(rate, 1)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Получение токенов. Возвращает время ожидания в секундах."""
+        with self._lock:
+            if self.rate <= 0:
+                return 0.0
+            self._refill(time.monotonic())
+            self.tokens -= tokens
+            wait = max(0.0, -self.tokens / self.rate)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class AdaptiveRateLimiter():
+    """Ограничитель частоты запросов и скорости скачивания.
+
+    Частота запросов подстраивается по принципу AIMD: после каждого
+    успешного ответа она плавно растет до max_rate, а при ответах
+    429/5xx, сетевых ошибках, резком росте времени ответа или падении
+    скорости скачивания - снижается вдвое (но не ниже min_rate).
+    Один экземпляр можно использовать из нескольких потоков.
+    """
+
+    def __init__(self, requests_per_sec: float, bytes_per_sec: float = 0,
+                 min_rate: float = 0.2, max_rate: Optional[float] = None,
+                 logger: Optional[logging.Logger] = None):
+        self.requests = TokenBucket(requests_per_sec)
+        self.bytes = TokenBucket(bytes_per_sec)
+        self.min_rate = min_rate
+        self.max_rate = max_rate if max_rate is not None else requests_per_sec
+        self.logger = logger
+        self.latency_avg = None
+        self.throughput_avg = None
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        return self.requests.rate
+
+    def acquire(self) -> float:
+        """Ожидание разрешения на очередной запрос.
+
+        Возвращает суммарное время ожидания в секундах.
+        """
+        waited = 0.0
+        pause = self.blocked_until - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+            waited += pause
+        return waited + self.requests.acquire(1)
+
+    def consume(self, nbytes: int) -> float:
+        """Учет полученных байт в ограничении скорости скачивания."""
+        return self.bytes.acquire(nbytes)
+
+    def _decrease(self, reason: str) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now - self.last_decrease < DECREASE_COOLDOWN:
+                return
+            self.last_decrease = now
+            old_rate = self.requests.rate
+            new_rate = max(self.min_rate, old_rate * DECREASE_FACTOR)
+        self.requests.set_rate(new_rate)
+        if self.logger is not None:
+            self.logger.info(
+                f'Rate limit decreased from {old_rate:.2f} to '
+                f'{new_rate:.2f} req/sec: {reason}'
+            )
+
+    def _increase(self) -> None:
+        with self._lock:
+            new_rate = min(self.max_rate, self.requests.rate + INCREASE_STEP)
+        if new_rate != self.requests.rate:
+            self.requests.set_rate(new_rate)
+
+    def block(self, seconds: float) -> None:
+        """Приостановка всех запросов на заданное время."""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until,
+                                     time.monotonic() + seconds)
+
+    def record_response(self, status_code: int, latency: float,
+                        retry_after: Optional[str] = None) -> None:
+        """Учет ответа сервера: кода и времени ответа (в секундах)."""
+        if status_code == 429:
+            try:
+                pause = float(retry_after)
+            except (TypeError, ValueError):
+                pause = DEFAULT_RETRY_AFTER
+            self.block(pause)
+            self._decrease(f'response code 429, pause {pause} sec')
+            return
+        if status_code >= 500:
+            self._decrease(f'response code {status_code}')
+            return
+
+        with self._lock:
+            average = self.latency_avg
+            if average is None:
+                self.latency_avg = latency
+            else:
+                self.latency_avg = (EWMA_ALPHA * latency
+                                    + (1 - EWMA_ALPHA) * average)
+        if (average is not None
+                and latency > average * LATENCY_SPIKE_FACTOR
+                and latency - average > MIN_LATENCY_SPIKE):
+            self._decrease(
+                f'latency {latency:.2f} sec (average {average:.2f} sec)'
+            )
+        else:
+            self._increase()
+
+    def record_error(self, error: Exception) -> None:
+        """Учет сетевой ошибки."""
+        self._decrease(f'request error {type(error).__name__}')
+
+    def record_throughput(self, nbytes: int, seconds: float) -> None:
+        """Учет скорости скачивания файла."""
+        if seconds <= 0 or nbytes < MIN_THROUGHPUT_SAMPLE:
+            return
+        throughput = nbytes / seconds
+        with self._lock:
+            average = self.throughput_avg
+            if average is None:
+                self.throughput_avg = throughput
+            else:
+                self.throughput_avg = (EWMA_ALPHA * throughput
+                                       + (1 - EWMA_ALPHA) * average)
+        if (average is not None
+                and throughput < average * THROUGHPUT_DROP_FACTOR):
+            self._decrease(
+                f'throughput {throughput / 1024:.0f} KB/sec '
+                f'(average {average / 1024:.0f} KB/sec)'
+            )
@@ -0,0 +1,289 @@
+"""Настройки отчетов: разбор и проверка файлов ReportSettings*.xml."""
+import datetime
+import os
+import re
+import threading
+import xml.etree.ElementTree as ElementTree
+from dataclasses import dataclass
+from enum import Enum
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+from exceptions import SettingsError
+
+WEEKDAYS = {'mon': 0, 'tue': 1, 'wed': 2, 'thu': 3,
+            'fri': 4, 'sat': 5, 'sun': 6}
+
+
+class Period(Enum):
+    """Периодичность отчета."""
+
+    # ежедневно
+    DAY = 'day'
+    # по понедельникам
+    WEEK = 'week'
+    # на первое число месяца
+    MONTH = 'month'
+    # на последний день месяца
+    END_OF_MONTH = 'end_of_month'
+    # на первое число квартала
+    QUARTER = 'quarter'
+    # на последний день квартала
+    END_OF_QUARTER = 'end_of_quarter'
+    # в заданные дни недели (weekdays:mon,thu)
+    WEEKDAYS = 'weekdays'
+
+
+class LoadFileType(Enum):
+    """Способ загрузки файла отчета."""
+
+    # файл запрашивается с сайта в архиве (&zip=1)
+    ZIP = 'zip'
+    # файл запрашивается как есть
+    FILE = 'file'
+
+
+class PathTemplate():
+    """Шаблон пути с подстановками %USERCODE%, %REGION%, %YEAR%, %MONTH%,
+    %DAY%, разобранный один раз на постоянные части и подстановки."""
+
+    MASKS = ('%USERCODE%', '%REGION%', '%YEAR%', '%MONTH%', '%DAY%')
+    _RE_MASKS = re.compile('(' + '|'.join(MASKS) + ')')
+
+    __slots__ = ('template', 'parts')
+
+    def __init__(self, template: str):
+        self.template = template
+        self.parts = tuple(part for part in self._RE_MASKS.split(template)
+                           if part)
+
+    def render(self, ucode: str, region: str, date1: datetime.date) -> str:
+        values = {
+            '%USERCODE%': ucode,
+            '%REGION%': region,
+            '%YEAR%': f'{date1.year:04d}',
+            '%MONTH%': f'{date1.month:02d}',
+            '%DAY%': f'{date1.day:02d}'
+        }
+        return ''.join(values.get(part, part) for part in self.parts)
+
+    def __repr__(self):
+        return f'PathTemplate({self.template!r})'
+
+
+@lru_cache(maxsize=1024)
+def compile_path(template: str) -> PathTemplate:
+    """Разобранный шаблон пути (с кэшированием)."""
+    return PathTemplate(template)
+
+
+@dataclass(frozen=True)
+class ReportSetting:
+    """Настройки загрузки одного отчета."""
+
+    __slots__ = ('name', 'code', 'code2', 'type', 'file_mask',
+                 'load_file_type', 'is_need_to_unpack', 'is_need_to_load',
+                 'notify', 'zone', 'path', 'period', 'weekdays', 'lookback',
+                 'poll_interval', 'publish_window', 'priority')
+
+    name: str
+    code: str
+    code2: Optional[str]
+    type: Optional[str]
+    file_mask: Optional[str]
+    load_file_type: LoadFileType
+    is_need_to_unpack: bool
+    is_need_to_load: bool
+    notify: bool
+    # 'zone' - зоны участника, иначе список зон через ';'
+    zone: str
+    path: PathTemplate
+    period: Period
+    # дни недели для Period.WEEKDAYS (0 - понедельник)
+    weekdays: Tuple[int, ...]
+    # глубина загрузки в днях в режиме mode=incremental (None - MAX_TIMESHIFT)
+    lookback: Optional[int]
+    # интервал опроса сайта в режиме source_type=daemon в минутах
+    # (None - по периодичности отчета)
+    poll_interval: Optional[int]
+    # время суток, в которое отчет публикуется на сайте (начало, конец);
+    # вне этого окна отчет в режиме source_type=daemon не опрашивается
+    publish_window: Optional[Tuple[datetime.time, datetime.time]]
+    # приоритет в очереди заданий source_type=daemon (меньше - раньше;
+    # None - по периодичности отчета)
+    priority: Optional[int]
+
+    @property
+    def period_name(self) -> str:
+        if self.period == Period.WEEKDAYS:
+            names = {number: name for name, number in WEEKDAYS.items()}
+            return 'weekdays:' + ','.join(names[day]
+                                          for day in self.weekdays)
+        return self.period.value
+
+
+def parse_bool(value: Optional[str], default: bool, attr: str,
+               code: str) -> bool:
+    """Разбор логического атрибута."""
+    if value is None:
+        return default
+    if value.strip().lower() == 'true':
+        return True
+    if value.strip().lower() == 'false':
+        return False
+    raise SettingsError(
+        f'Report {code}: attribute {attr} must be true or false, '
+        f'got {value!r}'
+    )
+
+
+def parse_number(value: Optional[str], attr: str, code: str,
+                 unit: str = 'days') -> Optional[int]:
+    """Разбор атрибута с неотрицательным числом (дней, минут)."""
+    if value is None:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise SettingsError(
+            f'Report {code}: attribute {attr} must be a non-negative number '
+            f'of {unit}, got {value!r}'
+        )
+    return number
+
+
+def parse_window(value: Optional[str], attr: str, code: str
+                 ) -> Optional[Tuple[datetime.time, datetime.time]]:
+    """Разбор окна времени суток вида HH:MM-HH:MM.
+
+    Окно может переходить через полночь (например, 22:00-02:00).
+    """
+    if value is None:
+        return None
+    try:
+        start, end = (datetime.datetime.strptime(part.strip(), '%H:%M').time()
+                      for part in value.split('-'))
+    except ValueError:
+        raise SettingsError(
+            f'Report {code}: attribute {attr} must be a time window '
+            f'HH:MM-HH:MM, got {value!r}'
+        )
+    if start == end:
+        raise SettingsError(
+            f'Report {code}: attribute {attr} must not be empty, '
+            f'got {value!r}'
+        )
+    return start, end
+
+
+def parse_period(value: Optional[str],
+                 code: str) -> Tuple[Period, Tuple[int, ...]]:
+    """Разбор периодичности отчета."""
+    if value is None:
+        return Period.DAY, ()
+    if value.startswith('weekdays:'):
+        names = value.split(':', 1)[1].lower().split(',')
+        try:
+            weekdays = tuple(sorted({WEEKDAYS[name.strip()]
+                                     for name in names}))
+        except KeyError as err:
+            raise SettingsError(
+                f'Report {code}: unknown weekday {err} in period {value!r}'
+            )
+        return Period.WEEKDAYS, weekdays
+    try:
+        period = Period(value)
+    except ValueError:
+        raise SettingsError(f'Report {code}: unknown period {value!r}')
+    if period == Period.WEEKDAYS:
+        raise SettingsError(
+            f'Report {code}: period weekdays requires a list of days, '
+            f'e.g. weekdays:mon,thu'
+        )
+    return period, ()
+
+
+def parse_report(rep_tag: ElementTree.Element) -> ReportSetting:
+    """Разбор и проверка тега report."""
+    code = rep_tag.get('code')
+    if not code:
+        raise SettingsError(
+            f"Report {rep_tag.get('name')!r}: attribute code is required"
+        )
+    for attr in ('loadFileType', 'region', 'path'):
+        if rep_tag.get(attr) is None:
+            raise SettingsError(
+                f'Report {code}: attribute {attr} is required'
+            )
+    try:
+        load_file_type = LoadFileType(rep_tag.get('loadFileType'))
+    except ValueError:
+        raise SettingsError(
+            f"Report {code}: unknown loadFileType "
+            f"{rep_tag.get('loadFileType')!r}"
+        )
+    period, weekdays = parse_period(rep_tag.get('period'), code)
+    poll_interval = parse_number(rep_tag.get('pollInterval'),
+                                 'pollInterval', code, 'minutes')
+    if poll_interval == 0:
+        raise SettingsError(
+            f'Report {code}: attribute pollInterval must be positive'
+        )
+    return ReportSetting(
+        name=rep_tag.get('name'),
+        code=code,
+        code2=rep_tag.get('code2'),
+        type=rep_tag.get('type'),
+        file_mask=rep_tag.get('fileMask'),
+        load_file_type=load_file_type,
+        is_need_to_unpack=parse_bool(rep_tag.get('unpack'), False,
+                                     'unpack', code),
+        is_need_to_load=parse_bool(rep_tag.get('needToLoad'), True,
+                                   'needToLoad', code),
+        notify=parse_bool(rep_tag.get('notify'), False, 'notify', code),
+        zone=rep_tag.get('region'),
+        path=compile_path(rep_tag.get('path')),
+        period=period,
+        weekdays=weekdays,
+        lookback=parse_number(rep_tag.get('lookback'), 'lookback', code),
+        poll_interval=poll_interval,
+        publish_window=parse_window(rep_tag.get('publishWindow'),
+                                    'publishWindow', code),
+        priority=parse_number(rep_tag.get('priority'), 'priority', code,
+                              'levels')
+    )
+
+
+_cache: Dict[str, Tuple[float, Tuple[ReportSetting, ...]]] = {}
+_cache_lock = threading.Lock()
+
+
+def load_report_settings(report_settings_file: str
+                         ) -> Tuple[ReportSetting, ...]:
+    """Чтение настроек отчетов.
+
+    Результат кэшируется по времени изменения файла, поэтому в долго
+    работающем процессе файл разбирается заново только после его изменения.
+    Если файла нет, возвращается пустой список настроек.
+    """
+    try:
+        mtime = os.path.getmtime(report_settings_file)
+    except (OSError, TypeError):
+        return ()
+    with _cache_lock:
+        cached = _cache.get(report_settings_file)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    try:
+        root = ElementTree.parse(report_settings_file).getroot()
+    except ElementTree.ParseError as err:
+        raise SettingsError(
+            f'Error parsing report settings {report_settings_file}: {err}'
+        )
+    settings = tuple(parse_report(rep_tag)
+                     for rep_tag in root.findall('report'))
+    with _cache_lock:
+        _cache[report_settings_file] = (mtime, settings)
+    return settings
@@ -0,0 +1,90 @@
+"""Повтор запросов к сайту АТС при временных ошибках."""
+import random
+from http import HTTPStatus
+from typing import Optional
+
+import requests
+
+# Виды временных ошибок
+CONNECT_ERROR = 'connect'
+READ_TIMEOUT = 'read_timeout'
+READ_ERROR = 'read_error'
+SERVER_ERROR = 'server_error'
+THROTTLED = 'throttled'
+
+# Множитель базовой задержки для каждого вида ошибок: при перегрузке
+# сервера (429, 5xx) ждем дольше, чем при единичном обрыве соединения
+DELAY_FACTORS = {
+    CONNECT_ERROR: 2.0,
+    READ_TIMEOUT: 1.0,
+    READ_ERROR: 1.0,
+    SERVER_ERROR: 2.0,
+    THROTTLED: 4.0,
+}
+
+# Ошибки, при которых можно повторить и неидемпотентный запрос (POST):
+# запрос гарантированно не дошел до сервера
+SAFE_FOR_ANY_METHOD = (CONNECT_ERROR,)
+
+
+def classify_exception(exception: Exception) -> Optional[str]:
+    """Вид временной ошибки запроса (None - ошибка не временная)."""
+    if isinstance(exception, requests.exceptions.ConnectTimeout):
+        return CONNECT_ERROR
+    if isinstance(exception, requests.exceptions.ReadTimeout):
+        return READ_TIMEOUT
+    if isinstance(exception, requests.exceptions.SSLError):
+        return None
+    if isinstance(exception, (requests.exceptions.ChunkedEncodingError,
+                              requests.exceptions.ContentDecodingError)):
+        return READ_ERROR
+    if isinstance(exception, requests.exceptions.ConnectionError):
+        return CONNECT_ERROR
+    return None
+
+
+def classify_status(status_code: int) -> Optional[str]:
+    """Вид временной ошибки по коду ответа (None - ответ не ошибочный)."""
+    if status_code == HTTPStatus.TOO_MANY_REQUESTS:
+        return THROTTLED
+    if status_code in (HTTPStatus.INTERNAL_SERVER_ERROR,
+                       HTTPStatus.BAD_GATEWAY,
+                       HTTPStatus.SERVICE_UNAVAILABLE,
+                       HTTPStatus.GATEWAY_TIMEOUT):
+        return SERVER_ERROR
+    return None
+
+
+class RetryPolicy():
+    """Политика повторов с экспоненциальной задержкой и случайным разбросом.
+
+    Задержка перед попыткой n (с нуля) выбирается случайно из интервала
+    [0, min(max_delay, base_delay * factor * 2 ** n)] ("full jitter"), чтобы
+    параллельные потоки не повторяли запросы одновременно.
+    """
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 1.0,
+                 max_delay: float = 60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, kind: Optional[str], attempt: int,
+                     method: str = 'GET') -> bool:
+        """Нужно ли повторять запрос после неудачной попытки attempt."""
+        if kind is None or attempt + 1 >= self.max_attempts:
+            return False
+        return method.upper() != 'POST' or kind in SAFE_FOR_ANY_METHOD
+
+    def delay(self, kind: str, attempt: int,
+              retry_after: Optional[str] = None) -> float:
+        """Задержка перед повтором в секундах."""
+        limit = min(self.max_delay,
+                    self.base_delay * DELAY_FACTORS[kind] * 2 ** attempt)
+        delay = random.uniform(0, limit)
+        if retry_after is not None:
+            try:
+                delay = max(delay, min(float(retry_after), self.max_delay))
+            except ValueError:
+                pass
+        return delay
@@ -0,0 +1,207 @@
+"""Расписание опроса отчетов в режиме source_type=daemon."""
+import datetime
+import heapq
+import itertools
+import logging
+import queue
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from report_settings import Period, ReportSetting
+
+# Интервал опроса сайта по умолчанию (в минутах) по периодичности отчета
+DEFAULT_POLL_INTERVALS = {
+    Period.DAY: 60,
+    Period.WEEKDAYS: 120,
+    Period.WEEK: 360,
+    Period.MONTH: 720,
+    Period.END_OF_MONTH: 720,
+    Period.QUARTER: 1440,
+    Period.END_OF_QUARTER: 1440,
+}
+
+# Приоритет по умолчанию по периодичности отчета (меньше - раньше)
+DEFAULT_PRIORITIES = {
+    Period.DAY: 0,
+    Period.WEEKDAYS: 1,
+    Period.WEEK: 2,
+    Period.MONTH: 3,
+    Period.END_OF_MONTH: 3,
+    Period.QUARTER: 4,
+    Period.END_OF_QUARTER: 4,
+}
+
+# Максимальное время (в секундах) между проверками расписания, за которое
+# замечаются изменения файла настроек отчетов
+REFRESH_INTERVAL = 60
+
+
+def get_poll_interval(report: ReportSetting) -> datetime.timedelta:
+    """Интервал опроса отчета."""
+    minutes = report.poll_interval
+    if minutes is None:
+        minutes = DEFAULT_POLL_INTERVALS[report.period]
+    return datetime.timedelta(minutes=minutes)
+
+
+def get_priority(report: ReportSetting) -> int:
+    """Приоритет отчета в очереди заданий."""
+    if report.priority is not None:
+        return report.priority
+    return DEFAULT_PRIORITIES[report.period]
+
+
+def is_in_window(window: Tuple[datetime.time, datetime.time],
+                 moment: datetime.datetime) -> bool:
+    """Проверка, что момент попадает в окно времени суток."""
+    start, end = window
+    time_of_day = moment.time()
+    if start < end:
+        return start <= time_of_day < end
+    # окно переходит через полночь
+    return time_of_day >= start or time_of_day < end
+
+
+def align_to_window(report: ReportSetting,
+                    moment: datetime.datetime) -> datetime.datetime:
+    """Ближайшее к moment время в окне публикации отчета."""
+    window = report.publish_window
+    if window is None or is_in_window(window, moment):
+        return moment
+    start = datetime.datetime.combine(moment.date(), window[0])
+    if start <= moment:
+        start += datetime.timedelta(days=1)
+    return start
+
+
+def get_next_run(report: ReportSetting,
+                 now: datetime.datetime) -> datetime.datetime:
+    """Время следующего опроса отчета."""
+    return align_to_window(report, now + get_poll_interval(report))
+
+
+class Scheduler():
+    """Очередь опроса отчетов по расписанию.
+
+    Отчеты ждут времени опроса в куче по времени запуска. Наступившие
+    задания попадают в очередь с приоритетом и выполняются пулом из workers
+    потоков, поэтому частые ежедневные отчеты не ждут за загрузкой
+    ежемесячных. Отчет не ставится в очередь повторно, пока не выполнено
+    его предыдущее задание; следующий опрос планируется после завершения
+    задания (в том числе с ошибкой).
+    """
+
+    def __init__(self, handler: Callable[[ReportSetting], None],
+                 logger: logging.Logger, workers: int = 2):
+        self.handler = handler
+        self.logger = logger
+        self.workers = max(workers, 1)
+        self.reports: Dict[str, ReportSetting] = {}
+        # (время запуска, номер, код отчета)
+        self._timers: List[Tuple[datetime.datetime, int, str]] = []
+        # (приоритет, время запуска, номер, код отчета)
+        self._ready = queue.PriorityQueue()
+        # отчеты, которые ждут запуска, стоят в очереди или выполняются
+        self._active: Set[str] = set()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopped = False
+
+    def set_reports(self, reports: Iterable[ReportSetting]) -> None:
+        """Обновление списка отчетов.
+
+        Новые отчеты опрашиваются сразу (в пределах окна публикации),
+        удаленные снимаются с расписания, у остальных обновляются настройки.
+        """
+        now = datetime.datetime.now()
+        with self._lock:
+            self.reports = {report.code: report for report in reports}
+            for code, report in self.reports.items():
+                if code not in self._active:
+                    self._push_timer(align_to_window(report, now), code)
+            self._wakeup.notify()
+
+    def _push_timer(self, run_at: datetime.datetime, code: str) -> None:
+        self._active.add(code)
+        heapq.heappush(self._timers, (run_at, next(self._counter), code))
+
+    def run(self, refresh: Optional[
+            Callable[[], Iterable[ReportSetting]]] = None) -> None:
+        """Выполнение заданий по расписанию до вызова stop.
+
+        refresh возвращает актуальный список отчетов и вызывается
+        не реже раза в REFRESH_INTERVAL секунд.
+        """
+        threads = [
+            threading.Thread(target=self._work, name=f'py_ats_daemon_{i}',
+                             daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                if refresh is not None:
+                    self.set_reports(refresh())
+                with self._lock:
+                    if self._stopped:
+                        break
+                    self._wakeup.wait(self._dispatch())
+        finally:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def _dispatch(self) -> float:
+        """Перенос наступивших заданий в очередь (под блокировкой).
+
+        Возвращает время ожидания до следующего задания в секундах.
+        """
+        now = datetime.datetime.now()
+        while self._timers and self._timers[0][0] <= now:
+            run_at, number, code = heapq.heappop(self._timers)
+            report = self.reports.get(code)
+            if report is None:
+                self._active.discard(code)
+                continue
+            self._ready.put((get_priority(report), run_at, number, code))
+        if not self._timers:
+            return REFRESH_INTERVAL
+        return min(max((self._timers[0][0] - now).total_seconds(), 0),
+                   REFRESH_INTERVAL)
+
+    def _work(self) -> None:
+        while True:
+            _, _, _, code = self._ready.get()
+            if code is None:
+                return
+            with self._lock:
+                report = self.reports.get(code)
+            if report is not None:
+                try:
+                    self.handler(report)
+                except Exception as err:
+                    self.logger.exception(
+                        f'Error loading report {code}: {err}'
+                    )
+            with self._lock:
+                report = self.reports.get(code)
+                if report is None or self._stopped:
+                    self._active.discard(code)
+                    continue
+                self._push_timer(get_next_run(report,
+                                              datetime.datetime.now()), code)
+                self._wakeup.notify()
+
+    def stop(self) -> None:
+        """Остановка: потоки завершают текущие задания и выходят."""
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._wakeup.notify()
+        for _ in range(self.workers):
+            # задание остановки обгоняет ожидающие в очереди задания
+            self._ready.put((-1, datetime.datetime.min, next(self._counter),
+                             None))
@@ -16,15 +16,15 @@ def get_user_password():
     return user, password
 
 
-def send_mail(receivers, rep_info, logger: logging.Logger):
-    """Отправка почтового сообщения."""
+def get_from_email(user_name: str) -> str:
+    """Адрес отправителя писем."""
+    return user_name + '@' + os.environ.get("DOMAIN")
+
+
+def make_message(receivers: str, rep_info, from_email: str) -> EmailMessage:
+    """Письмо со списком загруженных отчетов."""
     msg = EmailMessage()
     msg['Subject'] = 'py_ats: Отчеты АТС'
-    domain = os.environ.get("DOMAIN")
-    smtp_server = os.environ.get("SMTP_SERVER")
-
-    user_name, password = get_user_password()
-    from_email = user_name + '@' + domain
     mail_list = receivers.split(';')
 
     msg['From'] = from_email
@@ -59,9 +59,20 @@ def send_mail(receivers, rep_info, logger: logging.Logger):
     message_text = message_text_teplate.format(rows=rows)
 
     msg.add_alternative(message_text, subtype='html')
+    return msg
+
+
+def send_mail(receivers, rep_info, logger: logging.Logger):
+    """Отправка почтового сообщения."""
+    smtp_server = os.environ.get("SMTP_SERVER")
+    smtp_port = int(os.environ.get("SMTP_PORT", '25'))
+
+    user_name, password = get_user_password()
+    from_email = get_from_email(user_name)
+    msg = make_message(receivers, rep_info, from_email)
 
     try:
-        with smtplib.SMTP(smtp_server, 25) as server:
+        with smtplib.SMTP(smtp_server, smtp_port) as server:
             server.login(from_email, password)
             server.send_message(msg)
             print("Successfully sent email")
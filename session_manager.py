@@ -0,0 +1,114 @@
+"""Общий пул соединений и сохранение авторизации участников между запусками."""
+import json
+import logging
+import threading
+import time
+from typing import Optional
+
+import keyring
+import requests
+
+# Имя сервиса keyring, под которым хранятся куки авторизации участников
+COOKIES_SERVICE = 'py_ats_cookies'
+
+
+class SessionManager():
+    """Менеджер сессий сайта АТС.
+
+    Все сессии используют один HTTPAdapter, поэтому соединения (в том числе
+    TLS) с сайтом не закрываются при переходе к следующему участнику.
+    Куки авторизации участников сохраняются в keyring и используются
+    в следующих запусках, пока сервер их принимает.
+    """
+
+    def __init__(self, logger: logging.Logger, pool_size: int = 10,
+                 store_cookies: bool = True):
+        self.logger = logger
+        self.store_cookies = store_cookies
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size
+        )
+        self._lock = threading.Lock()
+
+    def create_session(self) -> requests.Session:
+        """Создание сессии на общем пуле соединений."""
+        session = requests.Session()
+        session.mount('http://', self.adapter)
+        session.mount('https://', self.adapter)
+        return session
+
+    def restore_cookies(self, part_code: str,
+                        session: requests.Session) -> bool:
+        """Загрузка сохраненных кук участника в сессию.
+
+        Возвращает True, если найдены непросроченные куки.
+        """
+        if not self.store_cookies:
+            return False
+        try:
+            with self._lock:
+                data = keyring.get_password(COOKIES_SERVICE, part_code)
+        except Exception as err:
+            self.logger.warning(
+                f'Error reading cookies for participant {part_code}: {err}'
+            )
+            return False
+        if not data:
+            return False
+
+        try:
+            cookies = json.loads(data)
+        except ValueError:
+            return False
+        now = time.time()
+        restored = 0
+        for cookie in cookies:
+            if cookie['expires'] is not None and cookie['expires'] < now:
+                continue
+            session.cookies.set(
+                cookie['name'],
+                cookie['value'],
+                domain=cookie['domain'],
+                path=cookie['path'],
+                expires=cookie['expires'],
+                secure=cookie['secure']
+            )
+            restored += 1
+        return restored > 0
+
+    def save_cookies(self, part_code: str,
+                     session: Optional[requests.Session]) -> None:
+        """Сохранение кук авторизации участника."""
+        if not self.store_cookies or session is None:
+            return
+        cookies = [
+            {'name': cookie.name,
+             'value': cookie.value,
+             'domain': cookie.domain,
+             'path': cookie.path,
+             'expires': cookie.expires,
+             'secure': cookie.secure}
+            for cookie in session.cookies
+        ]
+        try:
+            with self._lock:
+                keyring.set_password(COOKIES_SERVICE, part_code,
+                                     json.dumps(cookies))
+        except Exception as err:
+            self.logger.warning(
+                f'Error saving cookies for participant {part_code}: {err}'
+            )
+
+    def forget_cookies(self, part_code: str) -> None:
+        """Удаление сохраненных кук участника."""
+        if not self.store_cookies:
+            return
+        try:
+            with self._lock:
+                keyring.delete_password(COOKIES_SERVICE, part_code)
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        self.adapter.close()
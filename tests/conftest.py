@@ -0,0 +1,5 @@
+"""Модули программы лежат в корне репозитория."""
+import sys
+from os.path import dirname, join
+
+sys.path.insert(0, join(dirname(__file__), '..'))
@@ -0,0 +1,34 @@
+import logging
+
+import pytest
+
+from circuit_breaker import CircuitBreaker
+from exceptions import CircuitOpenError
+
+URL = 'https://www.atsenergo.ru/nreport'
+
+
+def open_circuit():
+    breaker = CircuitBreaker(logging.getLogger('test'), min_requests=2,
+                             open_time=0, max_wait=0.05)
+    breaker.record(URL, True)
+    breaker.record(URL, True)
+    # пробный запрос
+    breaker.acquire(URL)
+    return breaker
+
+
+def test_probe_without_response_keeps_circuit_open():
+    breaker = open_circuit()
+    # исключение без вида временной ошибки (например, SSLError)
+    breaker.record(URL, False, responded=False)
+    breaker.acquire(URL)  # новый пробный запрос
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire(URL)
+
+
+def test_probe_response_closes_circuit():
+    breaker = open_circuit()
+    breaker.record(URL, False)
+    breaker.acquire(URL)
+    breaker.acquire(URL)
@@ -0,0 +1,30 @@
+import atexit
+import io
+import json
+import logging
+
+from log_pipeline import JsonLinesFormatter, start_queue_logging
+
+
+def test_exception_through_queue():
+    json_stream = io.StringIO()
+    json_handler = logging.StreamHandler(json_stream)
+    json_handler.setFormatter(JsonLinesFormatter())
+    text_stream = io.StringIO()
+    text_handler = logging.StreamHandler(text_stream)
+    text_handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+    logger = logging.getLogger('test_log_pipeline')
+    logger.propagate = False
+    listener = start_queue_logging(logger, json_handler, text_handler)
+    try:
+        raise ValueError('bad page')
+    except ValueError:
+        logger.error('Error loading %s', 'page', exc_info=True)
+    listener.stop()
+    atexit.unregister(listener.stop)
+
+    data = json.loads(json_stream.getvalue())
+    assert data['message'] == 'Error loading page'
+    assert 'ValueError: bad page' in data['exception']
+    text = text_stream.getvalue()
+    assert text.startswith('ERROR: Error loading page\nTraceback')
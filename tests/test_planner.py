@@ -0,0 +1,56 @@
+import datetime
+
+from engine import DownloadUnit
+from manifest import Manifest
+from planner import advance_watermark
+from publication import PublicationPolicy, get_confirmed_empty_units
+
+START = datetime.date(2026, 9, 1)
+
+
+def make_units(days):
+    return [DownloadUnit('PART', 'sdd_daily', 'eur',
+                         START + datetime.timedelta(days=day), report=None)
+            for day in range(days)]
+
+
+def get_watermark(manifest, units, recheck_from, policy=PublicationPolicy()):
+    empty_units = get_confirmed_empty_units(
+        manifest.empty_pages(units[0].date, units[-1].date), policy,
+        recheck_from
+    )
+    return advance_watermark(
+        None, units, manifest.complete_units(units[0].date, units[-1].date),
+        empty_units
+    )
+
+
+def test_watermark_passes_empty_date(tmp_path):
+    manifest = Manifest(str(tmp_path / 'py_ats.db'))
+    units = make_units(5)
+    for unit in units:
+        if unit.date.day == 3:
+            manifest.record_empty(unit)
+        else:
+            manifest.mark_complete(unit, 1)
+
+    recheck_from = START + datetime.timedelta(days=10)
+    assert get_watermark(manifest, units, recheck_from) == units[-1].date
+    manifest.close()
+
+
+def test_watermark_stops_at_recent_empty_date(tmp_path):
+    manifest = Manifest(str(tmp_path / 'py_ats.db'))
+    units = make_units(5)
+    for unit in units:
+        if unit.date.day == 3:
+            manifest.record_empty(unit)
+        else:
+            manifest.mark_complete(unit, 1)
+
+    # Дата в периоде перепроверки, пустая меньше max_misses раз
+    assert get_watermark(manifest, units, START) == units[1].date
+    # Пустая max_misses раз подряд
+    policy = PublicationPolicy(max_misses=1)
+    assert get_watermark(manifest, units, START, policy) == units[-1].date
+    manifest.close()
@@ -0,0 +1,177 @@
+"""Распаковка архивов отчетов в фоновых потоках."""
+import logging
+import os
+import threading
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from os.path import basename, join, normpath
+from typing import Callable, List, Optional, Tuple
+
+from blob_store import BlobStore, write_temp
+from dir_index import DirIndex
+from metrics import UNPACK, RunMetrics
+
+
+# Обработчик записанного файла: полное имя, размер и SHA-256
+FileCallback = Callable[[str, int, str], None]
+
+
+def save_file(fileobj, file_name: str) -> str:
+    """Атомарная запись файлового объекта на диск.
+
+    Возвращает SHA-256 записанного содержимого.
+    """
+    hashing = write_temp(os.path.dirname(file_name), fileobj)
+    try:
+        os.replace(hashing.name, file_name)
+    except Exception:
+        if os.path.exists(hashing.name):
+            os.remove(hashing.name)
+        raise
+    return hashing.hexdigest()
+
+
+def extract_members(z: zipfile.ZipFile, dest_dir: str,
+                    blob_store: Optional[BlobStore] = None
+                    ) -> List[Tuple[str, int, str]]:
+    """Распаковка архива с подсчетом SHA-256 файлов по мере распаковки.
+
+    Если задано хранилище blob_store, файлы сохраняются в нем, а в dest_dir
+    создаются ссылки на них. Возвращает полные имена, размеры и SHA-256
+    распакованных файлов.
+    """
+    files = []
+    root = normpath(dest_dir)
+    for info in z.infolist():
+        file_name = normpath(join(root, info.filename))
+        if os.path.commonpath([root, file_name]) != root:
+            raise zipfile.BadZipFile(f'Unsafe file name {info.filename}')
+        if info.is_dir():
+            os.makedirs(file_name, exist_ok=True)
+            continue
+        if blob_store is not None:
+            sha256 = blob_store.add_member(z, info, file_name)
+        else:
+            os.makedirs(os.path.dirname(file_name), exist_ok=True)
+            with z.open(info) as member:
+                sha256 = save_file(member, file_name)
+        files.append((file_name, info.file_size, sha256))
+    return files
+
+
+def unpack_archive(dest_dir, archive, logger, file_name,
+                   dir_index: Optional[DirIndex] = None,
+                   blob_store: Optional[BlobStore] = None,
+                   on_file: Optional[FileCallback] = None) -> bool:
+    """Распаковка архива в нужную директорию.
+
+    archive - файловый объект с архивом, file_name - полное имя, под которым
+    архив сохранялся бы в dest_dir. Если файл не является архивом, он
+    сохраняется на диск как есть. Записанные файлы учитываются в индексе
+    dir_index и передаются в on_file. Если задано хранилище blob_store,
+    файлы архива сохраняются в нем, а в dest_dir создаются ссылки на них.
+    Возвращает True, если содержимое файла записано в dest_dir.
+    """
+    try:
+        try:
+            with zipfile.ZipFile(archive) as z:
+                files = extract_members(z, dest_dir, blob_store)
+        except zipfile.BadZipFile:
+            logger.error(
+                (f'Bad zip file. Error with unpacking '
+                 f'{basename(file_name)}')
+            )
+            print(f'Invalid file {file_name}')
+            archive.seek(0)
+            sha256 = save_file(archive, file_name)
+            files = [(file_name, os.path.getsize(file_name), sha256)]
+        for name, size, sha256 in files:
+            if dir_index is not None:
+                dir_index.add(name)
+            if on_file is not None:
+                on_file(name, size, sha256)
+        return True
+    except IOError:
+        logger.error(f"IOError with inpacking file {file_name}")
+    except Exception as err:
+        logger.error(f"Unknown error with inpacking file {file_name}: {err}")
+    finally:
+        archive.close()
+    return False
+
+
+class Unpacker():
+    """Пул потоков распаковки архивов.
+
+    Загрузка следующего файла идет параллельно с распаковкой предыдущего.
+    Число ожидающих распаковки архивов ограничено max_pending, чтобы
+    скачанные, но еще не распакованные архивы не занимали всю память.
+    """
+
+    def __init__(self, logger: logging.Logger, workers: int = 2,
+                 max_pending: int = 8, dir_index: Optional[DirIndex] = None,
+                 metrics: Optional[RunMetrics] = None,
+                 blob_store: Optional[BlobStore] = None):
+        self.logger = logger
+        self.dir_index = dir_index
+        self.blob_store = blob_store
+        self.metrics = metrics
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1),
+                                           thread_name_prefix='py_ats_unpack')
+        self._pending = threading.BoundedSemaphore(max(max_pending, 1))
+
+    def submit(self, dest_dir: str, archive, file_name: str,
+               on_file: Optional[FileCallback] = None) -> Future:
+        """Постановка архива в очередь на распаковку.
+
+        В on_file передается каждый записанный файл (см. unpack_archive).
+        """
+        self._pending.acquire()
+
+        def run() -> bool:
+            timer = (self.metrics.timer(UNPACK) if self.metrics is not None
+                     else nullcontext())
+            try:
+                with timer:
+                    return unpack_archive(dest_dir, archive, self.logger,
+                                          join(dest_dir, file_name),
+                                          self.dir_index, self.blob_store,
+                                          on_file)
+            finally:
+                self._pending.release()
+
+        try:
+            return self.executor.submit(run)
+        except Exception:
+            self._pending.release()
+            archive.close()
+            raise
+
+    @staticmethod
+    def on_complete(futures: List[Future],
+                    callback: Callable[[bool], None]) -> None:
+        """Вызов callback после распаковки всех архивов из futures.
+
+        В callback передается True, если все архивы распакованы успешно.
+        """
+        if not futures:
+            callback(True)
+            return
+        lock = threading.Lock()
+        state = {'left': len(futures)}
+
+        def done(_):
+            with lock:
+                state['left'] -= 1
+                if state['left'] > 0:
+                    return
+            callback(all(not future.cancelled() and future.result()
+                         for future in futures))
+
+        for future in futures:
+            future.add_done_callback(done)
+
+    def close(self) -> None:
+        """Ожидание завершения распаковки всех архивов."""
+        self.executor.shutdown(wait=True)